@@ -1,5 +1,7 @@
 import numpy as np
 
+from src.curriculum import TaskSpace
+
 def reach_the_cabinet():
 	bddl = """
 (define (problem LIBERO_Kitchen_Tabletop_Manipulation)
@@ -62,7 +64,7 @@ def reach_the_cabinet():
 
 )
 	"""
-	return [bddl.format(open_amount) for open_amount in np.arange(0.2, -0.05, -0.05)]
+	return TaskSpace(bddl, np.arange(0.2, -0.05, -0.05))
 
 
 def partial_open_the_cabinet():
@@ -118,7 +120,7 @@ def partial_open_the_cabinet():
 
 )
 	"""
-	return [bddl.format(open_amount) for open_amount in np.arange(0.1, 1.0, 0.1)]
+	return TaskSpace(bddl, np.arange(0.1, 1.0, 0.1))
 
 
 def open_the_cabinet():
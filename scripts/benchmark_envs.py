@@ -0,0 +1,165 @@
+# add parent path to sys so we can reference src
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copy
+import itertools
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import tyro
+import numpy as np
+
+from libero.libero import get_libero_path
+
+from src.utils import setup_envs
+from src.args import AlgArgs, EnvArgs
+from src.profiling import sum_phase_times, phase_ms_per_step
+
+# maps the benchmarked env class to the (visual_observation, her) flags setup_envs selects it by
+ENV_CLASSES = {
+    "lowdim": (False, False),          # LowDimensionalObsGymEnv
+    "agentview": (True, False),        # AgentViewGymEnv
+    "lowdim_goal": (False, True),      # LowDimensionalObsGymGoalEnv
+    "agentview_goal": (True, True),    # AgentViewGymGoalEnv
+}
+
+
+@dataclass
+class Args(EnvArgs, AlgArgs):
+    """Note: only the env related args in AlgArgs are used in this script"""
+
+    env_classes: List[str] = field(default_factory=lambda: list(ENV_CLASSES.keys()))
+    """env classes to benchmark: lowdim, agentview, lowdim_goal, agentview_goal"""
+    num_envs_sweep: List[int] = field(default_factory=lambda: [1, 8])
+    """numbers of envs to benchmark"""
+    start_methods: List[str] = field(default_factory=lambda: ["forkserver"])
+    """multiprocessing start methods to benchmark (only used when num_envs > 1)"""
+    shaping_rewards: List[bool] = field(default_factory=lambda: [True, False])
+    """shaping reward settings to benchmark (only used by the lowdim env)"""
+    renders: List[bool] = field(default_factory=lambda: [True, False])
+    """camera rendering settings to benchmark (the agentview envs always render)"""
+    num_steps: int = 500
+    """number of vec env steps to time for every configuration"""
+    warmup_steps: int = 10
+    """number of untimed vec env steps before timing"""
+    reset_samples: int = 10
+    """number of vec env resets to time for the reset latency percentiles"""
+    output_path: Optional[str] = None
+    """if passed in, the results are written to this json file in addition to stdout"""
+    seed: Optional[int] = None
+    """random seed for reproducibility"""
+    verbose: Optional[int] = 0
+    """verbosity of outputs, with 0 being least"""
+
+    # Environment specific arguments
+    custom_bddl_path: Optional[str] = None
+    """if passed in, the custom path will be used for bddl file as opposed to libero default files"""
+    bddl_file_name: str = "libero_90/KITCHEN_SCENE6_close_the_microwave.bddl"
+    """file name of the BDDL file"""
+
+
+def iterate_configs(args: Args):
+    seen = set()
+    for env_class, num_envs, start_method, shaping_reward, render in itertools.product(
+        args.env_classes, args.num_envs_sweep, args.start_methods, args.shaping_rewards, args.renders
+    ):
+        visual_observation, her = ENV_CLASSES[env_class]
+        if visual_observation and not render:
+            continue # image observations need the renderer
+        # collapse the settings that do not change anything for this configuration
+        if num_envs == 1:
+            start_method = None
+        if env_class != "lowdim":
+            shaping_reward = None
+        config = dict(env_class=env_class, num_envs=num_envs, start_method=start_method, shaping_reward=shaping_reward, render=render)
+        key = tuple(config.values())
+        if key in seen:
+            continue
+        seen.add(key)
+        yield config
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    return {f"p{q}": float(np.percentile(samples, q)) * 1000.0 for q in (50, 90, 99)}
+
+
+def benchmark(bddl_file: str, args: Args, config: dict) -> dict:
+    run_args = copy.copy(args)
+    run_args.visual_observation, run_args.her = ENV_CLASSES[config["env_class"]]
+    run_args.num_envs = config["num_envs"]
+    run_args.multiprocessing_start_method = config["start_method"]
+    if config["shaping_reward"] is not None:
+        run_args.shaping_reward = config["shaping_reward"]
+        if not run_args.shaping_reward and run_args.sparse_reward <= 0:
+            run_args.sparse_reward = 10.0
+
+    env_args = {"verbose": args.verbose}
+    if not config["render"]:
+        env_args["use_camera_obs"] = False
+
+    envs = setup_envs(bddl_file, run_args, **env_args)
+    if args.seed is not None:
+        envs.seed(args.seed)
+        np.random.seed(args.seed)
+
+    reset_latencies = []
+    for _ in range(args.reset_samples):
+        start = time.perf_counter()
+        envs.reset()
+        reset_latencies.append(time.perf_counter() - start)
+
+    actions = lambda: np.random.uniform(-1, 1, size=(envs.num_envs, *envs.action_space.shape))
+    for _ in range(args.warmup_steps):
+        envs.step(actions())
+
+    phases_before = sum_phase_times(envs.get_attr("phase_times"))
+    step_latencies = []
+    start = time.perf_counter()
+    for _ in range(args.num_steps):
+        action = actions()
+        step_start = time.perf_counter()
+        envs.step(action)
+        step_latencies.append(time.perf_counter() - step_start)
+    elapsed = time.perf_counter() - start
+    phases_after = sum_phase_times(envs.get_attr("phase_times"))
+    envs.close()
+
+    phases = phase_ms_per_step(phases_before, phases_after)
+    vec_step_ms = float(np.mean(step_latencies)) * 1000.0
+    # workers step in parallel, so whatever the vec step takes beyond one worker step is spent on IPC and waiting
+    phases["ipc"] = max(vec_step_ms - phases.get("step", 0.0), 0.0)
+
+    return {
+        **config,
+        "steps_per_sec": args.num_steps * envs.num_envs / elapsed,
+        "vec_step_ms": percentiles(step_latencies),
+        "reset_latency_ms": percentiles(reset_latencies),
+        "phase_ms_per_step": phases,
+    }
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+
+    if args.custom_bddl_path is not None:
+        bddl_file = args.custom_bddl_path
+    else:
+        bddl_file = os.path.join(get_libero_path("bddl_files"), args.bddl_file_name)
+
+    results = []
+    for config in iterate_configs(args):
+        print(f"Benchmarking {config}")
+        result = benchmark(bddl_file, args, config)
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output_path is not None:
+        if os.path.dirname(args.output_path) and not os.path.exists(os.path.dirname(args.output_path)):
+            os.makedirs(os.path.dirname(args.output_path))
+        with open(args.output_path, "w") as f:
+            json.dump({"bddl_file": bddl_file, "results": results}, f, indent=2)
+        print(f"Wrote results to {args.output_path}")
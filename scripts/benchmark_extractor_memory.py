@@ -0,0 +1,118 @@
+# add parent path to sys so we can reference src
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import tyro
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from torch.profiler import profile, ProfilerActivity
+
+from stable_baselines3.common.preprocessing import preprocess_obs
+
+from src.networks import CustomCombinedExtractor2, CustomCombinedPatchExtractor
+
+EXTRACTORS = {
+    "patch": CustomCombinedPatchExtractor,
+    "combined2": CustomCombinedExtractor2,
+}
+
+
+@dataclass
+class Args:
+    extractors: List[str] = field(default_factory=lambda: list(EXTRACTORS.keys()))
+    """extractors to benchmark: patch, combined2"""
+    batch_size: int = 256
+    """batch size of the sampled observations"""
+    image_size: int = 128
+    """height and width of the agentview images"""
+    goal_dim: int = 1
+    """size of the desired goal"""
+    num_iters: int = 20
+    """number of timed forward passes per mode"""
+    seed: int = 0
+    """random seed for reproducibility"""
+
+
+def make_batch(args: Args, channels_last: bool):
+    """a batch as the replay buffer returns it: uint8 images (HWC for channels_last, otherwise CHW) and float goals"""
+    shape = (args.batch_size, args.image_size, args.image_size, 3) if channels_last else (args.batch_size, 3, args.image_size, args.image_size)
+    return {
+        "observation": th.randint(0, 256, shape, dtype=th.uint8),
+        "desired_goal": th.randn(args.batch_size, args.goal_dim),
+    }
+
+
+def observation_space(args: Args, channels_last: bool) -> spaces.Dict:
+    shape = (args.image_size, args.image_size, 3) if channels_last else (3, args.image_size, args.image_size)
+    return spaces.Dict({
+        "observation": spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8),
+        "desired_goal": spaces.Box(low=-np.inf, high=np.inf, shape=(args.goal_dim,), dtype=np.float32),
+    })
+
+
+def allocated_mb(prof) -> float:
+    """total CPU memory allocated by all ops, freed memory is not subtracted"""
+    return sum(max(event.self_cpu_memory_usage, 0) for event in prof.key_averages()) / 2**20
+
+
+def benchmark_mode(extractor, batch, forward, num_iters: int) -> dict:
+    with th.no_grad():
+        forward(extractor, batch) # warmup
+        snapshot = {key: value.clone() for key, value in batch.items()}
+        with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+            forward(extractor, batch)
+        start = time.perf_counter()
+        for _ in range(num_iters):
+            forward(extractor, batch)
+        elapsed = time.perf_counter() - start
+    return {
+        "allocated_mb": allocated_mb(prof),
+        "forward_ms": elapsed / num_iters * 1000.0,
+        "batch_unchanged": all(th.equal(snapshot[key], batch[key]) for key in batch),
+    }
+
+
+def copied_forward(extractor, batch):
+    # what callers had to do while the extractors wrote into the observation dict
+    batch = {key: value.clone() for key, value in batch.items()}
+    return extractor(preprocess_obs(batch, extractor._observation_space, normalize_images=True))
+
+
+def preprocessed_forward(extractor, batch):
+    # the default SB3 path: preprocess_obs makes a normalized float copy of the images
+    return extractor(preprocess_obs(batch, extractor._observation_space, normalize_images=True))
+
+
+def zero_copy_forward(extractor, batch):
+    # channels_last: the raw uint8 batch goes straight into the extractor
+    return extractor(batch)
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    th.manual_seed(args.seed)
+
+    results = []
+    for name in args.extractors:
+        for mode, forward, channels_last in [
+            ("copy + preprocess", copied_forward, False),
+            ("preprocess", preprocessed_forward, False),
+            ("zero copy channels_last", zero_copy_forward, True),
+        ]:
+            extractor = EXTRACTORS[name](observation_space(args, channels_last), channels_last=channels_last).eval()
+            result = {"extractor": name, "mode": mode, **benchmark_mode(extractor, make_batch(args, channels_last), forward, args.num_iters)}
+            print(json.dumps(result))
+            results.append(result)
+
+    batch_mb = args.batch_size * 3 * args.image_size**2 / 2**20
+    print(f"\nuint8 image batch: {batch_mb:.1f} MB, float32 copy: {4 * batch_mb:.1f} MB")
+    print(f"{'extractor':>10}  {'mode':>24}  {'allocated MB':>12}  {'forward ms':>10}  batch unchanged")
+    for result in results:
+        print(f"{result['extractor']:>10}  {result['mode']:>24}  {result['allocated_mb']:>12.1f}  {result['forward_ms']:>10.2f}  {result['batch_unchanged']}")
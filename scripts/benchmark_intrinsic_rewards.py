@@ -0,0 +1,113 @@
+# add parent path to sys so we can reference src
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import tyro
+import numpy as np
+import torch as th
+
+from libero.libero import get_libero_path
+
+from src.utils import setup_envs
+from src.args import AlgArgs, EnvArgs
+
+
+@dataclass
+class Args(EnvArgs, AlgArgs):
+    """Note: only the env related args in AlgArgs are used in this script"""
+
+    exploration_algs: List[str] = field(default_factory=lambda: ["rnd", "native_rnd", "icm", "native_icm"])
+    """intrinsic reward modules to benchmark, any exploration_alg accepted by AlgArgs"""
+    num_rollouts: int = 20
+    """number of timed rollout-end compute + update calls per module"""
+    warmup_rollouts: int = 2
+    """number of untimed calls before timing"""
+    output_path: Optional[str] = None
+    """if passed in, the results are written to this json file in addition to stdout"""
+    seed: int = 0
+    """random seed for reproducibility"""
+
+    # Environment specific arguments
+    custom_bddl_path: Optional[str] = None
+    """if passed in, the custom path will be used for bddl file as opposed to libero default files"""
+    bddl_file_name: str = "libero_90/KITCHEN_SCENE6_close_the_microwave.bddl"
+    """file name of the BDDL file"""
+
+
+def make_samples(envs, args: Args, device) -> dict:
+    """a rollout of random low dimensional transitions shaped like the PPO rollout buffer, (n_steps, n_envs, ...)"""
+    n_steps, n_envs = args.n_steps, envs.num_envs
+    observations = th.randn(n_steps + 1, n_envs, *envs.observation_space.shape, device=device)
+    dones = th.zeros(n_steps, n_envs, device=device)
+    return dict(
+        observations=observations[:-1],
+        actions=th.rand(n_steps, n_envs, *envs.action_space.shape, device=device) * 2 - 1,
+        rewards=th.zeros(n_steps, n_envs, device=device),
+        terminateds=dones,
+        truncateds=dones,
+        next_observations=observations[1:],
+    )
+
+
+def benchmark_module(irs, samples, args: Args) -> dict:
+    for _ in range(args.warmup_rollouts):
+        irs.compute(samples=samples, sync=True)
+    if irs.device.type == "cuda":
+        th.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.num_rollouts):
+        intrinsic_rewards = irs.compute(samples=samples, sync=True)
+    if irs.device.type == "cuda":
+        th.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return {
+        "rollout_ms": elapsed / args.num_rollouts * 1000.0,
+        "transitions_per_sec": args.num_rollouts * intrinsic_rewards.numel() / elapsed,
+        "reward_dtype": str(intrinsic_rewards.dtype),
+        "mean_reward": intrinsic_rewards.float().mean().item(),
+        "loss": irs.metrics["loss"][-1],
+    }
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    assert not args.visual_observation, "the native intrinsic rewards are for low dimensional observations"
+    th.manual_seed(args.seed)
+    np.random.seed(args.seed)
+
+    if args.custom_bddl_path is not None:
+        bddl_file = args.custom_bddl_path
+    else:
+        bddl_file = os.path.join(get_libero_path("bddl_files"), args.bddl_file_name)
+
+    # the env pool only provides the spaces the modules are built from, the transitions are random
+    envs = setup_envs(bddl_file, args, verbose=0)
+    device = args.get_device()
+    samples = make_samples(envs, args, device)
+
+    results = []
+    for exploration_alg in args.exploration_algs:
+        args.exploration_alg = exploration_alg
+        th.manual_seed(args.seed)
+        irs = args.get_exploration_alg_reward(envs, device)
+        result = {"exploration_alg": exploration_alg, "n_steps": args.n_steps, "num_envs": envs.num_envs, **benchmark_module(irs, samples, args)}
+        print(json.dumps(result))
+        results.append(result)
+    envs.close()
+
+    print(f"\n{'module':>12}  {'rollout ms':>10}  {'transitions/s':>13}  {'dtype':>13}  {'loss':>8}")
+    for result in results:
+        print(f"{result['exploration_alg']:>12}  {result['rollout_ms']:>10.2f}  {result['transitions_per_sec']:>13.0f}  {result['reward_dtype']:>13}  {result['loss']:>8.4f}")
+
+    if args.output_path is not None:
+        if os.path.dirname(args.output_path) and not os.path.exists(os.path.dirname(args.output_path)):
+            os.makedirs(os.path.dirname(args.output_path))
+        with open(args.output_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {args.output_path}")
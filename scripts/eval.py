@@ -1,20 +1,22 @@
 # add parent path to sys
 import os
 import sys
-import random
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import tyro
 import torch
 import numpy as np
-from typing import Optional
+from typing import List, Optional
 import pickle
 
 from libero.libero import get_libero_path
 
 import src.patch
-from src.utils import setup_envs, obs_to_video
+from src.utils import setup_envs
+from src.video import EpisodeVideoWriter
+from src.evaluation import evaluate_policy_vec
+from src.inference import ExportedPolicy
 from src.args import AlgArgs, EnvArgs
 
 @dataclass
@@ -26,10 +28,16 @@ class Args(EnvArgs, AlgArgs):
     """random seed for reproducibility"""
     video_path: str = "video/output.mp4"
     """file path of the video output file"""
-    load_path: str = "logs"
-    """file path of the model file"""
+    video_stride: int = 1
+    """only every video_stride-th frame of an episode is written to the video"""
+    split_episodes: bool = False
+    """if toggled, every episode is written to its own video file next to video_path"""
+    load_path: List[str] = field(default_factory=lambda: ["logs"])
+    """file paths of the model files. Every model is evaluated on the same envs"""
     num_episodes: int = 10
-    """number of episodes to generate evaluation"""
+    """number of episodes to generate evaluation, spread over num_envs envs"""
+    deterministic: bool = False
+    """if toggled, actions are taken deterministically"""
     verbose: Optional[int] = 1
     """verbosity of outputs, with 0 being least"""
 
@@ -40,9 +48,16 @@ class Args(EnvArgs, AlgArgs):
     """file name of the BDDL file"""
 
 
+def checkpoint_output_path(path: str, load_path: str, num_checkpoints: int) -> str:
+    """with multiple checkpoints, every checkpoint gets its own output files named after the checkpoint"""
+    if num_checkpoints == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{os.path.splitext(os.path.basename(load_path))[0]}{ext}"
+
+
 if __name__ == "__main__":
     args = tyro.cli(Args)
-    args.num_envs = 1
     args.shaping_reward = False
 
     if args.custom_bddl_path is not None:
@@ -55,56 +70,54 @@ if __name__ == "__main__":
     print("Setting up environment")
     envs = setup_envs(bddl_file, args, verbose=args.verbose)
 
-    # Seeding everything
-    if args.seed is not None:
-        envs.seed(args.seed)
-        torch.manual_seed(args.seed)
-        np.random.seed(args.seed)
-
-    # start evaluation
-    print("loading model")
-    model = args.alg_class.load(f"{args.load_path}", env=envs if args.her else None)
-
-    obs = envs.reset()
-
-    images = []
-
-    count = 0
-    step_count = 0
-    success = 0
-    total_episodes = 0
-    final_sim_states = []
-    for i in range(args.steps_per_episode*args.num_episodes):
-        action, _states = model.predict(obs)
-        obs, rewards, dones, info = envs.step(action)
-        images.append(info[0]["agentview_image"])
-        step_count += 1
-        
-        if dones[0]:
-            count = 0
-            success += 1 if info[0]["is_success"] else 0
-            total_episodes += 1
-            print(f"episode {total_episodes}/{args.num_episodes}")
-            print(f"{success} successes out of {total_episodes} ({success / total_episodes:.6f})")
-            print(f"average episode length: {step_count / total_episodes:.2f}")
-            if info[0]["is_success"]:
-                final_sim_states.append(info[0]["sim_state"])
-            envs.reset()
-
-        if total_episodes == args.num_episodes:
-            break
-    
-        count += 1
-        
-    print("saving final sim states")
-    with open(args.video_path.replace("mp4", "pkl"), "wb") as f:
-        pickle.dump(final_sim_states, f)
-        
-    print("generating video")
-    obs_to_video(images, f"{args.video_path}")
+    results = {}
+    for load_path in args.load_path:
+        # Seeding everything, for every checkpoint so they are evaluated on the same episodes
+        if args.seed is not None:
+            envs.seed(args.seed)
+            torch.manual_seed(args.seed)
+            np.random.seed(args.seed)
+
+        # start evaluation
+        print(f"loading model {load_path}")
+        model = args.alg_class.load(f"{load_path}", env=envs if args.her else None)
+        policy = ExportedPolicy(model, verbose=args.verbose) if args.compile_policy else model
+
+        video_path = checkpoint_output_path(args.video_path, load_path, len(args.load_path))
+        # frames of the first env are encoded in the background while the episodes run
+        video_writer = EpisodeVideoWriter(video_path, frame_stride=args.video_stride, split_episodes=args.split_episodes)
+        final_sim_states = []
+
+        def record_step(infos, dones, counted):
+            if counted[0]:
+                video_writer.add_frame(infos[0]["agentview_image"])
+                if dones[0]:
+                    video_writer.end_episode()
+            for i in np.flatnonzero(dones & counted):
+                if infos[i]["is_success"]:
+                    final_sim_states.append(infos[i]["sim_state"])
+
+        result = evaluate_policy_vec(
+            policy,
+            envs,
+            args.num_episodes,
+            deterministic=args.deterministic,
+            step_callback=record_step,
+            verbose=args.verbose,
+        )
+        results[load_path] = result
+
+        print("saving final sim states")
+        with open(video_path.replace("mp4", "pkl"), "wb") as f:
+            pickle.dump(final_sim_states, f)
+
+        print("finishing video")
+        video_writer.close()
+        print(f"{load_path}: {result}")
+        del model, policy
 
     print("\nfinal:")
-    print(f"{success} successes out of {total_episodes} ({success / total_episodes:.6f})")
-    print(f"average episode length: {step_count / total_episodes:.2f}")
+    for load_path, result in results.items():
+        print(f"{load_path}: {result}")
 
-    envs.close()
\ No newline at end of file
+    envs.close()
@@ -0,0 +1,184 @@
+# add parent path to sys so we can reference src
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dataclasses
+import glob
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import tyro
+import torch
+import numpy as np
+
+from libero.libero import get_libero_path
+
+import src.patch
+from src.utils import setup_envs
+from src.evaluation import EvalResult, evaluate_policy_vec
+from src.inference import ExportedPolicy
+from src.args import AlgArgs, EnvArgs
+
+
+@dataclass
+class Args(EnvArgs, AlgArgs):
+    """Note: many of the args in AlgArgs aren't actually used in this script"""
+
+    # User specific arguments
+    checkpoint_dir: str = "models"
+    """directory containing the checkpoints to evaluate"""
+    checkpoint_pattern: str = "*_steps.zip"
+    """glob pattern of the checkpoint files inside checkpoint_dir (CheckpointCallback names them <prefix>_<steps>_steps.zip)"""
+    seeds: List[int] = field(default_factory=lambda: [0])
+    """seeds to evaluate every checkpoint with. num_episodes episodes are run per seed"""
+    num_episodes: int = 10
+    """number of episodes per checkpoint and seed, spread over num_envs envs"""
+    deterministic: bool = False
+    """if toggled, actions are taken deterministically"""
+    index_path: Optional[str] = None
+    """json file caching the evaluation results. Defaults to eval_index.json in checkpoint_dir"""
+    output_path: Optional[str] = None
+    """if passed in, the learning curve table is also written to this csv file"""
+    verbose: Optional[int] = 1
+    """verbosity of outputs, with 0 being least"""
+
+    # Environment specific arguments
+    custom_bddl_path: Optional[str] = None
+    """if passed in, the custom path will be used for bddl file as opposed to libero default files"""
+    bddl_file_name: str = "libero_90/KITCHEN_SCENE6_close_the_microwave.bddl"
+    """file name of the BDDL file"""
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def checkpoint_steps(path: str) -> Optional[int]:
+    match = re.search(r"_(\d+)_steps", os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+
+# the EnvArgs and AlgArgs fields that change the evaluated episodes, their rewards or the policy outputs
+PROTOCOL_FIELDS = [
+    "num_envs", "shaping_reward", "sparse_reward", "reward_geoms", "dense_reward_multiplier", "steps_per_episode",
+    "action_repeat", "setup_demo_path", "sim_states_path", "sparse_goal_tracking", "completed_goal_check_freq",
+    "alg", "visual_observation", "her", "truncate", "channels_last", "shared_encoder", "pretrained_encoder_path",
+    "compile_policy",
+]
+
+
+def protocol_hash(args: Args) -> str:
+    protocol = {name: getattr(args, name) for name in PROTOCOL_FIELDS}
+    return hashlib.sha256(json.dumps(protocol, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def index_key(checkpoint_hash: str, bddl_hash: str, args: Args) -> str:
+    """results are only reused if the checkpoint, the task and the evaluation protocol (including the env settings) are all the same"""
+    seeds = ",".join(str(seed) for seed in args.seeds)
+    return f"{checkpoint_hash}:{bddl_hash}:seeds={seeds}:episodes={args.num_episodes}:deterministic={args.deterministic}:env={protocol_hash(args)}"
+
+
+def load_index(index_path: str) -> dict:
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r") as f:
+        return json.load(f)
+
+
+def save_index(index: dict, index_path: str):
+    # write to a temporary file first so an interrupted sweep never leaves a corrupt index behind
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+def evaluate_checkpoint(checkpoint: str, envs, args: Args) -> EvalResult:
+    model = args.alg_class.load(checkpoint, env=envs if args.her else None)
+    policy = ExportedPolicy(model, verbose=args.verbose) if args.compile_policy else model
+    result = EvalResult()
+    for seed in args.seeds:
+        # every checkpoint is evaluated on the same seeded episodes
+        envs.seed(seed)
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        result.extend(evaluate_policy_vec(policy, envs, args.num_episodes, deterministic=args.deterministic, verbose=args.verbose))
+    del model, policy
+    return result
+
+
+def learning_curve_table(rows: List[dict]) -> str:
+    lines = [f"{'steps':>10}  {'success':>8}  {'95% CI':>17}  {'length':>8}  {'episodes':>8}  checkpoint"]
+    for row in rows:
+        low, high = row["success_rate_ci"]
+        steps = row["num_timesteps"] if row["num_timesteps"] is not None else "-"
+        lines.append(
+            f"{steps:>10}  {row['success_rate']:>8.4f}  [{low:.4f}, {high:.4f}]  {row['mean_length']:>8.2f}  {row['num_episodes']:>8}  {row['checkpoint']}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+    args.shaping_reward = False
+
+    if args.custom_bddl_path is not None:
+        bddl_file = args.custom_bddl_path
+    else:
+        bddl_file = os.path.join(get_libero_path("bddl_files"), args.bddl_file_name)
+    index_path = args.index_path if args.index_path is not None else os.path.join(args.checkpoint_dir, "eval_index.json")
+
+    checkpoints = glob.glob(os.path.join(args.checkpoint_dir, args.checkpoint_pattern))
+    checkpoints.sort(key=lambda path: (checkpoint_steps(path) is None, checkpoint_steps(path) or 0, path))
+    print(f"Found {len(checkpoints)} checkpoints in {args.checkpoint_dir}")
+
+    bddl_hash = file_sha256(bddl_file)
+    index = load_index(index_path)
+
+    rows = []
+    envs = None
+    for checkpoint in checkpoints:
+        key = index_key(file_sha256(checkpoint), bddl_hash, args)
+        if key in index:
+            if args.verbose >= 1: print(f"{checkpoint}: cached")
+        else:
+            if envs is None:
+                # the env pool is only created once something actually has to be evaluated
+                print("Setting up environment")
+                envs = setup_envs(bddl_file, args, verbose=args.verbose)
+            print(f"Evaluating {checkpoint}")
+            result = evaluate_checkpoint(checkpoint, envs, args)
+            print(f"{checkpoint}: {result}")
+            index[key] = {
+                "bddl_file": bddl_file,
+                "seeds": args.seeds,
+                **result.summary(),
+                "episodes": dataclasses.asdict(result),
+            }
+            save_index(index, index_path)
+        rows.append({"checkpoint": checkpoint, "num_timesteps": checkpoint_steps(checkpoint), **index[key]})
+
+    if envs is not None:
+        envs.close()
+
+    print("\nLearning curve:")
+    print(learning_curve_table(rows))
+
+    if args.output_path is not None:
+        if os.path.dirname(args.output_path) and not os.path.exists(os.path.dirname(args.output_path)):
+            os.makedirs(os.path.dirname(args.output_path))
+        with open(args.output_path, "w") as f:
+            f.write("num_timesteps,checkpoint,num_episodes,success_rate,success_rate_ci_low,success_rate_ci_high,mean_length,mean_reward\n")
+            for row in rows:
+                low, high = row["success_rate_ci"]
+                steps = row["num_timesteps"] if row["num_timesteps"] is not None else ""
+                f.write(f"{steps},{row['checkpoint']},{row['num_episodes']},{row['success_rate']},{low},{high},{row['mean_length']},{row['mean_reward']}\n")
+        print(f"Wrote learning curve to {args.output_path}")
@@ -3,16 +3,19 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List, Optional
 import tyro
 import torch
 import numpy as np
 
 from libero.libero import get_libero_path
-from stable_baselines3 import PPO, SAC
 
 import src.patch
-from src.utils import setup_envs, obs_to_video
+from src.utils import setup_envs
+from src.video import EpisodeVideoWriter
+from src.evaluation import evaluate_policy_chain, parse_switch_predicate
+from src.inference import ExportedPolicy
 from src.args import AlgArgs, EnvArgs
 
 
@@ -25,12 +28,18 @@ class Args(EnvArgs, AlgArgs):
     """random seed for reproducibility"""
     video_path: str = "videos/output.mp4"
     """file path of the video output file"""
-    load_path_1: str = "logs"
-    """file path of the model file"""
-    load_path_2: str = "logs"
-    """file path of the model file"""
+    video_stride: int = 1
+    """only every video_stride-th frame of an episode is written to the video"""
+    load_paths: List[str] = field(default_factory=lambda: ["logs", "logs"])
+    """file paths of the model files, in the order they are used within an episode"""
+    switch_on: List[str] = field(default_factory=lambda: ["subgoal"])
+    """when to switch from each model to the next, one per pair of models: subgoal, reward>X or never"""
     num_episodes: int = 10
-    """number of episodes to generate evaluation"""
+    """number of episodes to generate evaluation, spread over num_envs envs"""
+    deterministic: bool = False
+    """if toggled, actions are taken deterministically"""
+    verbose: Optional[int] = 1
+    """verbosity of outputs, with 0 being least"""
 
     # Environment specific arguments
     custom_bddl_path: str = None
@@ -41,7 +50,7 @@ class Args(EnvArgs, AlgArgs):
 
 if __name__ == "__main__":
     args = tyro.cli(Args)
-    args.num_envs = 1
+    assert len(args.switch_on) == len(args.load_paths) - 1, "pass one --switch-on predicate per pair of consecutive models"
 
     if args.custom_bddl_path is not None:
         task_name = os.path.basename(args.custom_bddl_path)
@@ -61,46 +70,33 @@ if __name__ == "__main__":
 
     # start evaluation
     print("Loading models")
-    model_1 = args.alg_class.load(f"{args.load_path_1}", env=envs if args.her else None)
-    model_2 = args.alg_class.load(f"{args.load_path_2}", env=envs if args.her else None)
-    
-    # start with model 1
-    model = model_1
-
-    obs = envs.reset()
-    target_qpos = envs.envs[0].env.env.robots[0]._joint_positions
-
-
-    images = []
-
-    print("generating video")
-    count = 0
-    success = 0
-    total_episodes = 0
-    for i in range(args.steps_per_episode*args.num_episodes):
-        action, _states = model.predict(obs)
-        obs, rewards, dones, info = envs.step(action)
-        images.append(info[0]["agentview_image"])
-
-        if rewards[0] > args.sparse_reward / 10.0:
-            print("switching to model 2")
-            model = model_2
-            # reset robot
-            # envs.envs[0].reset_robots_random()
-
-        if dones[0]:
-            count = 0
-            success += 1 if info[0]["is_success"] else 0
-            total_episodes += 1
-            print(total_episodes)
-            envs.reset()
-            model = model_1
-
-        if total_episodes == args.num_episodes:
-            break
-    
-        count += 1
-        
-    obs_to_video(images, f"{args.video_path}")
-    print("# of tasks successful", success, "out of", total_episodes)
+    models = [args.alg_class.load(f"{load_path}", env=envs if args.her else None) for load_path in args.load_paths]
+    if args.compile_policy:
+        models = [ExportedPolicy(model, verbose=args.verbose) for model in models]
+    switch_predicates = [parse_switch_predicate(spec, args.sparse_reward) for spec in args.switch_on]
+
+    # frames of the first env are encoded in the background while the episodes run
+    video_writer = EpisodeVideoWriter(args.video_path, frame_stride=args.video_stride)
+
+    def record_step(infos, dones, counted):
+        if counted[0]:
+            video_writer.add_frame(infos[0]["agentview_image"])
+            if dones[0]:
+                video_writer.end_episode()
+
+    result, stages_reached = evaluate_policy_chain(
+        models,
+        switch_predicates,
+        envs,
+        args.num_episodes,
+        deterministic=args.deterministic,
+        step_callback=record_step,
+        verbose=args.verbose,
+    )
+    video_writer.close()
+
+    print(result)
+    for stage, load_path in enumerate(args.load_paths):
+        reached = np.mean(np.array(stages_reached) >= stage)
+        print(f"episodes reaching policy {stage} ({load_path}): {reached:.4f}")
     envs.close()
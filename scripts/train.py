@@ -11,9 +11,8 @@ import numpy as np
 from typing import Optional
 
 from libero.libero import get_libero_path
-from stable_baselines3.common.callbacks import CheckpointCallback
 
-from src.callbacks import VideoWriter
+from src.callbacks import AsyncCheckpointCallback, TensorboardCallback, VideoWriter, PhaseTimingCallback
 from src.utils import setup_envs, setup_run_at_path, setup_model
 from src.args import WandbArgs, AlgArgs, EnvArgs
 
@@ -30,6 +29,8 @@ class Args(WandbArgs, AlgArgs, EnvArgs):
     """directory path of the models checkpoints"""
     model_path: Optional[str] = None
     """path to existing model if loading a model"""
+    keep_checkpoints: int = 5
+    """number of most recent checkpoints to keep, besides the best one"""
     verbose: Optional[int] = 1
     """verbosity of outputs, with 0 being least"""
 
@@ -90,11 +91,17 @@ if __name__ == "__main__":
     print("Setting up callbacks")
     callbacks = []
 
-    # checkpoint callback
-    callbacks.append(CheckpointCallback(save_freq=log_interval*1024, save_path=save_path, name_prefix="model"))
+    # checkpoint callback, written in the background
+    callbacks.append(AsyncCheckpointCallback(save_freq=log_interval*1024, save_path=save_path, name_prefix="model", keep_last=args.keep_checkpoints))
 
     # log videos
-    callbacks.append(VideoWriter(n_steps=5000 * args.num_envs))
+    callbacks.append(VideoWriter(n_steps=5000 * args.num_envs, save_dir=os.path.join(save_path, "videos")))
+
+    # log where the env step time goes
+    callbacks.append(PhaseTimingCallback(log_freq=1000))
+
+    # log the episode stats shipped by the env workers
+    callbacks.append(TensorboardCallback())
 
     if args.exploration_alg is not None:
         callbacks.append(args.get_exploration_callback(envs))
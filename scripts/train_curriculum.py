@@ -16,13 +16,14 @@ from typing import List, Tuple, Optional
 import copy
 import gc
 
-from stable_baselines3.common.callbacks import CheckpointCallback
 
-from src.callbacks import VideoWriter, StopTrainingOnSuccessRateThreshold
+from src.callbacks import AsyncCheckpointCallback, TensorboardCallback, VideoWriter, StopTrainingOnSuccessRateThreshold, EvalSuccessGateCallback, PhaseTimingCallback, CurriculumSchedulerCallback, RunStateCheckpointCallback, SimStateRecorderCallback
+from src.checkpointing import RunStateCheckpointer, restore_run_state
+from src.curriculum import CurriculumStep, LearningProgressScheduler, load_curriculum
+from src.replay_transfer import TRANSFER_MODES, enable_sim_state_recording, transfer_replay_buffer
 from src.utils import setup_envs, setup_run_at_path, setup_model, get_open_files_count
 from src.args import WandbArgs, AlgArgs, EnvArgs
 
-import inspect
 
 @dataclass
 class Args(WandbArgs, AlgArgs, EnvArgs):
@@ -37,6 +38,8 @@ class Args(WandbArgs, AlgArgs, EnvArgs):
     """directory path of the models checkpoints"""
     model_path: Optional[str] = None
     """path to existing model if loading a model"""
+    keep_checkpoints: int = 5
+    """number of most recent checkpoints to keep over the whole run, besides the best one of each subtask"""
     verbose: Optional[int] = 1
     """verbosity of outputs, with 0 being least"""
 
@@ -46,63 +49,38 @@ class Args(WandbArgs, AlgArgs, EnvArgs):
     """Comma separated list of task names(function names) to ignore when reading the curriculum file"""
     ignore_until: str = ""
     """Skip all tasks until reaching a task with this name (includes the number)"""
+    resume_from: Optional[str] = None
+    """Skip all tasks until reaching this parameter value of a task space, as <task>=<value> (e.g. partial_open_the_cabinet=0.5), or until the task <task>"""
+    verify_all_bddls: bool = False
+    """if toggled, every curriculum step is loaded once before training, otherwise only the first step of each task"""
     success_rate_threshold: float = 0.7
     """success rate to reach before moving on to the next subtask of the curriculum"""
+    eval_freq: int = 10000
+    """timesteps between the deterministic evaluations that decide when to move on to the next subtask. If 0, the success rate of the training episodes is used instead"""
+    eval_num_envs: int = 2
+    """number of envs of the separate vec env used for the evaluations"""
+    eval_episodes: int = 10
+    """number of episodes per evaluation"""
+    eval_async: bool = True
+    """if toggled, evaluations run on a background thread in parallel with training"""
+    concurrent: bool = False
+    """if toggled, the previous, current and next subtasks are trained at once in a single run, with the env workers split between them by learning progress. total_timesteps is then the budget of the whole curriculum instead of each subtask"""
+    reassign_freq: int = 1000
+    """concurrent only: vec env steps between worker reassignments"""
+    min_current_share: float = 0.5
+    """concurrent only: minimum fraction of the env workers that run the current subtask"""
+    resume: Optional[str] = None
+    """save directory of a previous run to resume from its latest run state checkpoint (model, optimizer, replay buffer, RNG states and curriculum position)"""
+    run_state_freq: int = 10000
+    """vec env steps between run state checkpoints. If 0, they are only written at the end of each subtask"""
+    buffer_transfer: str = "keep"
+    """sac only: how the replay buffer carries over to the next subtask. keep: unchanged, relabel: the rewards of the stored transitions are recomputed for the new subtask from their recorded sim states (low-dimensional observations without HER, sparse rewards without shaping rewards, action_repeat 1; the recorded float64 sim states take buffer_size * num_envs * sim state size * 8 bytes, about 1 GB for a 1M buffer), expire: only the newest buffer_keep_last transitions per env are kept"""
+    buffer_keep_last: int = 10000
+    """expire only: number of transitions per env kept for the next subtask"""
     final_task_timesteps: Optional[int] = None
     """The number of timesteps to run the final task. If not set, will equal total_timesteps"""
 
 
-def load_bddls(curriculum_file: str, ignore_until: str = "", ignore_tasks: List[str] = []):
-    assert curriculum_file is not None
-    assert os.path.exists(curriculum_file)
-    with open(curriculum_file, 'r') as f:
-        curriculum_file_str = f.read()
-    
-    namespace = {}
-    exec(curriculum_file_str, namespace)
-
-    bddls: List[Tuple[str, str]] = []
-    for k, func in namespace.items():
-        if not inspect.isfunction(func) or inspect.isbuiltin(func): # ignore non-functions and builtins
-            # print(f"skipping {k} because it is builtin or is not a function")
-            continue
-        if k.startswith("__") and k.endswith("__"): # ignore functions named __name__
-            # print(f"skipping {k} because it is in the format __name__")
-            continue
-        if k in ignore_tasks: 
-            print(f"skipping {k} in ignore_tasks")
-            continue
-        if ignore_until != "" and not ignore_until.startswith(k):
-            print(f"skipping {k} until ignore_until")
-            continue
-        if len(inspect.signature(func).parameters) == 0:
-            bddl = func()
-            if type(bddl) is str:
-                bddl_name = func.__name__
-                if bddl_name == ignore_until:
-                    ignore_until = ""
-                bddls.append((bddl_name, bddl))
-                print(f"Added single task '{bddl_name}'")
-            elif type(bddl) is list:
-                count = 0
-                for i, s in enumerate(bddl):
-                    assert type(s) is str
-                    bddl_name = f"{func.__name__}_{i}"
-                    if ignore_until != "": # ignore until this if we're skipping tasks
-                        if bddl_name != ignore_until: 
-                            print(f"skipping {bddl_name} until ignore_until")
-                            continue
-                        else:
-                            ignore_until = ""
-                    bddls.append((f"{func.__name__}_{i}", s))
-                    count += 1
-                print(f"Added task space '{func.__name__}' with {count} steps")
-    # for k, bddl in bddls:
-    #     print(k)
-    #     print(bddl)
-    return bddls
-
-
 def create_envs(bddl_str: str, args: Args, tmp_dir = "."):
     bddl_path = os.path.join(tmp_dir, f"tmp_bddl_{START_TIME_STR}.bddl")
     if not os.path.exists(tmp_dir):
@@ -116,40 +94,137 @@ def create_envs(bddl_str: str, args: Args, tmp_dir = "."):
     return envs
 
 
-if __name__ == "__main__":
-    args = tyro.cli(Args)
+def train_concurrent(model, steps: List[CurriculumStep], args: Args, save_path: str, models_path: str, checkpoints_path: str, tensorboard_path: str, tmp_dir: str, log_interval: int):
+    """
+    trains all subtasks in one learn call on a single pool of switchable envs, with a LearningProgressScheduler
+    deciding which subtask each worker runs
+    """
+    if not os.path.exists(tmp_dir):
+        os.makedirs(tmp_dir)
+    bddl_files = {}
+    def task_bddl_file(task_index: int) -> str:
+        # rendered and written when a worker is first moved to the task, and kept since workers may recreate the task env later
+        if task_index not in bddl_files:
+            bddl_files[task_index] = os.path.join(tmp_dir, f"tmp_bddl_{START_TIME_STR}_{task_index}.bddl")
+            with open(bddl_files[task_index], 'w') as f:
+                f.write(steps[task_index].bddl)
+        return bddl_files[task_index]
+
+    envs = setup_envs(task_bddl_file(0), args, task_switching=True, verbose=args.verbose)
+    if args.seed is not None:
+        envs.seed(args.seed)
+    model.set_env(envs)
+
+    scheduler = LearningProgressScheduler(
+        len(steps),
+        envs.num_envs,
+        success_rate_threshold=args.success_rate_threshold,
+        min_current_share=args.min_current_share,
+    )
+
+    callbacks = []
+
+    # checkpoint callback, written in the background
+    callbacks.append(AsyncCheckpointCallback(save_freq=log_interval*32, save_path=checkpoints_path, name_prefix="model", keep_last=args.keep_checkpoints))
 
+    # log videos
+    callbacks.append(VideoWriter(n_steps=5000 * args.num_envs, save_dir=os.path.join(save_path, "videos")))
 
-    print("Loading bddls")
-    bddls = load_bddls(args.curriculum_file, args.ignore_until, [t.strip() for t in args.ignore_tasks.split(',')])
-    assert len(bddls) > 0
+    # log where the env step time goes
+    callbacks.append(PhaseTimingCallback(log_freq=1000))
 
+    # log the episode stats shipped by the env workers
+    callbacks.append(TensorboardCallback())
 
-    print("Creating save directory")
-    task_name = os.path.splitext(os.path.basename(args.curriculum_file))[0]
-    run_name, save_path = setup_run_at_path(
-        args.save_path,
-        task_name,
-        f"{args.get_alg_str()}_seed_{args.seed}",
-        START_TIME_STR
+    # move workers between subtasks
+    callbacks.append(CurriculumSchedulerCallback(
+        scheduler,
+        task_bddl_file,
+        reassign_freq=args.reassign_freq,
+        final_task_timesteps=args.final_task_timesteps,
+        verbose=args.verbose,
+    ))
+
+    # exploration technique callbacks
+    if args.exploration_alg is not None:
+        callbacks.append(args.get_exploration_callback(envs))
+
+    model.learn(
+        total_timesteps=args.total_timesteps, # for the whole curriculum, unlike the per-subtask budget of sequential training
+        tb_log_name="concurrent",
+        log_interval=log_interval,
+        callback=callbacks,
+        reset_num_timesteps=False,
+        progress_bar=False
     )
+    print(f"Finished concurrent training on subtask {scheduler.current_task+1}/{len(steps)} ({steps[scheduler.current_task].name})")
+
+    if args.wandb: # save tensorboard files to wandb
+        wandb.save(os.path.join(tensorboard_path, "*", "*"), base_path=tensorboard_path, policy='now')
+    model.save(os.path.join(models_path, "concurrent"))
+    if args.wandb: # save models to wandb
+        wandb.save(os.path.join(models_path, "concurrent.zip"), base_path=save_path, policy='now')
+
+    envs.close()
+    for bddl_file in bddl_files.values():
+        os.remove(bddl_file)
+
+
+if __name__ == "__main__":
+    args = tyro.cli(Args)
+
+
+    print("Loading curriculum")
+    steps = load_curriculum(args.curriculum_file, args.ignore_until, [t.strip() for t in args.ignore_tasks.split(',')], args.resume_from)
+    assert len(steps) > 0
+
+
+    assert args.resume is None or not args.concurrent, "resuming is only supported for sequential curricula"
+    assert args.buffer_transfer in TRANSFER_MODES, f"buffer_transfer must be one of {TRANSFER_MODES}"
+    assert args.buffer_transfer == "keep" or (args.alg == "sac" and not args.her and not args.concurrent), \
+        "replay buffer transfer is only supported for sequential SAC curricula without HER"
+    assert args.buffer_transfer != "relabel" or not args.visual_observation, "relabeling needs the low-dimensional env"
+    # relabeled rewards leave out the dense shaping terms, fresh transitions would be on a different reward scale
+    assert args.buffer_transfer != "relabel" or not args.shaping_reward, "relabeling needs sparse rewards only, turn off shaping_reward"
+    # stored rewards of repeated actions are summed over the substeps, relabeling only sees the end state
+    assert args.buffer_transfer != "relabel" or args.action_repeat == 1, "relabeling needs action_repeat 1"
+    if args.resume is not None:
+        # keep writing into the directory of the resumed run
+        save_path = args.resume
+        run_name = os.path.relpath(save_path, args.save_path)
+    else:
+        print("Creating save directory")
+        task_name = os.path.splitext(os.path.basename(args.curriculum_file))[0]
+        run_name, save_path = setup_run_at_path(
+            args.save_path,
+            task_name,
+            f"{args.get_alg_str()}_seed_{args.seed}",
+            START_TIME_STR
+        )
     tensorboard_path = os.path.join(save_path, "tensorboard")
     models_path = os.path.join(save_path, "models")
     checkpoints_path = os.path.join(save_path, "checkpoints")
+    run_state_path = os.path.join(save_path, "run_state")
     tmp_path = os.path.join(save_path, "tmp")
 
 
+    eval_args = copy.copy(args)
+    eval_args.num_envs = args.eval_num_envs
+
+
     print("Verifying bddls")
     verify_args = copy.copy(args)
     verify_args.num_envs = 1
-    for i, (subtask_name, bddl) in enumerate(bddls):
+    for i, step in enumerate(steps):
+        if not args.verify_all_bddls and i > 0 and step.task_name == steps[i-1].task_name:
+            continue
         try:
-            envs = create_envs(bddl, verify_args, tmp_dir=tmp_path)
+            envs = create_envs(step.bddl, verify_args, tmp_dir=tmp_path)
             envs.reset()
             envs.step(np.array([envs.action_space.sample()]))
             envs.close()
         except Exception as e:
-            print(f"Exception in bddl {i} '{subtask_name}'")
+            print(f"Exception in bddl {i} '{step.name}'")
             raise e
 
 
@@ -162,7 +237,7 @@ if __name__ == "__main__":
 
 
     # Create temporary env using first bddl for the model to use in initialization
-    envs = create_envs(bddls[0][1], args, tmp_dir=tmp_path)
+    envs = create_envs(steps[0].bddl, args, tmp_dir=tmp_path)
 
 
     # Seeding everything
@@ -176,72 +251,148 @@ if __name__ == "__main__":
     model = setup_model(args, envs, args.seed, save_path, tensorboard_path, args.model_path)
     log_interval = 1 if args.alg == "ppo" else 2
     # device = args.get_device()
+    if args.buffer_transfer == "relabel":
+        # before restoring a run state, so the recorded sim states are restored with the buffer
+        enable_sim_state_recording(model.replay_buffer, envs.get_attr("sim_state_dim", indices=[0])[0])
 
 
     envs.close()
     del envs
-    print("Start training")
-    for i, (subtask_name, bddl) in enumerate(bddls):
-        print(f"Starting subtask {i+1}/{len(bddls)} ({subtask_name}) at step {model.num_timesteps}")
-        print("Open files before subtask:", get_open_files_count())
-        is_final_task = i == len(bddls)-1
-
-        envs = create_envs(bddl, args, tmp_dir=tmp_path)
-        print("Open files after create_envs:", get_open_files_count())
-        if args.seed is not None:
-            envs.seed(args.seed)
-        model.set_env(envs)
 
+    # timesteps trained on each subtask, and where to continue when resuming
+    subtask_timesteps = {}
+    start_index = 0
+    if args.resume is not None:
+        resume_state = restore_run_state(model, run_state_path, verbose=args.verbose)
+        subtask_timesteps = resume_state["subtask_timesteps"]
+        if resume_state["subtask_name"] is None:
+            start_index = len(steps)
+        else:
+            start_index = next((i for i, step in enumerate(steps) if step.name == resume_state["subtask_name"]), None)
+            assert start_index is not None, f"subtask {resume_state['subtask_name']} of the resumed run is not in the curriculum"
+        print(f"Resuming at subtask {start_index+1}/{len(steps)} after {subtask_timesteps.get(resume_state['subtask_name'], 0)} of its timesteps")
+    checkpointer = RunStateCheckpointer(run_state_path, verbose=args.verbose)
 
-        callbacks = []
-
-        # checkpoint callback
-        callbacks.append(CheckpointCallback(save_freq=log_interval*32, save_path=checkpoints_path, name_prefix="model"))
-
-        # log videos
-        callbacks.append(VideoWriter(n_steps=5000 * args.num_envs))
-
-        # Stop training when the model reaches the success rate threshold
-        if not is_final_task: # on the last subtask, train all the way to the end
-            callbacks.append(StopTrainingOnSuccessRateThreshold(
-                threshold=args.success_rate_threshold, 
-                min_count=log_interval*args.num_envs,
-            ))
-
-        # exploration technique callbacks
-        if args.exploration_alg is not None:
-            callbacks.append(args.get_exploration_callback(envs))
+    print("Start training")
+    if args.concurrent:
+        train_concurrent(model, steps, args, save_path, models_path, checkpoints_path, tensorboard_path, tmp_path, log_interval)
+    else:
+        for i, step in enumerate(steps):
+            if i < start_index:
+                continue
+            subtask_name = step.name
+            is_resumed_subtask = args.resume is not None and i == start_index
+            subtask_start = model.num_timesteps - subtask_timesteps.get(subtask_name, 0)
+            bddl = step.bddl # only rendered once the subtask is scheduled
+            print(f"Starting subtask {i+1}/{len(steps)} ({subtask_name}) at step {model.num_timesteps}")
+            print("Open files before subtask:", get_open_files_count())
+            is_final_task = i == len(steps)-1
+
+            envs = create_envs(bddl, args, tmp_dir=tmp_path)
+            print("Open files after create_envs:", get_open_files_count())
+            if args.seed is not None:
+                envs.seed(args.seed)
+            model.set_env(envs)
+
+            # carry the replay buffer of the previous subtask over, unless this subtask already started before resuming
+            if args.buffer_transfer != "keep" and i > 0 and model.num_timesteps == subtask_start:
+                if transfer_replay_buffer(model.replay_buffer, envs, args.buffer_transfer, args.buffer_keep_last, verbose=args.verbose):
+                    checkpointer.invalidate_buffer()
+
+
+            callbacks = []
+
+            # checkpoint callback, written in the background
+            # the last keep_checkpoints are kept over the whole run, the best one per subtask
+            callbacks.append(AsyncCheckpointCallback(save_freq=log_interval*32, save_path=checkpoints_path, name_prefix="model", keep_last=args.keep_checkpoints, best_prefix=f"{i}_{subtask_name}"))
+
+            # log videos
+            callbacks.append(VideoWriter(n_steps=5000 * args.num_envs, save_dir=os.path.join(save_path, "videos")))
+
+            # log where the env step time goes
+            callbacks.append(PhaseTimingCallback(log_freq=1000))
+
+            # log the episode stats shipped by the env workers
+            callbacks.append(TensorboardCallback())
+
+            # resumable run state, including the replay buffer and the curriculum position
+            if args.run_state_freq > 0:
+                callbacks.append(RunStateCheckpointCallback(
+                    checkpointer,
+                    save_freq=args.run_state_freq,
+                    extra_state=lambda: {
+                        "subtask_name": subtask_name,
+                        "subtask_timesteps": {**subtask_timesteps, subtask_name: model.num_timesteps - subtask_start},
+                    },
+                ))
+
+            # record the sim states the stored transitions can be relabeled from
+            if args.buffer_transfer == "relabel":
+                callbacks.append(SimStateRecorderCallback())
+
+            # Stop training when the model reaches the success rate threshold
+            eval_envs = None
+            if not is_final_task and args.eval_freq > 0: # on the last subtask, train all the way to the end
+                eval_envs = create_envs(bddl, eval_args, tmp_dir=tmp_path)
+                callbacks.append(EvalSuccessGateCallback(
+                    eval_envs,
+                    threshold=args.success_rate_threshold,
+                    eval_freq=args.eval_freq,
+                    num_episodes=args.eval_episodes,
+                    async_eval=args.eval_async,
+                    seed=args.seed,
+                ))
+            elif not is_final_task:
+                callbacks.append(StopTrainingOnSuccessRateThreshold(
+                    threshold=args.success_rate_threshold, 
+                    min_count=log_interval*args.num_envs,
+                ))
+
+            # exploration technique callbacks
+            if args.exploration_alg is not None:
+                callbacks.append(args.get_exploration_callback(envs))
         
         
-        # reset these buffers so the training stats for the previous subtask doesn't leak into this subtask
-        model.ep_info_buffer = None
-        model.ep_success_buffer = None
-
-        total_timesteps = args.total_timesteps
-        if is_final_task and args.final_task_timesteps is not None:
-            total_timesteps = args.final_task_timesteps
-
-        model.learn(
-            total_timesteps=total_timesteps,
-            tb_log_name=f"{i}_{subtask_name}",
-            log_interval=log_interval,
-            callback=callbacks,
-            reset_num_timesteps=False,
-            progress_bar=False
-        )
-        print("Open files after learn:", get_open_files_count())
-
-
-        if args.wandb: # save tensorboard files to wandb
-            wandb.save(os.path.join(tensorboard_path, "*", "*"), base_path=tensorboard_path, policy='now')
-        model.save(os.path.join(models_path, f"{i}_{subtask_name}"))
-        if args.wandb: # save models to wandb
-            wandb.save(os.path.join(models_path, f"{i}_{subtask_name}.zip"), base_path=save_path, policy='now')
-
-        print("Open files before close:", get_open_files_count())
-        envs.close()
-        del envs
-        gc.collect()
-        print("Open files after close:", get_open_files_count())
-
+            # reset these buffers so the training stats for the previous subtask doesn't leak into this subtask
+            if not is_resumed_subtask:
+                model.ep_info_buffer = None
+                model.ep_success_buffer = None
+
+            total_timesteps = args.total_timesteps
+            if is_final_task and args.final_task_timesteps is not None:
+                total_timesteps = args.final_task_timesteps
+            total_timesteps -= model.num_timesteps - subtask_start
+
+            model.learn(
+                total_timesteps=total_timesteps,
+                tb_log_name=f"{i}_{subtask_name}",
+                log_interval=log_interval,
+                callback=callbacks,
+                reset_num_timesteps=False,
+                progress_bar=False
+            )
+            print("Open files after learn:", get_open_files_count())
+            subtask_timesteps[subtask_name] = model.num_timesteps - subtask_start
+            checkpointer.save(model, {
+                "subtask_name": steps[i+1].name if not is_final_task else None,
+                "subtask_timesteps": subtask_timesteps,
+            })
+
+
+            if args.wandb: # save tensorboard files to wandb
+                wandb.save(os.path.join(tensorboard_path, "*", "*"), base_path=tensorboard_path, policy='now')
+            model.save(os.path.join(models_path, f"{i}_{subtask_name}"))
+            if args.wandb: # save models to wandb
+                wandb.save(os.path.join(models_path, f"{i}_{subtask_name}.zip"), base_path=save_path, policy='now')
+
+            print("Open files before close:", get_open_files_count())
+            envs.close()
+            del envs
+            if eval_envs is not None:
+                eval_envs.close()
+                del eval_envs
+            gc.collect()
+            print("Open files after close:", get_open_files_count())
+
+    checkpointer.close()
     del model
\ No newline at end of file
@@ -16,6 +16,7 @@ from rllte.xplore.reward import RND, Disagreement, E3B, Fabric, ICM, NGU, Pseudo
 from rllte.common.prototype import BaseReward
 
 from .callbacks import RLeXploreWithOffPolicyRL, RLeXploreWithOnPolicyRL
+from .rnd import NativeICM, NativeRND
 
 
 @dataclass
@@ -27,7 +28,13 @@ class AlgArgs:
     her: bool = False
     """if toggled, SAC will use HER otherwise it would not"""
     exploration_alg: Optional[str] = None
-    """algorithm for exploration techniques: rnd, e3b, disagreement, re3, ride, icm"""
+    """algorithm for exploration techniques: rnd, e3b, disagreement, re3, ride, icm, native_rnd, native_icm (float32 low dimensional versions from src/rnd.py)"""
+    exploration_compute_every: int = 32
+    """off-policy only: number of steps whose intrinsic rewards are computed together in one batch"""
+    exploration_update_every: int = 32
+    """off-policy only: number of steps between updates of the intrinsic reward module"""
+    exploration_async_update: bool = False
+    """off-policy only: if toggled, the intrinsic reward module is updated on a background thread"""
     total_timesteps: int = 250000
     """total timesteps of the experiments"""
     learning_rate: float = 1e-3 
@@ -44,6 +51,14 @@ class AlgArgs:
     """if toggled, progress bar will be shown"""
     device: Optional[str] = None
     """device to use for training"""
+    channels_last: bool = False
+    """if toggled, image observations stay HWC uint8 until the first conv, which runs in channels-last memory format"""
+    shared_encoder: bool = False
+    """if toggled with SAC, actor and critic share the image encoder, which runs once per sampled batch (see SharedEncoderSAC)"""
+    pretrained_encoder_path: Optional[str] = None
+    """path to a trained visual model (.zip). If passed in, its image encoder is frozen and the policy is trained on the image embeddings"""
+    compile_policy: bool = False
+    """if toggled, PPO rollout collection and evaluation use TorchScript traced policies (see src/inference.py)"""
     
     def get_alg_str(self):
         alg_str = self.alg
@@ -68,7 +83,7 @@ class AlgArgs:
         else:
             return torch.device(self.device)
     
-    def get_exploration_alg_reward(self, envs: VecEnv, device: Optional[torch.device] = None) -> Optional[BaseReward]:
+    def get_exploration_alg_reward(self, envs: VecEnv, device: Optional[torch.device] = None) -> Optional[Union[BaseReward, NativeRND, NativeICM]]:
         if device == None:
             device = self.get_device()
         if self.exploration_alg == None:
@@ -85,6 +100,10 @@ class AlgArgs:
             return PseudoCounts(envs, device=device, rwd_norm_type='rms', obs_norm_type='none')
         elif self.exploration_alg == "ride":
             return RIDE(envs, device=device, rwd_norm_type='rms', obs_norm_type='none')
+        elif self.exploration_alg == "native_rnd":
+            return NativeRND(envs, device=device)
+        elif self.exploration_alg == "native_icm":
+            return NativeICM(envs, device=device)
         else:
             print("You have typed an invalid exploration technique. --help for more information.")
             exit(1)
@@ -97,7 +116,12 @@ class AlgArgs:
         if self.alg == 'ppo':
             return RLeXploreWithOnPolicyRL(irs)
         else:
-            return RLeXploreWithOffPolicyRL(irs)
+            return RLeXploreWithOffPolicyRL(
+                irs,
+                compute_every=self.exploration_compute_every,
+                update_every=self.exploration_update_every,
+                async_update=self.exploration_async_update,
+            )
 
 
 @dataclass
@@ -117,10 +141,22 @@ class EnvArgs:
     """multiplies the last goal state's shaping reward"""
     steps_per_episode: int = 250
     """number of steps in episode. If truncate is True, the episode will terminate after this value"""
+    action_repeat: int = 1
+    """number of control steps each action is applied for. Rewards are summed over the repeated steps, and steps_per_episode still counts control steps"""
     setup_demo_path: Optional[str] = None
     """a directory containing a demo.hdf5 file. If passed in, runs the actions in the given demonstration before every episode to setup the scene"""
     sim_states_path: Optional[str] = None
     """path to initial sim states pickle file in order to randomly select initial sim states. if None, the sim state will always start from default"""
+    sparse_goal_tracking: bool = False
+    """if toggled and shaping reward is off, only the current goal predicate is evaluated every step and already completed goals every completed_goal_check_freq steps"""
+    completed_goal_check_freq: int = 10
+    """number of steps between re-evaluations of already completed goals when sparse_goal_tracking is toggled"""
+    pin_workers: bool = False
+    """if toggled and num_envs > 1, each env worker is pinned to dedicated cores with single-threaded torch/BLAS, and the learner to a reserved core set"""
+    learner_cores: int = 2
+    """number of cores reserved for the learner (main process) when pin_workers is toggled"""
+    cores_per_env: int = 1
+    """number of cores dedicated to each env worker when pin_workers is toggled"""
 
     def fetch_sim_states(self):
         """load and cache the sim states from sim_states_path. If cached, directly return the states and do not load"""
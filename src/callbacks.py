@@ -1,23 +1,68 @@
+import os
+import re
+import shutil
 from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
 
 from stable_baselines3.common.callbacks import BaseCallback
 from stable_baselines3.common.base_class import BaseAlgorithm
-from stable_baselines3.common.logger import Video
+from stable_baselines3.common.save_util import save_to_zip_file
+from stable_baselines3.common.vec_env import VecEnv
 import numpy as np
 import torch as th
+from rllte.common.prototype import BaseReward
+
+from .checkpointing import RunStateCheckpointer, snapshot_model, write_atomic
+from .curriculum import LearningProgressScheduler
+from .evaluation import EvalResult, evaluate_policy_vec
+from .profiling import sum_phase_times, phase_ms_per_step
+from .video import StreamingVideoWriter
 
 class TensorboardCallback(BaseCallback):
     """
     Custom callback for plotting additional values in tensorboard.
+    Logs the means of the episode stats (reward, success, length and goal progress or distance) that the env workers
+    put into info["episode_stats"] at the end of each episode, over the last stats_window episodes.
+    Only the infos SB3 already collects are read, so there is no IPC beyond the regular step.
     """
 
-    def __init__(self, verbose=0):
+    def __init__(self, stats_window: int = 100, verbose=0):
         super(TensorboardCallback, self).__init__(verbose)
+        self.stats_window = stats_window
+        self.episode_stats = {}
+
+    def _on_step(self) -> bool:
+        finished = False
+        for info in self.locals["infos"]:
+            stats = info.get("episode_stats")
+            if stats is None:
+                continue
+            finished = True
+            for name, value in stats.items():
+                self.episode_stats.setdefault(name, deque(maxlen=self.stats_window)).append(value)
+        if finished:
+            for name, values in self.episode_stats.items():
+                self.logger.record(f"episode/{name}", np.mean(values))
+        return True
+
+class PhaseTimingCallback(BaseCallback):
+    """
+    Logs the per-phase step timings accumulated inside the env workers (see src/profiling.py).
+    The workers are only queried every log_freq calls, so regular steps do not pay for any extra IPC.
+    """
+
+    def __init__(self, log_freq: int = 1000, verbose=0):
+        super(PhaseTimingCallback, self).__init__(verbose)
+        self.log_freq = log_freq
+        self.last_phase_times = {}
 
     def _on_step(self) -> bool:
-        for index, custom_attributes in enumerate(self.training_env.get_attr('custom_attr')):
-            self.logger.record(f'total reward for env {index}', custom_attributes.get('total_reward'))
-            self.logger.record(f'reward for env {index}', custom_attributes.get('reward'))
+        if self.n_calls % self.log_freq == 0:
+            phase_times = sum_phase_times(self.training_env.get_attr("phase_times"))
+            for name, ms in phase_ms_per_step(self.last_phase_times, phase_times).items():
+                self.logger.record(f"phase_time/{name}_ms", ms, exclude="stdout")
+            self.last_phase_times = phase_times
         return True
 
 class DebugCallback(BaseCallback):
@@ -34,29 +79,71 @@ class DebugCallback(BaseCallback):
 class VideoWriter(BaseCallback):
     """
     A custom callback for writing videos of the agent's performance.
+    Every n_steps timesteps, the next full episode of the first env is streamed to an mp4 in save_dir, encoded on a
+    background thread. Frames are only touched inside these recording windows, and the logger gets the file path.
     """
-    def __init__(self, n_steps: int):
+    def __init__(self, n_steps: int, save_dir: str, video_length: int = 250, fps: int = 30):
         super().__init__()
         self.n_steps = n_steps
+        self.save_dir = save_dir
+        self.video_length = video_length
+        self.fps = fps
         self.last_time_trigger = 0
-        self.frame_buffer = deque(maxlen=250)
+        self.waiting_for_episode = False
+        self.recorder: Optional[StreamingVideoWriter] = None
+        # closed recorders that may still be encoding their last frames
+        self.finishing: List[StreamingVideoWriter] = []
 
     def _on_step(self) -> bool:
-        infos = self.locals["infos"][0]  # only log the first environment
-        frame = infos["agentview_image"].transpose(2, 0, 1)[:, ::-1, ::-1]
-        self.frame_buffer.append(frame)
-        if (self.num_timesteps - self.last_time_trigger) >= self.n_steps:
+        if self.recorder is not None:
+            frame = self.locals["infos"][0].get("agentview_image")  # only log the first environment
+            if frame is not None:
+                self.recorder.append(frame[::-1, ::-1])
+            if self.locals["dones"][0] or self.recorder.num_frames >= self.video_length:
+                self._finish_recording()
+        elif self.waiting_for_episode:
+            if self.locals["dones"][0]:
+                # start with the next step so the video covers a full episode
+                self.waiting_for_episode = False
+                filename = os.path.join(self.save_dir, f"agent_view_{self.num_timesteps}.mp4")
+                self.recorder = StreamingVideoWriter(filename, fps=self.fps)
+        elif (self.num_timesteps - self.last_time_trigger) >= self.n_steps:
             self.last_time_trigger = self.num_timesteps
-            frames = th.tensor(np.stack(self.frame_buffer)).unsqueeze(0)
-
-            logger = self.locals.get("self").logger
-            logger.record("video/agent_view", Video(frames, fps=30), exclude="stdout")
+            self.waiting_for_episode = True
         return True
+
+    def _finish_recording(self):
+        # the remaining frames finish encoding in the background
+        self.recorder.close(wait=False)
+        self.logger.record("video/agent_view", self.recorder.filename, exclude="stdout")
+        for recorder in [recorder for recorder in self.finishing if recorder.done]:
+            recorder.join() # raises encoding errors
+            self.finishing.remove(recorder)
+        self.finishing.append(self.recorder)
+        self.recorder = None
+
+    def _on_training_end(self) -> None:
+        if self.recorder is not None:
+            self._finish_recording()
+        # make sure every video is complete before learn returns
+        for recorder in self.finishing:
+            recorder.join()
+        self.finishing = []
     
 
+def overrides_watch(irs: BaseReward) -> bool:
+    """whether the intrinsic reward module does anything in watch, which is a no-op in BaseReward and absent in the native modules"""
+    return getattr(type(irs), "watch", BaseReward.watch) is not BaseReward.watch
+
+
 class RLeXploreWithOnPolicyRL(BaseCallback):
     """
     A custom callback for combining RLeXplore and on-policy algorithms from SB3.
+
+    The rollout buffer's observations are a view into a preallocated (n_steps + 1, n_envs, *obs_shape) array, whose
+    last row is filled with the final next observations at the end of the rollout. The observations and next
+    observations passed to the intrinsic reward module are then two shifted views of the same memory, instead of
+    a converted copy and a clone.
     """
     def __init__(self, irs, verbose=0):
         super(RLeXploreWithOnPolicyRL, self).__init__(verbose)
@@ -66,55 +153,57 @@ class RLeXploreWithOnPolicyRL(BaseCallback):
     def init_callback(self, model: BaseAlgorithm) -> None:
         super().init_callback(model)
         self.buffer = self.model.rollout_buffer
+        assert not isinstance(self.buffer.observations, dict), "intrinsic rewards are not supported for dict observations"
+        self.observation_storage = np.zeros((self.buffer.buffer_size + 1, *self.buffer.observations.shape[1:]), dtype=self.buffer.observations.dtype)
+        self.watch = overrides_watch(self.irs)
         self.loss_buffer = deque(maxlen=50)
         self.intrinsic_reward_buffer = deque(maxlen=50)
 
+    def _on_rollout_start(self) -> None:
+        # the buffer was just reset, make it write the observations into the shared storage
+        self.buffer.observations = self.observation_storage[:-1]
+
     def _on_step(self) -> bool:
         """
         This method will be called by the model after each call to `env.step()`.
 
         :return: (bool) If the callback returns False, training is aborted early.
         """
-        observations = self.locals["obs_tensor"]
-        device = observations.device
-        actions = th.as_tensor(self.locals["actions"], device=device)
-        rewards = th.as_tensor(self.locals["rewards"], device=device)
-        dones = th.as_tensor(self.locals["dones"], device=device)
-        next_observations = th.as_tensor(self.locals["new_obs"], device=device)
-
-        # ===================== watch the interaction ===================== #
-        self.irs.watch(observations, actions, rewards, dones, dones, next_observations)
-        # ===================== watch the interaction ===================== #
+        if self.watch:
+            observations = self.locals["obs_tensor"]
+            device = observations.device
+            actions = th.as_tensor(self.locals["actions"], device=device)
+            rewards = th.as_tensor(self.locals["rewards"], device=device)
+            dones = th.as_tensor(self.locals["dones"], device=device)
+            next_observations = th.as_tensor(self.locals["new_obs"], device=device)
+
+            # ===================== watch the interaction ===================== #
+            self.irs.watch(observations, actions, rewards, dones, dones, next_observations)
+            # ===================== watch the interaction ===================== #
         return True
 
     def _on_rollout_end(self) -> None:
         # ===================== compute the intrinsic rewards ===================== #
-        # prepare the data samples
-        obs = th.as_tensor(self.buffer.observations)
-        # get the new observations
-        new_obs = obs.clone()
-        new_obs[:-1] = obs[1:]
-        new_obs[-1] = th.as_tensor(self.locals["new_obs"])
-        actions = th.as_tensor(self.buffer.actions)
-        rewards = th.as_tensor(self.buffer.rewards)
-        dones = th.as_tensor(self.buffer.episode_starts)
-        print(obs.shape, actions.shape, rewards.shape, dones.shape, obs.shape)
-        # compute the intrinsic rewards
-        intrinsic_rewards = self.irs.compute(
-            samples=dict(observations=obs, actions=actions, 
-                         rewards=rewards, terminateds=dones, 
-                         truncateds=dones, next_observations=new_obs),
-            sync=True)
-        
-        # update the intrinsic reward module
-        self.irs.update(samples=dict(observations=obs, actions=actions,
-                                    rewards=rewards, terminateds=dones,
-                                    truncateds=dones, next_observations=new_obs))
+        # prepare the data samples, on the CPU these are views of the buffer's arrays
+        device = self.irs.device
+        self.observation_storage[-1] = self.locals["new_obs"]
+        observations = th.as_tensor(self.observation_storage, device=device)
+        samples = dict(
+            observations=observations[:-1],
+            actions=th.as_tensor(self.buffer.actions, device=device),
+            rewards=th.as_tensor(self.buffer.rewards, device=device),
+            terminateds=th.as_tensor(self.buffer.episode_starts, device=device),
+            truncateds=th.as_tensor(self.buffer.episode_starts, device=device),
+            next_observations=observations[1:],
+        )
+        # compute the intrinsic rewards, sync also updates the intrinsic reward module
+        intrinsic_rewards = self.irs.compute(samples=samples, sync=True)
         self.loss_buffer.append(self.irs.metrics["loss"][-1])
-        self.intrinsic_reward_buffer.append(np.mean(intrinsic_rewards.cpu().numpy()))
+        intrinsic_rewards = intrinsic_rewards.cpu().numpy()
+        self.intrinsic_reward_buffer.append(np.mean(intrinsic_rewards))
 
         # add the intrinsic rewards to the buffer
-        self.buffer.rewards += intrinsic_rewards.cpu().numpy()
+        self.buffer.rewards += intrinsic_rewards
         # compute the advantages again
         values = self.locals["values"]
         dones = self.locals["dones"]
@@ -128,16 +217,32 @@ class RLeXploreWithOnPolicyRL(BaseCallback):
 class RLeXploreWithOffPolicyRL(BaseCallback):
     """
     A custom callback for combining RLeXplore and off-policy algorithms from SB3. 
+
+    Intrinsic rewards are computed in batches of compute_every steps and added to the rewards of those transitions
+    in the replay buffer, so a transition can be sampled before its intrinsic reward was added. The intrinsic
+    reward module is updated on a replay batch every update_every steps, optionally on a background thread.
+    An update still running when the module is needed on the training thread (watch, compute) is waited for first,
+    so the module is never used by both threads at once.
     """
-    def __init__(self, irs, verbose=0):
+    def __init__(self, irs, compute_every: int = 32, update_every: int = 32, async_update: bool = False, verbose=0):
         super(RLeXploreWithOffPolicyRL, self).__init__(verbose)
         self.irs = irs
         self.buffer = None
+        self.compute_every = compute_every
+        self.update_every = update_every
+        self.async_update = async_update
+        self.update_executor = ThreadPoolExecutor(max_workers=1) if async_update else None
+        self.pending_update: Optional[Future] = None
+        # transitions waiting for their intrinsic rewards, and their positions in the replay buffer
+        self.pending = []
+        self.pending_positions = []
 
     def init_callback(self, model: BaseAlgorithm) -> None:
         super().init_callback(model)
         self.buffer = self.model.replay_buffer
-        
+        assert not isinstance(self.buffer.observations, dict), "intrinsic rewards are not supported for dict observations"
+        self.watch = overrides_watch(self.irs)
+        self.intrinsic_reward_buffer = deque(maxlen=50)
 
     def _on_step(self) -> bool:
         """
@@ -145,46 +250,87 @@ class RLeXploreWithOffPolicyRL(BaseCallback):
 
         :return: (bool) If the callback returns False, training is aborted early.
         """
-        device = self.irs.device
-        obs = th.as_tensor(self.locals['self']._last_obs, device=device)
-        actions = th.as_tensor(self.locals["actions"], device=device)
-        rewards = th.as_tensor(self.locals["rewards"], device=device)
-        dones = th.as_tensor(self.locals["dones"], device=device)
-        next_obs = th.as_tensor(self.locals["new_obs"], device=device)
-        # ===================== watch the interaction ===================== #
-        self.irs.watch(obs, actions, rewards, dones, dones, next_obs)
-        # ===================== watch the interaction ===================== #
+        # all pending transitions are in the replay buffer by now, the current one is only stored after this call
+        if len(self.pending) >= self.compute_every:
+            self._add_intrinsic_rewards()
+
+        obs = self.locals['self']._last_obs
+        actions = self.locals["actions"]
+        rewards = self.locals["rewards"]
+        dones = self.locals["dones"]
+        next_obs = self.locals["new_obs"]
+        if self.watch:
+            self._wait_for_update()
+            # ===================== watch the interaction ===================== #
+            device = self.irs.device
+            self.irs.watch(th.as_tensor(obs, device=device), th.as_tensor(actions, device=device), th.as_tensor(rewards, device=device),
+                           th.as_tensor(dones, device=device), th.as_tensor(dones, device=device), th.as_tensor(next_obs, device=device))
+            # ===================== watch the interaction ===================== #
+        self.pending.append((obs, actions, rewards.copy(), dones, next_obs))
+        self.pending_positions.append(self.buffer.pos)
+
+        if self.n_calls % self.update_every == 0:
+            self._update()
+        return True
+
+    def _wait_for_update(self):
+        if self.pending_update is not None:
+            self.pending_update.result() # raises the exceptions of the update
+            self.pending_update = None
+
+    def _add_intrinsic_rewards(self):
+        self._wait_for_update()
         # ===================== compute the intrinsic rewards ===================== #
-        intrinsic_rewards = self.irs.compute(samples={'observations':obs.unsqueeze(0).float(), 
-                                            'actions':actions.unsqueeze(0), 
-                                            'rewards':rewards.unsqueeze(0),
-                                            'terminateds':dones.unsqueeze(0),
-                                            'truncateds':dones.unsqueeze(0),
-                                            'next_observations':next_obs.unsqueeze(0).float()}, 
+        device = self.irs.device
+        obs, actions, rewards, dones, next_obs = (th.as_tensor(np.stack(values), device=device) for values in zip(*self.pending))
+        intrinsic_rewards = self.irs.compute(samples={'observations': obs.float(), 
+                                            'actions': actions,
+                                            'rewards': rewards,
+                                            'terminateds': dones,
+                                            'truncateds': dones,
+                                            'next_observations': next_obs.float()}, 
                                             sync=False)
         # ===================== compute the intrinsic rewards ===================== #
-        # add the intrinsic rewards to the original rewards
-        self.locals['rewards'] += intrinsic_rewards.cpu().numpy().squeeze()
-        # Zifan: check if this value is indeed added back to the reward in storage
-
-        try:
-            # update the intrinsic reward module
-            replay_data = self.buffer.sample(batch_size=self.irs.batch_size)
-            self.irs.update(samples={'observations': th.as_tensor(replay_data.observations).unsqueeze(1).to(device), # (n_steps, n_envs, *obs_shape)
-                                     'actions': th.as_tensor(replay_data.actions).unsqueeze(1).to(device),
-                                     'rewards': th.as_tensor(replay_data.rewards).to(device),
-                                     'terminateds': th.as_tensor(replay_data.dones).to(device),
-                                     'truncateds': th.as_tensor(replay_data.dones).to(device),
-                                     'next_observations': th.as_tensor(replay_data.next_observations).unsqueeze(1).to(device)
-                                     })
-        except:
-            pass
+        # add the intrinsic rewards to the stored rewards, shape (compute_every, n_envs)
+        intrinsic_rewards = intrinsic_rewards.cpu().numpy().reshape(len(self.pending), -1)
+        self.buffer.rewards[self.pending_positions] += intrinsic_rewards
+        self.intrinsic_reward_buffer.append(np.mean(intrinsic_rewards))
+        self.logger.record("intrinsic_reward/reward", np.mean(self.intrinsic_reward_buffer))
+        self.pending.clear()
+        self.pending_positions.clear()
+
+    def _update(self):
+        if self.buffer.size() == 0:
+            return
+        if self.pending_update is not None:
+            if not self.pending_update.done():
+                return # the previous update is still running
+            self.pending_update.result() # raises the exceptions of the update
+            self.pending_update = None
 
-        return True
+        # update the intrinsic reward module
+        device = self.irs.device
+        replay_data = self.buffer.sample(batch_size=self.irs.batch_size)
+        samples = {'observations': th.as_tensor(replay_data.observations).unsqueeze(1).to(device), # (n_steps, n_envs, *obs_shape)
+                   'actions': th.as_tensor(replay_data.actions).unsqueeze(1).to(device),
+                   'rewards': th.as_tensor(replay_data.rewards).to(device),
+                   'terminateds': th.as_tensor(replay_data.dones).to(device),
+                   'truncateds': th.as_tensor(replay_data.dones).to(device),
+                   'next_observations': th.as_tensor(replay_data.next_observations).unsqueeze(1).to(device)
+                   }
+        if self.update_executor is not None:
+            self.pending_update = self.update_executor.submit(self.irs.update, samples=samples)
+        else:
+            self.irs.update(samples=samples)
 
     def _on_rollout_end(self) -> None:
         pass
 
+    def _on_training_end(self) -> None:
+        if len(self.pending) > 0:
+            self._add_intrinsic_rewards()
+        self._wait_for_update()
+
 
 class StopTrainingOnSuccessRateThreshold(BaseCallback):
     """
@@ -225,4 +371,260 @@ class StopTrainingOnSuccessRateThreshold(BaseCallback):
 
     def _on_rollout_end(self):
         self.update_should_end()
-    
\ No newline at end of file
+    
+
+class EvalSuccessGateCallback(BaseCallback):
+    """
+    Stops the training once a deterministic evaluation reaches a success rate threshold.
+
+    Every eval_freq timesteps the current policy weights are copied into a separate policy, which runs num_episodes
+    episodes on its own small vec env. With async_eval this happens on a background thread while training goes on,
+    and the result is checked on the following steps, so at most one evaluation is pending at a time.
+    Unlike StopTrainingOnSuccessRateThreshold, the decision does not depend on the stochastic training episodes.
+
+    :param eval_envs: vec env used only for the evaluations, closed by the caller
+    :param seed: if set, the eval envs are reseeded before every evaluation so all evaluations see the same episodes
+    """
+    def __init__(
+        self,
+        eval_envs: VecEnv,
+        threshold: float,
+        eval_freq: int = 10000,
+        num_episodes: int = 10,
+        deterministic: bool = True,
+        async_eval: bool = True,
+        seed: Optional[int] = None,
+        verbose: int = 1,
+    ):
+        super().__init__(verbose=verbose)
+        self.eval_envs = eval_envs
+        self.threshold = threshold
+        self.eval_freq = eval_freq
+        self.num_episodes = num_episodes
+        self.deterministic = deterministic
+        self.seed = seed
+        self.eval_executor = ThreadPoolExecutor(max_workers=1) if async_eval else None
+        self.pending_eval: Optional[Future] = None
+        self.eval_policy = None
+        self.last_eval_timesteps = 0
+        self.last_result: Optional[EvalResult] = None
+        self.should_end = False
+
+    def _init_callback(self) -> None:
+        # a fresh policy rather than a deepcopy, so nothing attached to the training policy (e.g. traced rollouts) is copied
+        policy = self.model.policy
+        self.eval_policy = type(policy)(**policy._get_constructor_parameters()).to(policy.device)
+        self.eval_policy.set_training_mode(False)
+        self.last_eval_timesteps = self.num_timesteps
+
+    def _evaluate(self, eval_timesteps: int):
+        if self.seed is not None:
+            self.eval_envs.seed(self.seed)
+        result = evaluate_policy_vec(self.eval_policy, self.eval_envs, self.num_episodes, deterministic=self.deterministic, verbose=0)
+        return eval_timesteps, result
+
+    def _handle_result(self, eval_timesteps: int, result: EvalResult):
+        self.last_result = result
+        self.logger.record("eval/success_rate", result.success_rate)
+        self.logger.record("eval/mean_length", result.mean_length)
+        self.logger.record("eval/mean_reward", result.mean_reward)
+        if self.verbose >= 1:
+            print(f"Eval at step {eval_timesteps}: {result}")
+        if result.success_rate >= self.threshold:
+            self.should_end = True
+            print(f"Eval success rate reached {result.success_rate}, which is at least the threshold {self.threshold}. Stopping training.")
+
+    def _on_step(self) -> bool:
+        if self.pending_eval is not None and self.pending_eval.done():
+            self._handle_result(*self.pending_eval.result())
+            self.pending_eval = None
+        if self.should_end:
+            return False
+
+        if self.pending_eval is None and self.num_timesteps - self.last_eval_timesteps >= self.eval_freq:
+            self.last_eval_timesteps = self.num_timesteps
+            # the weights are copied here, so training can keep updating the policy during the evaluation
+            self.eval_policy.load_state_dict(self.model.policy.state_dict())
+            if self.eval_executor is not None:
+                self.pending_eval = self.eval_executor.submit(self._evaluate, self.num_timesteps)
+            else:
+                self._handle_result(*self._evaluate(self.num_timesteps))
+        return not self.should_end
+
+    def _on_training_end(self) -> None:
+        # the eval envs must be idle before the caller closes them
+        if self.pending_eval is not None:
+            self._handle_result(*self.pending_eval.result())
+            self.pending_eval = None
+        if self.eval_executor is not None:
+            self.eval_executor.shutdown()
+
+
+class CurriculumSchedulerCallback(BaseCallback):
+    """
+    Runs a LearningProgressScheduler over a vec env of SwitchableTaskEnvs (see src/curriculum.py).
+    Finished episodes are recorded for the task they ran on, and every reassign_freq calls the scheduler may advance
+    the curriculum and move workers between tasks. Moved workers switch on their next reset.
+
+    :param task_bddl_file: maps a task index to its BDDL file, called only when a worker is moved to the task
+    :param final_task_timesteps: if set, training stops this many timesteps after the final task became current
+    """
+    def __init__(
+        self,
+        scheduler: LearningProgressScheduler,
+        task_bddl_file: Callable[[int], str],
+        reassign_freq: int = 1000,
+        final_task_timesteps: Optional[int] = None,
+        verbose: int = 1,
+    ):
+        super().__init__(verbose=verbose)
+        self.scheduler = scheduler
+        self.task_bddl_file = task_bddl_file
+        self.reassign_freq = reassign_freq
+        self.final_task_timesteps = final_task_timesteps
+        self.final_task_start: Optional[int] = None
+
+    def _on_step(self) -> bool:
+        for info, done in zip(self.locals["infos"], self.locals["dones"]):
+            if done and "task_index" in info:
+                self.scheduler.record(info["task_index"], info.get("is_success", False))
+
+        if self.n_calls % self.reassign_freq == 0:
+            self.scheduler.maybe_advance()
+            for worker, task in self.scheduler.reassign():
+                self.training_env.env_method("switch_task", task, self.task_bddl_file(task), indices=[worker])
+            self.logger.record("curriculum/current_task", self.scheduler.current_task)
+            for task, stats in self.scheduler.summary().items():
+                offset = task - self.scheduler.current_task
+                self.logger.record(f"curriculum/workers_{offset:+d}", stats["workers"])
+                self.logger.record(f"curriculum/learning_progress_{offset:+d}", stats["learning_progress"])
+                if stats["success_rate"] is not None:
+                    self.logger.record(f"curriculum/success_rate_{offset:+d}", stats["success_rate"])
+            if self.verbose >= 2:
+                print(f"curriculum at step {self.num_timesteps}: {self.scheduler.summary()}")
+
+        if self.scheduler.is_final_task and self.final_task_start is None:
+            self.final_task_start = self.num_timesteps
+        if self.final_task_timesteps is not None and self.final_task_start is not None:
+            return self.num_timesteps - self.final_task_start < self.final_task_timesteps
+        return True
+
+
+class RunStateCheckpointCallback(BaseCallback):
+    """
+    Saves a resumable run-state checkpoint (see src/checkpointing.py) every save_freq calls.
+    The state is copied on the training thread and written in the background.
+
+    :param extra_state: called at every save for additional state to store, e.g. the curriculum position
+    """
+    def __init__(self, checkpointer: RunStateCheckpointer, save_freq: int, extra_state: Optional[Callable[[], dict]] = None, verbose: int = 0):
+        super().__init__(verbose=verbose)
+        self.checkpointer = checkpointer
+        self.save_freq = save_freq
+        self.extra_state = extra_state
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.save_freq == 0:
+            self.checkpointer.save(self.model, self.extra_state() if self.extra_state is not None else None)
+        return True
+
+
+class SimStateRecorderCallback(BaseCallback):
+    """
+    Records the flattened sim state after every transition (info["sim_state"]) into the sim_states array of the
+    replay buffer (see replay_transfer.enable_sim_state_recording), so the rewards of the stored transitions can be
+    relabeled for the next curriculum subtask. Relabeling replaces any intrinsic rewards added to them.
+    """
+    def __init__(self, verbose: int = 0):
+        super().__init__(verbose=verbose)
+        self.buffer = None
+
+    def init_callback(self, model: BaseAlgorithm) -> None:
+        super().init_callback(model)
+        self.buffer = self.model.replay_buffer
+        assert getattr(self.buffer, "sim_states", None) is not None, "sim state recording is not enabled for the replay buffer"
+
+    def _on_step(self) -> bool:
+        # the current transition is only stored after this call, at the current buffer position
+        for env_index, info in enumerate(self.locals["infos"]):
+            sim_state = info.get("sim_state")
+            self.buffer.sim_states[self.buffer.pos, env_index] = sim_state.flatten() if sim_state is not None else np.nan
+        return True
+
+
+class AsyncCheckpointCallback(BaseCallback):
+    """
+    Like CheckpointCallback, but without stalling training: every save_freq calls the model is copied in memory
+    (see checkpointing.snapshot_model), and the zip is serialized, compressed and written on a background thread.
+    Checkpoints are named <name_prefix>_<num_timesteps>_steps.zip like CheckpointCallback's, and only the last
+    keep_last of them are kept, including the ones already in save_path (e.g. of earlier curriculum subtasks or a
+    resumed run). With keep_best, the checkpoint with the best training success rate (or mean episode reward if
+    there is no success info) during this callback is also kept as <best_prefix>_best.zip, with best_prefix
+    defaulting to name_prefix.
+    If the previous checkpoint is still being written when the next one is due, the next one is deferred.
+    """
+    def __init__(self, save_freq: int, save_path: str, name_prefix: str = "model", keep_last: int = 5, keep_best: bool = True, best_prefix: Optional[str] = None, verbose: int = 0):
+        super().__init__(verbose=verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.name_prefix = name_prefix
+        self.best_prefix = best_prefix if best_prefix is not None else name_prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending: Optional[Future] = None
+        self.last_save_call = 0
+        self.best_metric: Optional[float] = None
+        self.saved = deque()
+
+    def _init_callback(self) -> None:
+        os.makedirs(self.save_path, exist_ok=True)
+        # earlier checkpoints with the same prefix count towards keep_last, oldest first
+        pattern = re.compile(rf"{re.escape(self.name_prefix)}_(\d+)_steps\.zip")
+        existing = [(int(match.group(1)), name) for name in os.listdir(self.save_path) if (match := pattern.fullmatch(name))]
+        self.saved = deque(os.path.join(self.save_path, name) for _, name in sorted(existing))
+
+    def _metric(self) -> Optional[float]:
+        if self.model.ep_success_buffer is not None and len(self.model.ep_success_buffer) > 0:
+            return float(np.mean(self.model.ep_success_buffer))
+        if self.model.ep_info_buffer is not None and len(self.model.ep_info_buffer) > 0:
+            return float(np.mean([ep_info["r"] for ep_info in self.model.ep_info_buffer]))
+        return None
+
+    def _on_step(self) -> bool:
+        if self.n_calls - self.last_save_call < self.save_freq:
+            return True
+        if self.pending is not None:
+            if not self.pending.done():
+                return True
+            self.pending.result() # raises errors from the writer
+        self.last_save_call = self.n_calls
+
+        metric = self._metric()
+        is_best = self.keep_best and metric is not None and (self.best_metric is None or metric > self.best_metric)
+        if is_best:
+            self.best_metric = metric
+        path = os.path.join(self.save_path, f"{self.name_prefix}_{self.num_timesteps}_steps.zip")
+        self.pending = self.executor.submit(self._write, path, snapshot_model(self.model), is_best)
+        return True
+
+    def _write(self, path: str, snapshot, is_best: bool):
+        data, params, pytorch_variables = snapshot
+        write_atomic(path, lambda f: save_to_zip_file(f, data=data, params=params, pytorch_variables=pytorch_variables))
+        if is_best:
+            with open(path, "rb") as checkpoint:
+                write_atomic(os.path.join(self.save_path, f"{self.best_prefix}_best.zip"), lambda f: shutil.copyfileobj(checkpoint, f))
+        self.saved.append(path)
+        while len(self.saved) > self.keep_last:
+            os.remove(self.saved.popleft())
+        if self.verbose >= 1:
+            print(f"Saving model checkpoint to {path}" + (" (best)" if is_best else ""))
+
+    def _on_training_end(self) -> None:
+        # learn only returns once the last checkpoint is on disk, so the next callback can take over the directory
+        try:
+            if self.pending is not None:
+                self.pending.result()
+                self.pending = None
+        finally:
+            self.executor.shutdown(wait=True)
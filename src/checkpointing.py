@@ -0,0 +1,286 @@
+import copy
+import json
+import os
+import random
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch as th
+
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.save_util import recursive_getattr, recursive_setattr
+
+MANIFEST_FILE = "manifest.json"
+
+
+def cpu_copy(obj):
+    """copies the tensors and arrays of (nested) state dicts to the CPU, so they no longer change with training"""
+    if isinstance(obj, th.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if isinstance(obj, dict):
+        return {key: cpu_copy(value) for key, value in obj.items()}
+    if isinstance(obj, tuple) and hasattr(obj, "_fields"): # named tuples, e.g. TrainFreq
+        return type(obj)(*(cpu_copy(value) for value in obj))
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(value) for value in obj)
+    if isinstance(obj, deque):
+        return copy.copy(obj)
+    return obj
+
+
+def snapshot_model(model: BaseAlgorithm) -> Tuple[dict, dict, dict]:
+    """
+    an in-memory copy of what BaseAlgorithm.save writes (data, params and pytorch variables, without the replay
+    buffer), which no longer changes with training and can be passed to save_to_zip_file on another thread
+    """
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for name in state_dicts_names + (torch_variable_names or []):
+        exclude.add(name.split(".")[0])
+    for name in exclude:
+        data.pop(name, None)
+    data = {key: cpu_copy(value) for key, value in data.items()}
+    pytorch_variables = {name: cpu_copy(recursive_getattr(model, name)) for name in torch_variable_names or []}
+    params = cpu_copy(model.get_parameters())
+    return data, params, pytorch_variables
+
+
+def rng_states() -> Dict[str, Any]:
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": th.get_rng_state(),
+        "cuda": th.cuda.get_rng_state_all() if th.cuda.is_available() else None,
+    }
+
+
+def set_rng_states(states: Dict[str, Any]):
+    random.setstate(states["python"])
+    np.random.set_state(states["numpy"])
+    th.set_rng_state(states["torch"])
+    if states["cuda"] is not None and th.cuda.is_available():
+        th.cuda.set_rng_state_all(states["cuda"])
+
+
+def transition_arrays(buffer: ReplayBuffer) -> Dict[str, np.ndarray]:
+    """
+    the per-transition arrays of a replay buffer (first dimension buffer_size), by attribute name, with
+    dict observations as "<attribute>.<key>". This covers HER's episode bookkeeping arrays as well
+    """
+    arrays = {}
+    for name, value in vars(buffer).items():
+        if isinstance(value, np.ndarray) and value.ndim > 0 and value.shape[0] == buffer.buffer_size:
+            arrays[name] = value
+        elif isinstance(value, dict):
+            for key, array in value.items():
+                if isinstance(array, np.ndarray) and array.ndim > 0 and array.shape[0] == buffer.buffer_size:
+                    arrays[f"{name}.{key}"] = array
+    return arrays
+
+
+def buffer_state(buffer: ReplayBuffer) -> Dict[str, Any]:
+    """the small, non per-transition state of a replay buffer (positions, HER's current episode starts)"""
+    transitions = transition_arrays(buffer)
+    state = {"pos": buffer.pos, "full": buffer.full}
+    for name, value in vars(buffer).items():
+        if isinstance(value, np.ndarray) and name not in transitions:
+            state[name] = value.copy()
+    return state
+
+
+def write_atomic(path: str, write):
+    """calls write(file) on a temporary file, which then replaces path, so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_manifest(run_state_dir: str) -> Optional[dict]:
+    path = os.path.join(run_state_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class RunStateCheckpointer:
+    """
+    Writes resumable run-state checkpoints into run_state_dir: the parameters and optimizer states of the model,
+    its counters and episode buffers, the RNG states, any extra state (e.g. the curriculum position), and the
+    replay buffer.
+
+    save() only copies the state on the calling thread, everything is written on a background thread. The replay
+    buffer is streamed as chunks: every checkpoint copies only the transitions added since the previous one, and
+    chunks that were completely overwritten in the ring buffer are deleted. All files are written to temporary
+    files first, and a checkpoint only becomes visible when manifest.json is replaced, so a job killed in the
+    middle of a write resumes from the previous checkpoint. At most one write is in flight, a save waits for the
+    previous one.
+
+    The rows to stream are counted from the buffer position, not from num_timesteps: saves inside a callback run
+    after SB3 counted the current step but before its transition is stored, so the two do not always move together.
+    num_timesteps only tells whether the buffer may have wrapped around completely since the previous checkpoint.
+
+    Intrinsic rewards that are added to stored transitions after a checkpoint (see RLeXploreWithOffPolicyRL) are
+    not in the chunk of that checkpoint.
+    """
+    def __init__(self, run_state_dir: str, verbose: int = 1):
+        self.run_state_dir = run_state_dir
+        self.verbose = verbose
+        if not os.path.exists(run_state_dir):
+            os.makedirs(run_state_dir)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending: Optional[Future] = None
+        # continue the numbering and the buffer chunks of a resumed run
+        manifest = load_manifest(run_state_dir)
+        self.checkpoint_index = manifest["checkpoint"] if manifest is not None else 0
+        self.chunks: List[dict] = manifest["chunks"] if manifest is not None else []
+        self.last_num_timesteps: Optional[int] = manifest["num_timesteps"] if manifest is not None else None
+        # manifests without the buffer position get a full buffer on the next checkpoint
+        self.last_buffer_pos: Optional[int] = manifest.get("buffer_pos") if manifest is not None else None
+
+    def invalidate_buffer(self):
+        """makes the next checkpoint write the whole replay buffer, e.g. after its stored transitions were changed"""
+        self.last_buffer_pos = None
+
+    def _snapshot_buffer(self, model: BaseAlgorithm) -> Optional[dict]:
+        buffer = getattr(model, "replay_buffer", None)
+        if buffer is None:
+            return None
+        size = buffer.buffer_size
+        # every vec env step adds one row for all envs, give or take the row of a step that is not stored yet
+        steps = (model.num_timesteps - self.last_num_timesteps) // buffer.n_envs if self.last_num_timesteps is not None else None
+        replace = self.last_buffer_pos is None or steps >= size - 1
+        if replace:
+            rows = size if buffer.full else buffer.pos
+        else:
+            rows = (buffer.pos - self.last_buffer_pos) % size
+        indices = (buffer.pos - rows + np.arange(rows)) % size
+        return {
+            "start": int(indices[0]) if rows > 0 else int(buffer.pos),
+            "count": int(rows),
+            "replace": replace,
+            "buffer_size": size,
+            "arrays": {name: array[indices] for name, array in transition_arrays(buffer).items()} if rows > 0 else None,
+        }
+
+    def save(self, model: BaseAlgorithm, extra_state: Optional[dict] = None) -> Future:
+        if self.pending is not None:
+            self.pending.result()
+        self.checkpoint_index += 1
+        _, pytorch_variable_names = model._get_torch_save_params()
+        buffer = getattr(model, "replay_buffer", None)
+        state = {
+            "params": cpu_copy(model.get_parameters()),
+            "pytorch_variables": {name: cpu_copy(recursive_getattr(model, name)) for name in pytorch_variable_names or []},
+            "num_timesteps": model.num_timesteps,
+            "n_updates": getattr(model, "_n_updates", 0),
+            "episode_num": model._episode_num,
+            "ep_info_buffer": list(model.ep_info_buffer) if model.ep_info_buffer is not None else None,
+            "ep_success_buffer": list(model.ep_success_buffer) if model.ep_success_buffer is not None else None,
+            "buffer_state": buffer_state(buffer) if buffer is not None else None,
+            "rng_states": rng_states(),
+            "extra": cpu_copy(extra_state or {}),
+        }
+        chunk = self._snapshot_buffer(model)
+        self.last_num_timesteps = model.num_timesteps
+        self.last_buffer_pos = int(buffer.pos) if buffer is not None else None
+        self.pending = self.executor.submit(self._write, self.checkpoint_index, state, chunk, self.last_buffer_pos)
+        return self.pending
+
+    def _write(self, index: int, state: dict, chunk: Optional[dict], buffer_pos: Optional[int]):
+        state_file = f"state_{index}.pt"
+        write_atomic(os.path.join(self.run_state_dir, state_file), lambda f: th.save(state, f))
+
+        buffer_size = None
+        if chunk is not None:
+            buffer_size = chunk["buffer_size"]
+            if chunk["replace"]:
+                self.chunks = []
+            if chunk["count"] > 0:
+                chunk_file = f"buffer_chunk_{index}.npz"
+                write_atomic(os.path.join(self.run_state_dir, chunk_file), lambda f: np.savez(f, **chunk["arrays"]))
+                self.chunks.append({"file": chunk_file, "start": chunk["start"], "count": chunk["count"]})
+            # drop the chunks whose ring positions were all overwritten by newer chunks
+            kept, newer = [], 0
+            for entry in reversed(self.chunks):
+                if newer >= buffer_size:
+                    break
+                kept.append(entry)
+                newer += entry["count"]
+            self.chunks = kept[::-1]
+
+        manifest = {
+            "checkpoint": index,
+            "state_file": state_file,
+            "num_timesteps": state["num_timesteps"],
+            "buffer_size": buffer_size,
+            "buffer_pos": buffer_pos,
+            "chunks": self.chunks,
+        }
+        write_atomic(os.path.join(self.run_state_dir, MANIFEST_FILE), lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+
+        # only now that the manifest points to the new files, the old ones can go
+        referenced = {state_file, MANIFEST_FILE, *(entry["file"] for entry in self.chunks)}
+        for name in os.listdir(self.run_state_dir):
+            if name not in referenced and not name.endswith(".tmp"):
+                os.remove(os.path.join(self.run_state_dir, name))
+        if self.verbose >= 1:
+            print(f"Wrote run state checkpoint {index} at step {state['num_timesteps']} to {self.run_state_dir}")
+
+    def join(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.join()
+        self.executor.shutdown()
+
+
+def restore_run_state(model: BaseAlgorithm, run_state_dir: str, verbose: int = 1) -> dict:
+    """
+    loads the latest checkpoint of a RunStateCheckpointer into a model created with the same arguments,
+    including its replay buffer and the RNG states. Returns the extra state passed to save
+    """
+    manifest = load_manifest(run_state_dir)
+    assert manifest is not None, f"no run state checkpoint in {run_state_dir}"
+    state = th.load(os.path.join(run_state_dir, manifest["state_file"]), map_location="cpu", weights_only=False)
+
+    model.set_parameters(state["params"], exact_match=True, device=model.device)
+    for name, value in state["pytorch_variables"].items():
+        recursive_setattr(model, f"{name}.data", value.data.to(model.device))
+    model.num_timesteps = state["num_timesteps"]
+    model._episode_num = state["episode_num"]
+    if hasattr(model, "_n_updates"):
+        model._n_updates = state["n_updates"]
+    if state["ep_info_buffer"] is not None:
+        model.ep_info_buffer = deque(state["ep_info_buffer"], maxlen=model._stats_window_size)
+    if state["ep_success_buffer"] is not None:
+        model.ep_success_buffer = deque(state["ep_success_buffer"], maxlen=model._stats_window_size)
+
+    buffer = getattr(model, "replay_buffer", None)
+    if buffer is not None and state["buffer_state"] is not None:
+        assert manifest["buffer_size"] == buffer.buffer_size, "the replay buffer size changed since the checkpoint"
+        arrays = transition_arrays(buffer)
+        for entry in manifest["chunks"]:
+            indices = (entry["start"] + np.arange(entry["count"])) % buffer.buffer_size
+            # HER stores its infos as object arrays
+            with np.load(os.path.join(run_state_dir, entry["file"]), allow_pickle=True) as chunk:
+                for name, array in arrays.items():
+                    array[indices] = chunk[name]
+        for name, value in state["buffer_state"].items():
+            setattr(buffer, name, value)
+
+    set_rng_states(state["rng_states"])
+    if verbose >= 1:
+        print(f"Restored run state checkpoint {manifest['checkpoint']} at step {model.num_timesteps} from {run_state_dir}")
+    return state["extra"]
@@ -0,0 +1,332 @@
+import inspect
+import os
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import gymnasium as gym
+
+from .profiling import sum_phase_times
+
+
+class TaskSpace:
+    """
+    A curriculum task space: a BDDL template and the parameter values it is swept over, e.g.
+    TaskSpace(bddl, np.arange(0.1, 1.0, 0.1)). BDDLs are only rendered when a step is actually used.
+    A parameter value is passed to template.format as a single positional argument, or unpacked if it is a
+    tuple (positional) or dict (named).
+    """
+    def __init__(self, template: str, params: Sequence[Any]):
+        self.template = template
+        self.params = list(params)
+
+    def __len__(self):
+        return len(self.params)
+
+    def render_value(self, value) -> str:
+        """renders the template for any parameter value, including ones between the grid points"""
+        if isinstance(value, dict):
+            return self.template.format(**value)
+        if isinstance(value, tuple):
+            return self.template.format(*value)
+        return self.template.format(value)
+
+    def render(self, index: int) -> str:
+        return self.render_value(self.params[index])
+
+
+class CurriculumStep:
+    """one subtask of a curriculum, either a fixed BDDL string or a step of a TaskSpace rendered on first access"""
+    def __init__(self, name: str, task_name: str, bddl: Optional[str] = None, task_space: Optional[TaskSpace] = None, index: Optional[int] = None):
+        assert (bddl is None) != (task_space is None), "a curriculum step needs either a bddl or a task space"
+        self.name = name
+        self.task_name = task_name
+        self.task_space = task_space
+        self.index = index
+        self._bddl = bddl
+
+    @property
+    def param(self):
+        """the parameter value of a task space step, None for fixed BDDLs"""
+        return self.task_space.params[self.index] if self.task_space is not None else None
+
+    @property
+    def bddl(self) -> str:
+        if self._bddl is None:
+            self._bddl = self.task_space.render(self.index)
+        return self._bddl
+
+    def matches(self, task_name: str, value: Optional[str] = None) -> bool:
+        """whether this is the step of task_name with the parameter value (compared as floats if possible)"""
+        if task_name != self.task_name:
+            return False
+        if value is None:
+            return True
+        if self.param is None:
+            return False
+        try:
+            return bool(np.isclose(float(self.param), float(value)))
+        except (TypeError, ValueError):
+            return str(self.param) == value
+
+    def __repr__(self):
+        return f"CurriculumStep({self.name}, param={self.param})" if self.task_space is not None else f"CurriculumStep({self.name})"
+
+
+def load_curriculum(
+    curriculum_file: str,
+    ignore_until: str = "",
+    ignore_tasks: List[str] = [],
+    resume_from: Optional[str] = None,
+) -> List[CurriculumStep]:
+    """
+    Reads a curriculum file: every function without arguments is a task, in definition order. A task function
+    returns a BDDL string, a list of BDDL strings, or a TaskSpace, whose BDDLs are rendered lazily.
+    Steps of lists and task spaces are named <function>_<index>.
+
+    :param ignore_until: skip all steps before the step (or the first step of the task) with this name
+    :param ignore_tasks: names of task functions to leave out
+    :param resume_from: "<task>=<value>" skips all steps before the step of the task with this parameter value,
+        or "<task>" skips all steps before the task
+    """
+    assert curriculum_file is not None
+    assert os.path.exists(curriculum_file)
+    with open(curriculum_file, 'r') as f:
+        curriculum_file_str = f.read()
+
+    namespace = {"TaskSpace": TaskSpace}
+    exec(curriculum_file_str, namespace)
+
+    steps: List[CurriculumStep] = []
+    for k, func in namespace.items():
+        if not inspect.isfunction(func) or inspect.isbuiltin(func): # ignore non-functions and builtins
+            continue
+        if k.startswith("__") and k.endswith("__"): # ignore functions named __name__
+            continue
+        if k in ignore_tasks:
+            print(f"skipping {k} in ignore_tasks")
+            continue
+        if len(inspect.signature(func).parameters) != 0:
+            continue
+        task = func()
+        if type(task) is str:
+            steps.append(CurriculumStep(k, k, bddl=task))
+            print(f"Added single task '{k}'")
+        elif isinstance(task, TaskSpace):
+            steps.extend(CurriculumStep(f"{k}_{i}", k, task_space=task, index=i) for i in range(len(task)))
+            print(f"Added task space '{k}' with {len(task)} steps from {task.params[0]} to {task.params[-1]}")
+        elif type(task) is list:
+            for i, bddl in enumerate(task):
+                assert type(bddl) is str
+                steps.append(CurriculumStep(f"{k}_{i}", k, bddl=bddl))
+            print(f"Added task space '{k}' with {len(task)} steps")
+
+    start = 0
+    if ignore_until != "":
+        start = next((i for i, step in enumerate(steps) if step.name == ignore_until or step.task_name == ignore_until), None)
+        assert start is not None, f"no curriculum step named {ignore_until}"
+    if resume_from is not None:
+        task_name, _, value = resume_from.partition("=")
+        start = next((i for i, step in enumerate(steps) if step.matches(task_name, value or None)), None)
+        assert start is not None, f"no curriculum step matches {resume_from}"
+    if start > 0:
+        print(f"skipping {start} steps, starting at {steps[start]}")
+    return steps[start:]
+
+
+class SwitchableTaskEnv(gym.Env):
+    """
+    Env whose task (BDDL file) can be switched from the learner with env_method("switch_task", ...), so a vec env
+    worker can move between curriculum steps without restarting the worker pool.
+    A switch is applied on the next reset, so the current episode always finishes on its own task. The envs of the
+    last max_cached_tasks tasks are kept, so switching back and forth between neighbouring steps is cheap.
+    Every step reports the task it ran on in info["task_index"].
+    """
+    def __init__(self, make_env: Callable[[str], gym.Env], bddl_file: str, task_index: int = 0, max_cached_tasks: int = 3):
+        assert max_cached_tasks >= 1, "the env of the current task has to stay cached"
+        self.make_env = make_env
+        self.max_cached_tasks = max_cached_tasks
+        self.task_index = task_index
+        self.env = make_env(bddl_file)
+        self.envs: "OrderedDict[int, gym.Env]" = OrderedDict([(task_index, self.env)])
+        self.observation_space = self.env.observation_space
+        self.action_space = self.env.action_space
+        self.pending_task: Optional[Tuple[int, str]] = None
+        self.retired_phase_times = []
+
+    def switch_task(self, task_index: int, bddl_file: str):
+        """switches to the task on the next reset"""
+        self.pending_task = None if task_index == self.task_index else (task_index, bddl_file)
+
+    def _apply_pending_task(self):
+        if self.pending_task is None:
+            return
+        task_index, bddl_file = self.pending_task
+        self.pending_task = None
+        if task_index not in self.envs:
+            env = self.make_env(bddl_file)
+            assert env.observation_space == self.observation_space and env.action_space == self.action_space, \
+                f"task {task_index} ({bddl_file}) has different observation or action spaces than the other curriculum steps"
+            self.envs[task_index] = env
+            while len(self.envs) > self.max_cached_tasks:
+                _, evicted = self.envs.popitem(last=False)
+                if hasattr(evicted, "phase_times"):
+                    self.retired_phase_times.append(evicted.phase_times)
+                self._close_task_env(evicted)
+        self.envs.move_to_end(task_index)
+        self.task_index = task_index
+        self.env = self.envs[task_index]
+
+    @property
+    def phase_times(self):
+        """phase times summed over the envs of all tasks this worker has run"""
+        return sum_phase_times([*self.retired_phase_times, *(env.phase_times for env in self.envs.values() if hasattr(env, "phase_times"))])
+
+    def step(self, action):
+        obs, reward, done, truncated, info = self.env.step(action)
+        info["task_index"] = self.task_index
+        return obs, reward, done, truncated, info
+
+    def reset(self, seed=None, **kwargs):
+        self._apply_pending_task()
+        return self.env.reset(seed=seed, **kwargs)
+
+    def seed(self, seed=None):
+        return self.env.seed(seed)
+
+    @staticmethod
+    def _close_task_env(env: gym.Env):
+        """closes a task env and the LIBERO env inside it, since the gym env classes do not close their simulator and renderer"""
+        env.close()
+        libero_env = getattr(env, "env", None) or getattr(env, "_env", None)
+        if libero_env is not None:
+            libero_env.close()
+
+    def close(self):
+        for env in self.envs.values():
+            self._close_task_env(env)
+        self.envs.clear()
+
+    def __getattr__(self, name):
+        # everything else (e.g. env_method calls) goes to the env of the current task
+        if name.startswith("_") or name == "env":
+            raise AttributeError(name)
+        return getattr(self.env, name)
+
+
+class LearningProgressScheduler:
+    """
+    Keeps the previous, current and next curriculum steps active at once and splits the env workers between them
+    according to their learning progress, the absolute change in success rate between the older and the newer half
+    of the last 2 * progress_window episodes of a task. Tasks without enough episodes yet count as progress_prior.
+    The current step always keeps at least min_current_share of the workers. It advances once its success rate over
+    the last success_window episodes reaches success_rate_threshold.
+    """
+    def __init__(
+        self,
+        num_tasks: int,
+        num_envs: int,
+        success_rate_threshold: float,
+        success_window: int = 50,
+        progress_window: int = 25,
+        progress_prior: float = 0.1,
+        min_current_share: float = 0.5,
+        current_task: int = 0,
+    ):
+        self.num_tasks = num_tasks
+        self.num_envs = num_envs
+        self.success_rate_threshold = success_rate_threshold
+        self.success_window = success_window
+        self.progress_window = progress_window
+        self.progress_prior = progress_prior
+        self.min_current_share = min_current_share
+        self.current_task = current_task
+        self.successes: Dict[int, deque] = {}
+        # every worker starts on the current task
+        self.assignment: List[int] = [current_task] * num_envs
+
+    def record(self, task_index: int, success: bool):
+        maxlen = max(self.success_window, 2 * self.progress_window)
+        self.successes.setdefault(task_index, deque(maxlen=maxlen)).append(float(success))
+
+    def success_rate(self, task_index: int) -> Optional[float]:
+        history = list(self.successes.get(task_index, []))[-self.success_window:]
+        return float(np.mean(history)) if len(history) > 0 else None
+
+    def learning_progress(self, task_index: int) -> float:
+        history = list(self.successes.get(task_index, []))
+        if len(history) < 2 * self.progress_window:
+            return self.progress_prior
+        older = history[-2 * self.progress_window:-self.progress_window]
+        newer = history[-self.progress_window:]
+        return abs(float(np.mean(newer)) - float(np.mean(older)))
+
+    def active_tasks(self) -> List[int]:
+        return [task for task in (self.current_task - 1, self.current_task, self.current_task + 1) if 0 <= task < self.num_tasks]
+
+    @property
+    def is_final_task(self) -> bool:
+        return self.current_task == self.num_tasks - 1
+
+    def maybe_advance(self) -> bool:
+        """moves on to the next curriculum step if the current one is solved. Returns whether it did"""
+        if self.is_final_task or len(self.successes.get(self.current_task, [])) < self.success_window:
+            return False
+        success_rate = self.success_rate(self.current_task)
+        if success_rate < self.success_rate_threshold:
+            return False
+        print(f"Task {self.current_task} reached success rate {success_rate}, advancing to task {self.current_task + 1}")
+        self.current_task += 1
+        return True
+
+    def target_counts(self) -> Dict[int, int]:
+        """number of workers per active task"""
+        active = self.active_tasks()
+        min_current = min(self.num_envs, int(np.ceil(self.min_current_share * self.num_envs)))
+        others = [task for task in active if task != self.current_task]
+        counts = {task: 0 for task in active}
+        counts[self.current_task] = min_current
+        remaining = self.num_envs - min_current
+        if remaining == 0 or len(others) == 0:
+            counts[self.current_task] += remaining
+            return counts
+        # the remaining workers go to all active tasks by learning progress, with largest remainder rounding
+        progress = np.array([self.learning_progress(task) for task in active]) + 1e-6
+        shares = remaining * progress / progress.sum()
+        floors = np.floor(shares).astype(int)
+        for i in np.argsort(floors - shares)[:remaining - floors.sum()]:
+            floors[i] += 1
+        for task, count in zip(active, floors):
+            counts[task] += int(count)
+        return counts
+
+    def reassign(self) -> List[Tuple[int, int]]:
+        """
+        updates the worker assignment to the target counts, moving as few workers as possible.
+        Returns the (worker index, task index) pairs that changed.
+        """
+        counts = self.target_counts()
+        kept = {task: 0 for task in counts}
+        to_move = []
+        for worker, task in enumerate(self.assignment):
+            if task in counts and kept[task] < counts[task]:
+                kept[task] += 1
+            else:
+                to_move.append(worker)
+        changes = []
+        for task, count in counts.items():
+            for _ in range(count - kept[task]):
+                worker = to_move.pop(0)
+                self.assignment[worker] = task
+                changes.append((worker, task))
+        return changes
+
+    def summary(self) -> Dict[int, dict]:
+        return {
+            task: {
+                "workers": self.assignment.count(task),
+                "success_rate": self.success_rate(task),
+                "learning_progress": self.learning_progress(task),
+            }
+            for task in self.active_tasks()
+        }
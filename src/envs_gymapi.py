@@ -10,6 +10,8 @@ from libero.libero.envs import OffScreenRenderEnv
 from libero.libero.envs.objects.articulated_objects import Microwave, SlideCabinet, Window, Faucet, BasinFaucet, ShortCabinet, ShortFridge, WoodenCabinet, WhiteCabinet, FlatStove
 
 from src.dense_reward import DenseReward
+from src.sparse_reward import SparseGoalTracker
+from src.profiling import PhaseTimer, time_render_calls
 import datetime
 
 current_time = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -64,6 +66,61 @@ class MapObjects():
         
         return goal_value, goal_ranges
     
+def set_cameras_enabled(env: OffScreenRenderEnv, enabled: bool):
+    """
+    turns the camera observables of a LIBERO env on or off. Disabled cameras are not rendered on env steps,
+    which is used to skip the renders on the intermediate substeps of an action repeat.
+    """
+    if getattr(env, "_cameras_enabled", True) == enabled:
+        return
+    for observable in env.env._observables.values():
+        if observable.modality == "image":
+            observable.set_enabled(enabled)
+    env._cameras_enabled = enabled
+
+
+def repeat_step(env: OffScreenRenderEnv, action, substep: int, action_repeat: int):
+    """
+    steps the LIBERO env for one substep of an action repeat.
+    Only the last substep renders the cameras, the observations of earlier substeps are thrown away.
+    """
+    set_cameras_enabled(env, substep == action_repeat - 1)
+    return env.step(action)
+
+
+def repeat_final_obs(env: OffScreenRenderEnv, obs, substep: int, action_repeat: int):
+    """
+    returns the observations after an action repeat. If the repeat stopped early (e.g. success or truncation),
+    the cameras were off on the last substep, so they are re-enabled and the observations recomputed.
+    """
+    if substep == action_repeat - 1:
+        return obs
+    set_cameras_enabled(env, True)
+    return env.env._get_observations(force_update=True)
+
+class EpisodeStats:
+    """
+    Accumulates the statistics of the current episode inside the env worker. They are only shipped to the learner
+    once, in info["episode_stats"] of the last step of the episode, so logging them costs no extra IPC.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.reward = 0.0
+        self.length = 0
+
+    def step(self, reward: float):
+        self.reward += float(reward)
+        self.length += 1
+
+    def finish(self, success: bool, **goal_stats) -> dict:
+        """the stats of the finished episode, e.g. with goal_progress or goal_distance"""
+        stats = {"reward": self.reward, "success": float(success), "length": self.length}
+        stats.update({name: float(value) for name, value in goal_stats.items()})
+        self.reset()
+        return stats
+
 class LowDimensionalObsGymEnv(gym.Env):
     """ Sparse or dense reward environment with all the low-dimensional states
     """
@@ -76,6 +133,9 @@ class LowDimensionalObsGymEnv(gym.Env):
         steps_per_episode = 250,
         sim_states: Optional[np.ndarray] = None, 
         setup_demo: Optional[np.ndarray] = None,
+        sparse_goal_tracking: bool = False,
+        completed_goal_check_freq: int = 10,
+        action_repeat: int = 1,
         verbose=1, # 
         **kwargs
     ):
@@ -87,6 +147,9 @@ class LowDimensionalObsGymEnv(gym.Env):
             dense_reward_multiplier (float): multiplier applied to the dense reward
             steps_per_episode (int): truncate the episode if the number of steps exceeds this
             setup_demo (str): path to a demo directory (containing a demo.hdf5) to run before each episode
+            sparse_goal_tracking (bool): without shaping rewards, track goal progress incrementally instead of evaluating every goal predicate each step (see SparseGoalTracker)
+            completed_goal_check_freq (int): with sparse_goal_tracking, how many steps between re-evaluations of already completed goals
+            action_repeat (int): number of control steps each action is applied for. Rewards are summed over the repeated steps and steps_per_episode still counts control steps
             verbose (int): verbosity of print output
                 - 0: no prints
                 - 1: a few permanent lines
@@ -96,8 +159,11 @@ class LowDimensionalObsGymEnv(gym.Env):
         """
 
         assert is_shaping_reward or sparse_reward > 0, "Must use at least one of shaping or sparse rewards"
+        assert action_repeat >= 1, "action_repeat must be at least 1"
 
         self.env = OffScreenRenderEnv(**kwargs)
+        self.phase_timer = PhaseTimer()
+        time_render_calls(self.phase_timer, self.env.sim)
         obs = self.env.env._get_observations()
         low_dim_obs = self.get_low_dim_obs(obs)
         self.observation_space = Box(low=-np.inf, high=np.inf, shape=low_dim_obs.shape, dtype="float32")
@@ -111,7 +177,9 @@ class LowDimensionalObsGymEnv(gym.Env):
         self.steps_per_episode = steps_per_episode
         self.sim_states = sim_states
         self.setup_demo = setup_demo
+        self.action_repeat = action_repeat
         self.verbose = verbose
+        self.episode_stats = EpisodeStats()
 
         # for multi-goal tasks
         self.current_goal_index = 0
@@ -131,6 +199,11 @@ class LowDimensionalObsGymEnv(gym.Env):
             self.env.env.reward_geoms = reward_geoms
             self.shaping_reward = {}
 
+        # incremental goal tracking for sparse-only rewards
+        self.goal_tracker: Optional[SparseGoalTracker] = None
+        if sparse_goal_tracking and not is_shaping_reward:
+            self.goal_tracker = SparseGoalTracker(self.goal_states, self._eval_predicate, self._check_success, completed_goal_check_freq)
+
         if self.verbose >= 1:
             if is_shaping_reward:
                 print("using shaping rewards:", self.shaping_reward)
@@ -143,12 +216,70 @@ class LowDimensionalObsGymEnv(gym.Env):
             obs[k] for k in obs.keys() if not k.endswith("image")
         ], axis = -1)
     
+    @property
+    def phase_times(self):
+        """accumulated wall time per step phase in this worker, see PhaseTimer.summary"""
+        return self.phase_timer.summary()
+
     def step(self, action):
-        obs, reward, done, info = self.env.step(action)
+        with self.phase_timer.phase("step"):
+            return self._step(action)
+
+    def _step(self, action):
+        reward = 0.0
+        for substep in range(self.action_repeat):
+            with self.phase_timer.phase("env_step"):
+                obs, _, _, info = repeat_step(self.env, action, substep, self.action_repeat)
+
+            with self.phase_timer.phase("reward"):
+                substep_reward, success = self._compute_reward()
+            reward += substep_reward
+
+            if self.verbose >= 4: print(f"reward at step {self.step_count}: {substep_reward}")
+            self.step_count += 1
+            truncated = self.step_count >= self.steps_per_episode
+            if success or truncated:
+                break
+        obs = repeat_final_obs(self.env, obs, substep, self.action_repeat)
+
+        # logistics
+        done = success or truncated
+        if done and self.verbose >= 2:
+            print("done. success:", success)
+        if "agentview_image" in obs: # not rendered when camera observations are turned off
+            info["agentview_image"] = obs["agentview_image"]
+        info["is_success"] = success
+        with self.phase_timer.phase("sim_state"):
+            info["sim_state"] = self.env.sim.get_state()
+        self.episode_stats.step(reward)
+        if done:
+            info["episode_stats"] = self.episode_stats.finish(success, goal_progress=1.0 if success else self.goal_progress())
+
+        with self.phase_timer.phase("low_dim_obs"):
+            low_dim_obs = self.get_low_dim_obs(obs)
+        return low_dim_obs, reward, done, truncated, info
+
+    def goal_progress(self) -> float:
+        """fraction of the goal states completed in this episode"""
+        if len(self.goal_states) == 0:
+            return 0.0
+        return len(self.completed_goals) / len(self.goal_states)
+
+    def _check_success(self):
+        with self.phase_timer.phase("check_success"):
+            return self.env.check_success()
+
+    def _eval_predicate(self, state):
+        with self.phase_timer.phase("eval_predicate"):
+            return self.env.env._eval_predicate(state)
+
+    def _compute_reward(self):
+        if self.goal_tracker is not None:
+            return self._compute_tracked_sparse_reward()
 
         # sparse completion reward
         if self.sparse_reward:
-            success = self.env.check_success()
+            success = self._check_success()
         else:
             success = False
         reward = 0.0
@@ -158,7 +289,7 @@ class LowDimensionalObsGymEnv(gym.Env):
             # if not using dense reward, only check sparse predicate
             state = self.goal_states[self.current_goal_index] # complete multiple goals in order
             state_tuple = tuple(state)
-            result = self.env.env._eval_predicate(state) # FIXME: would this be an extra call to the predicates, since check_success() was called earlier?
+            result = self._eval_predicate(state) # FIXME: would this be an extra call to the predicates, since check_success() was called earlier?
             if result:
                 if state_tuple not in self.completed_goals:
                     if self.verbose >= 3: print(f"achieved {state_tuple}")
@@ -171,7 +302,7 @@ class LowDimensionalObsGymEnv(gym.Env):
             # when using dense reward, check sparse predicate and add dense reward
             state = self.goal_states[self.current_goal_index] # complete multiple goals in order
             state_tuple = tuple(state)
-            result = self.env.env._eval_predicate(state)
+            result = self._eval_predicate(state)
             if result:
                 # if already completed, we do not get any reward
                 if state_tuple not in self.completed_goals:
@@ -184,33 +315,53 @@ class LowDimensionalObsGymEnv(gym.Env):
                         if self.verbose >= 3: print("current goal index: ", self.current_goal_index)
             else:
                 dense_reward_object = self.shaping_reward[state_tuple]
-                if self.current_goal_index == len(self.goal_states) - 1:
-                    reward += self.dense_reward_multiplier * dense_reward_object.dense_reward(step_count=self.step_count)
-                else:
-                    reward += dense_reward_object.dense_reward(step_count=self.step_count)
+                with self.phase_timer.phase("dense_reward"):
+                    if self.current_goal_index == len(self.goal_states) - 1:
+                        reward += self.dense_reward_multiplier * dense_reward_object.dense_reward(step_count=self.step_count)
+                    else:
+                        reward += dense_reward_object.dense_reward(step_count=self.step_count)
 
         # small reward for a task remaining in complete mode
         if len(self.goal_states) > 1:
             for state in self.goal_states:
-                if self.env.env._eval_predicate(state):        
+                if self._eval_predicate(state):        
                     if self.verbose >= 4: print("small reward for state: ", state)
                     reward += self.sparse_reward / 1000.0
 
-        # logistics
-        if self.verbose >= 4: print(f"reward at step {self.step_count}: {reward}")
-        self.step_count += 1
-        truncated = self.step_count >= self.steps_per_episode
-        done = success or truncated
-        if done and self.verbose >= 2:
-            print("done. success:", success)
-        info["agentview_image"] = obs["agentview_image"]
-        info["is_success"] = success
-        info["sim_state"] = self.env.sim.get_state()
+        return reward, success
+
+    def _compute_tracked_sparse_reward(self):
+        """
+        Sparse-only reward from the incremental goal tracker. Success and sub-goal rewards match _compute_reward,
+        but the small reward for goals remaining complete uses the tracker's cached results for completed goals
+        and does not look at goals past the current one.
+        """
+        success, newly_completed = self.goal_tracker.update()
+        self.current_goal_index = self.goal_tracker.current_goal_index
+        reward = 0.0
+        if success:
+            reward = self.sparse_reward
+        elif newly_completed > 0:
+            for state in self.goal_states[self.goal_tracker.num_completed - newly_completed:self.goal_tracker.num_completed]:
+                if self.verbose >= 3: print(f"achieved {tuple(state)}")
+                self.completed_goals.add(tuple(state))
+            if self.verbose >= 3: print("current goal index: ", self.current_goal_index)
+            reward += newly_completed * self.sparse_reward / 10.0
 
-        return self.get_low_dim_obs(obs), reward, done, truncated, info
+        # small reward for a task remaining in complete mode
+        if len(self.goal_states) > 1:
+            reward += self.goal_tracker.num_holding() * self.sparse_reward / 1000.0
+
+        return reward, success
     
     def reset(self, seed=None):
+        with self.phase_timer.phase("reset"):
+            obs = self._reset()
+        return obs, {}
+
+    def _reset(self):
         obs = self.env.reset()
+        time_render_calls(self.phase_timer, self.env.sim)
 
         # load random simulation
         if self.sim_states is not None:
@@ -227,10 +378,13 @@ class LowDimensionalObsGymEnv(gym.Env):
 
         obs = self.get_low_dim_obs(obs)
         self.step_count = 0
+        self.episode_stats.reset()
         self.current_goal_index = 0
         self.completed_goals.clear()
+        if self.goal_tracker is not None:
+            self.goal_tracker.reset()
 
-        return obs, {}
+        return obs
     
     def seed(self, seed=None):
         return self.env.seed(seed)
@@ -243,12 +397,51 @@ class LowDimensionalObsGymEnv(gym.Env):
             qposs.append(qpos)
         return np.array(qposs)
 
-    
+    @property
+    def sim_state_dim(self) -> int:
+        return self.env.sim.get_state().flatten().shape[0]
+
+    def relabel_rewards(self, flat_sim_states: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rewards and success flags of this env's task for a batch of flattened sim states, e.g. the next states of
+        replay buffer transitions collected on another curriculum step. Like _compute_reward, but only with the terms
+        that depend on the state alone: the success reward and the small reward for goals remaining complete, which
+        multi-goal tasks also get on success. The one-time sub-goal rewards and the dense shaping rewards depend on
+        the episode so far and are left out. Stored rewards of repeated actions are sums over the substeps, which a
+        single end state cannot reproduce, so action_repeat has to be 1.
+        The sim state of the running episode is restored afterwards.
+        """
+        assert self.sparse_reward > 0, "relabeling needs sparse rewards"
+        assert self.action_repeat == 1, "relabeling needs action_repeat 1"
+        # set_state_from_flattened does not check the size, states of a different object set would load as garbage
+        assert flat_sim_states.ndim == 2 and flat_sim_states.shape[1] == self.sim_state_dim, \
+            f"sim states of size {flat_sim_states.shape[-1]} do not match this task's sim state size {self.sim_state_dim}"
+        current_state = self.env.sim.get_state().flatten()
+        rewards = np.zeros(len(flat_sim_states), dtype=np.float32)
+        successes = np.zeros(len(flat_sim_states), dtype=bool)
+        with self.phase_timer.phase("relabel"):
+            for i, sim_state in enumerate(flat_sim_states):
+                self.env.sim.set_state_from_flattened(sim_state)
+                self.env.sim.forward()
+                successes[i] = self._check_success()
+                if successes[i]:
+                    rewards[i] = self.sparse_reward
+                # small reward for a task remaining in complete mode, as in _compute_reward
+                if len(self.goal_states) > 1:
+                    rewards[i] += sum(self._eval_predicate(state) for state in self.goal_states) * self.sparse_reward / 1000.0
+            self.env.sim.set_state_from_flattened(current_state)
+            self.env.sim.forward()
+        return rewards, successes
+
+
 class LowDimensionalObsGymGoalEnv(gym.Env):
     """ Sparse reward environment with all the low-dimensional states with HER
     """
-    def __init__(self, verbose=1, **kwargs):
+    def __init__(self, verbose=1, action_repeat: int = 1, **kwargs):
         self._env = OffScreenRenderEnv(**kwargs)
+        self.action_repeat = action_repeat
+        self.phase_timer = PhaseTimer()
+        time_render_calls(self.phase_timer, self._env.sim)
         self.obj_of_interest = self._env.obj_of_interest[0]  # hardcoded for now
         self.instruction = self._env.language_instruction
         obs = self._env.env._get_observations()
@@ -269,6 +462,7 @@ class LowDimensionalObsGymGoalEnv(gym.Env):
         self.action_space = Box(low=-1, high=1, shape=(7,), dtype="float32")
         self.step_count = 0
         self.episode_count = 0
+        self.episode_stats = EpisodeStats()
 
         # logging
         self.images = []
@@ -287,12 +481,27 @@ class LowDimensionalObsGymGoalEnv(gym.Env):
             qposs.append(qpos)
         return np.array(qposs)
     
+    @property
+    def phase_times(self):
+        """accumulated wall time per step phase in this worker, see PhaseTimer.summary"""
+        return self.phase_timer.summary()
+
     def step(self, action):
-        obs, reward, done, info = self._env.step(action)
-        success = self._env.check_success()
-        reward = 10.0 * success
-        self.step_count += 1
-        truncated = self.step_count >= 250
+        with self.phase_timer.phase("step"):
+            return self._step(action)
+
+    def _step(self, action):
+        for substep in range(self.action_repeat):
+            with self.phase_timer.phase("env_step"):
+                obs, reward, done, info = repeat_step(self._env, action, substep, self.action_repeat)
+            with self.phase_timer.phase("reward"):
+                success = self._env.check_success()
+                reward = 10.0 * success
+            self.step_count += 1
+            truncated = self.step_count >= 250
+            if success or truncated:
+                break
+        obs = repeat_final_obs(self._env, obs, substep, self.action_repeat)
         # truncated = False # added in order not to truncate
         done = success or truncated
 
@@ -303,20 +512,28 @@ class LowDimensionalObsGymGoalEnv(gym.Env):
         if done:
             self.episode_count += 1
 
-        info["agentview_image"] = obs["agentview_image"]
+        achieved_goal = self.get_achieved_goal()
+        if "agentview_image" in obs: # not rendered when camera observations are turned off
+            info["agentview_image"] = obs["agentview_image"]
         info["is_success"] = success
+        self.episode_stats.step(reward)
+        if done:
+            info["episode_stats"] = self.episode_stats.finish(success, goal_distance=np.linalg.norm(achieved_goal - self.desired_goal))
 
         return \
             {   
                 "observation": self.get_low_dim_obs(obs),
                 "desired_goal": self.desired_goal,
-                "achieved_goal": self.get_achieved_goal()
+                "achieved_goal": achieved_goal
             }, reward, done, truncated, info
     
     def reset(self, seed=None):
-        obs = self._env.reset()
+        with self.phase_timer.phase("reset"):
+            obs = self._env.reset()
+        time_render_calls(self.phase_timer, self._env.sim)
         self.episode_count = 0
         self.step_count = 0
+        self.episode_stats.reset()
         return \
             {   
                 "observation": self.get_low_dim_obs(obs),
@@ -343,33 +560,54 @@ class LowDimensionalObsGymGoalEnv(gym.Env):
 class AgentViewGymEnv(gym.Env):
     """ Sparse reward environment with image observations
     """
-    def __init__(self, verbose=1, **kwargs):
+    def __init__(self, verbose=1, action_repeat: int = 1, **kwargs):
         self._env = OffScreenRenderEnv(**kwargs)
+        self.action_repeat = action_repeat
+        self.phase_timer = PhaseTimer()
+        time_render_calls(self.phase_timer, self._env.sim)
         obs_shape = self._env.env._get_observations()["agentview_image"].shape
 
         self.observation_space = Box(low=0, high=255, shape=obs_shape, dtype="uint8")
         self.action_space = Box(low=-1, high=1, shape=(7,), dtype="float32")
 
-        self.custom_attr = {"total_reward": 0, "reward": 0} # custom attributes for tensorboard logging
+        self.episode_stats = EpisodeStats()
         self.step_count = 0
     
+    @property
+    def phase_times(self):
+        """accumulated wall time per step phase in this worker, see PhaseTimer.summary"""
+        return self.phase_timer.summary()
+
     def step(self, action):
-        obs, reward, done, info = self._env.step(action)
-        success = self._env.check_success()
-        reward = 10.0 * success
-        self.step_count += 1
-        truncated = self.step_count >= 250
+        with self.phase_timer.phase("step"):
+            return self._step(action)
+
+    def _step(self, action):
+        for substep in range(self.action_repeat):
+            with self.phase_timer.phase("env_step"):
+                obs, reward, done, info = repeat_step(self._env, action, substep, self.action_repeat)
+            with self.phase_timer.phase("reward"):
+                success = self._env.check_success()
+                reward = 10.0 * success
+            self.step_count += 1
+            truncated = self.step_count >= 250
+            if success or truncated:
+                break
+        obs = repeat_final_obs(self._env, obs, substep, self.action_repeat)
         done = success or truncated
         info["agentview_image"] = obs["agentview_image"]
         info["is_success"] = success
-        self.custom_attr["reward"] = reward
-        self.custom_attr["total_reward"] = self.custom_attr["total_reward"] + reward
+        self.episode_stats.step(reward)
+        if done:
+            info["episode_stats"] = self.episode_stats.finish(success)
         return obs["agentview_image"], reward, done, truncated, info
     
     def reset(self, seed=None):
-        obs = self._env.reset()
+        with self.phase_timer.phase("reset"):
+            obs = self._env.reset()
+        time_render_calls(self.phase_timer, self._env.sim)
         self.step_count = 0
-        self.custom_attr = {"total_reward": 0, "reward": 0}
+        self.episode_stats.reset()
         return obs["agentview_image"], {}
     
     def seed(self, seed=None):
@@ -385,7 +623,7 @@ class AgentViewSimpleGymEnv(gym.Env):
         self.observation_space = Box(low=0, high=255, shape=obs_shape, dtype="uint8")
         self.action_space = Box(low=-1, high=1, shape=(7,), dtype="float32")
 
-        self.custom_attr = {"total_reward": 0, "reward": 0} # custom attributes for tensorboard logging
+        self.episode_stats = EpisodeStats()
         self.step_count = 0
     
     def step(self, action):
@@ -397,8 +635,9 @@ class AgentViewSimpleGymEnv(gym.Env):
         truncated = self.step_count >= 250
         done = success or truncated
         info["agentview_image"] = obs["agentview_image"]
-        self.custom_attr["reward"] = reward
-        self.custom_attr["total_reward"] = self.custom_attr["total_reward"] + reward
+        self.episode_stats.step(np.sum(reward)) # reward is per goal joint here
+        if done:
+            info["episode_stats"] = self.episode_stats.finish(success)
         return obs["agentview_image"], reward, done, truncated, info
 
     def get_achieved_goal(self):
@@ -421,7 +660,7 @@ class AgentViewSimpleGymEnv(gym.Env):
     def reset(self, seed=None):
         obs = self._env.reset()
         self.step_count = 0
-        self.custom_attr = {"total_reward": 0, "reward": 0}
+        self.episode_stats.reset()
         return obs["agentview_image"], {}
     
     def seed(self, seed=None):
@@ -431,8 +670,11 @@ class AgentViewSimpleGymEnv(gym.Env):
 class AgentViewGymGoalEnv(gym.Env):
     """ Sparse reward environment with image observations
     """
-    def __init__(self, verbose=1, **kwargs):
+    def __init__(self, verbose=1, action_repeat: int = 1, **kwargs):
         self._env = OffScreenRenderEnv(**kwargs)
+        self.action_repeat = action_repeat
+        self.phase_timer = PhaseTimer()
+        time_render_calls(self.phase_timer, self._env.sim)
         self.obj_of_interest = self._env.obj_of_interest[0]  # hardcoded for now
         obs_shape = self._env.env._get_observations()["agentview_image"].shape
         achieved_goal = self.get_achieved_goal()
@@ -446,7 +688,7 @@ class AgentViewGymGoalEnv(gym.Env):
         })
         self.action_space = Box(low=-1, high=1, shape=(7,), dtype="float32")
 
-        self.custom_attr = {"total_reward": 0, "reward": 0} # custom attributes for tensorboard logging
+        self.episode_stats = EpisodeStats()
         self.step_count = 0
 
     def get_achieved_goal(self):
@@ -457,28 +699,47 @@ class AgentViewGymGoalEnv(gym.Env):
             qposs.append(qpos)
         return np.array(qposs)
     
+    @property
+    def phase_times(self):
+        """accumulated wall time per step phase in this worker, see PhaseTimer.summary"""
+        return self.phase_timer.summary()
+
     def step(self, action):
-        obs, reward, done, info = self._env.step(action)
-        success = self._env.check_success()
-        reward = 10.0 * success
-        self.step_count += 1
-        truncated = self.step_count >= 250
+        with self.phase_timer.phase("step"):
+            return self._step(action)
+
+    def _step(self, action):
+        for substep in range(self.action_repeat):
+            with self.phase_timer.phase("env_step"):
+                obs, reward, done, info = repeat_step(self._env, action, substep, self.action_repeat)
+            with self.phase_timer.phase("reward"):
+                success = self._env.check_success()
+                reward = 10.0 * success
+            self.step_count += 1
+            truncated = self.step_count >= 250
+            if success or truncated:
+                break
+        obs = repeat_final_obs(self._env, obs, substep, self.action_repeat)
         done = success or truncated
         info["agentview_image"] = obs["agentview_image"]
         info["is_success"] = success
-        self.custom_attr["reward"] = reward
-        self.custom_attr["total_reward"] += self.custom_attr["total_reward"]
+        achieved_goal = self.get_achieved_goal()
+        self.episode_stats.step(reward)
+        if done:
+            info["episode_stats"] = self.episode_stats.finish(success, goal_distance=np.linalg.norm(achieved_goal - self.desired_goal))
         return \
             {   
                 "observation": obs["agentview_image"],
                 "desired_goal": self.desired_goal,
-                "achieved_goal": self.get_achieved_goal()
+                "achieved_goal": achieved_goal
             }, reward, done, truncated, info
     
     def reset(self, seed=None):
-        obs = self._env.reset()
+        with self.phase_timer.phase("reset"):
+            obs = self._env.reset()
+        time_render_calls(self.phase_timer, self._env.sim)
         self.step_count = 0
-        self.custom_attr = {"total_reward": 0, "reward": 0}
+        self.episode_stats.reset()
         return \
             {   
                 "observation": obs["agentview_image"],
@@ -0,0 +1,221 @@
+import math
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.vec_env import VecEnv
+
+from .inference import ExportedPolicy
+
+
+def wilson_interval(successes: int, n: int, z: float = 1.96) -> Tuple[float, float]:
+    """Wilson score interval of a success rate, which stays inside [0, 1] and is sensible for rates near 0 or 1"""
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+@dataclass
+class EvalResult:
+    """per-episode outcomes of an evaluation and their summary statistics"""
+    successes: List[bool] = field(default_factory=list)
+    lengths: List[int] = field(default_factory=list)
+    rewards: List[float] = field(default_factory=list)
+
+    def extend(self, other: "EvalResult"):
+        """adds the episodes of another evaluation, e.g. with a different seed"""
+        self.successes.extend(other.successes)
+        self.lengths.extend(other.lengths)
+        self.rewards.extend(other.rewards)
+
+    @property
+    def num_episodes(self) -> int:
+        return len(self.successes)
+
+    @property
+    def success_rate(self) -> float:
+        return float(np.mean(self.successes)) if self.successes else 0.0
+
+    @property
+    def success_rate_ci(self) -> Tuple[float, float]:
+        return wilson_interval(int(np.sum(self.successes)), self.num_episodes)
+
+    @property
+    def mean_length(self) -> float:
+        return float(np.mean(self.lengths)) if self.lengths else 0.0
+
+    @property
+    def mean_length_ci(self) -> Tuple[float, float]:
+        """normal approximation 95% interval of the mean episode length"""
+        if self.num_episodes < 2:
+            return self.mean_length, self.mean_length
+        half_width = 1.96 * float(np.std(self.lengths, ddof=1)) / math.sqrt(self.num_episodes)
+        return self.mean_length - half_width, self.mean_length + half_width
+
+    @property
+    def mean_reward(self) -> float:
+        return float(np.mean(self.rewards)) if self.rewards else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "num_episodes": self.num_episodes,
+            "success_rate": self.success_rate,
+            "success_rate_ci": list(self.success_rate_ci),
+            "mean_length": self.mean_length,
+            "mean_length_ci": list(self.mean_length_ci),
+            "mean_reward": self.mean_reward,
+        }
+
+    def __str__(self) -> str:
+        low, high = self.success_rate_ci
+        length_low, length_high = self.mean_length_ci
+        return (
+            f"{int(np.sum(self.successes))} successes out of {self.num_episodes} "
+            f"({self.success_rate:.4f}, 95% CI [{low:.4f}, {high:.4f}]), "
+            f"average episode length: {self.mean_length:.2f} (95% CI [{length_low:.2f}, {length_high:.2f}])"
+        )
+
+
+def episode_targets(num_episodes: int, num_envs: int) -> np.ndarray:
+    """
+    number of episodes every env has to finish. The episodes are split evenly up front rather than taking the first
+    num_episodes to finish, which would bias the results towards short episodes
+    """
+    return np.array([(num_episodes + i) // num_envs for i in range(num_envs)], dtype=int)
+
+
+def evaluate_policy_vec(
+    model: Union[BaseAlgorithm, ExportedPolicy],
+    envs: VecEnv,
+    num_episodes: int,
+    deterministic: bool = False,
+    step_callback: Optional[Callable[[List[dict], np.ndarray, np.ndarray], None]] = None,
+    verbose: int = 1,
+) -> EvalResult:
+    """
+    Runs num_episodes episodes spread over all the envs of a vec env, with one batched predict per vec env step.
+    The vec env resets finished envs by itself, and envs that finished their share of episodes keep stepping
+    until all envs are done, but their episodes are not counted.
+
+    :param step_callback: called after every step with (infos, dones, counted), where counted marks the envs
+        whose current episode counts towards the evaluation
+    """
+    num_envs = envs.num_envs
+    targets = episode_targets(num_episodes, num_envs)
+    counts = np.zeros(num_envs, dtype=int)
+    episode_rewards = np.zeros(num_envs)
+    episode_lengths = np.zeros(num_envs, dtype=int)
+    result = EvalResult()
+
+    obs = envs.reset()
+    while (counts < targets).any():
+        actions, _ = model.predict(obs, deterministic=deterministic)
+        obs, rewards, dones, infos = envs.step(actions)
+        counted = counts < targets
+        episode_rewards += rewards
+        episode_lengths += 1
+        if step_callback is not None:
+            step_callback(infos, dones, counted)
+
+        for i in np.flatnonzero(dones):
+            if counted[i]:
+                result.successes.append(bool(infos[i].get("is_success", False)))
+                result.lengths.append(int(episode_lengths[i]))
+                result.rewards.append(float(episode_rewards[i]))
+                counts[i] += 1
+                if verbose >= 2:
+                    print(f"episode {result.num_episodes}/{num_episodes}: {result}")
+            episode_rewards[i] = 0.0
+            episode_lengths[i] = 0
+
+    return result
+
+
+def parse_switch_predicate(spec: str, sparse_reward: float) -> Callable[[float, dict], bool]:
+    """
+    parses when a policy chain moves on to its next policy, checked on the step reward and info of every step:
+        - subgoal: a sub-goal was completed, i.e. the step reward exceeds the sub-goal reward of sparse_reward / 10
+        - reward>X: the step reward exceeds X
+        - never: stay on the current policy
+    """
+    if spec == "subgoal":
+        threshold = sparse_reward / 10.0
+        return lambda reward, info: reward > threshold
+    if spec.startswith("reward>"):
+        threshold = float(spec[len("reward>"):])
+        return lambda reward, info: reward > threshold
+    if spec == "never":
+        return lambda reward, info: False
+    raise Exception(f"invalid switch predicate '{spec}'")
+
+
+def slice_obs(obs, mask: np.ndarray):
+    if isinstance(obs, dict):
+        return {key: value[mask] for key, value in obs.items()}
+    return obs[mask]
+
+
+def evaluate_policy_chain(
+    models: List[Union[BaseAlgorithm, ExportedPolicy]],
+    switch_predicates: List[Callable[[float, dict], bool]],
+    envs: VecEnv,
+    num_episodes: int,
+    deterministic: bool = False,
+    step_callback: Optional[Callable[[List[dict], np.ndarray, np.ndarray], None]] = None,
+    verbose: int = 1,
+) -> Tuple[EvalResult, List[int]]:
+    """
+    Evaluates an ordered chain of policies like evaluate_policy_vec. Every env starts an episode on the first policy
+    and moves on to policy i+1 once switch_predicates[i] holds for a step. On every step the envs are grouped by
+    their current policy, so there is one batched predict per policy in use rather than one per env.
+
+    :return: the evaluation result and, for every counted episode, the index of the last policy it reached
+    """
+    assert len(switch_predicates) == len(models) - 1, "need one switch predicate between every pair of policies"
+    num_envs = envs.num_envs
+    targets = episode_targets(num_episodes, num_envs)
+    counts = np.zeros(num_envs, dtype=int)
+    episode_rewards = np.zeros(num_envs)
+    episode_lengths = np.zeros(num_envs, dtype=int)
+    stages = np.zeros(num_envs, dtype=int)
+    actions = np.zeros((num_envs, *envs.action_space.shape), dtype=envs.action_space.dtype)
+    result = EvalResult()
+    stages_reached: List[int] = []
+
+    obs = envs.reset()
+    while (counts < targets).any():
+        for stage, model in enumerate(models):
+            in_stage = stages == stage
+            if in_stage.any():
+                actions[in_stage], _ = model.predict(slice_obs(obs, in_stage), deterministic=deterministic)
+        obs, rewards, dones, infos = envs.step(actions)
+        counted = counts < targets
+        episode_rewards += rewards
+        episode_lengths += 1
+        if step_callback is not None:
+            step_callback(infos, dones, counted)
+
+        for i in range(num_envs):
+            if dones[i]:
+                if counted[i]:
+                    result.successes.append(bool(infos[i].get("is_success", False)))
+                    result.lengths.append(int(episode_lengths[i]))
+                    result.rewards.append(float(episode_rewards[i]))
+                    stages_reached.append(int(stages[i]))
+                    counts[i] += 1
+                    if verbose >= 2:
+                        print(f"episode {result.num_episodes}/{num_episodes} (reached policy {stages[i]}): {result}")
+                episode_rewards[i] = 0.0
+                episode_lengths[i] = 0
+                stages[i] = 0
+            elif stages[i] < len(switch_predicates) and switch_predicates[stages[i]](rewards[i], infos[i]):
+                if verbose >= 3: print(f"env {i} switching to policy {stages[i] + 1}")
+                stages[i] += 1
+
+    return result, stages_reached
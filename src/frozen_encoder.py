@@ -0,0 +1,110 @@
+from typing import Callable, Dict, Union
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+
+from stable_baselines3.common.save_util import load_from_zip_file
+from stable_baselines3.common.vec_env import VecEnv, VecEnvWrapper
+
+from .networks import CustomCNN, CustomCombinedExtractor2, CustomCombinedPatchExtractor, channels_last_input
+
+# where the features extractor's weights live in the policy state dict of PPO and SAC models
+EXTRACTOR_PREFIXES = ["features_extractor.", "actor.features_extractor.", "pi_features_extractor."]
+
+
+def image_encoder(extractor) -> Callable[[th.Tensor], th.Tensor]:
+    """the image part of a features extractor, mapping prepared image batches to flat embeddings"""
+    if isinstance(extractor, CustomCNN):
+        return lambda images: extractor.linear(extractor.cnn(images))
+    if isinstance(extractor, CustomCombinedPatchExtractor):
+        return extractor.encode_image
+    if isinstance(extractor, CustomCombinedExtractor2):
+        return extractor.conv
+    raise Exception(f"no image encoder for features extractor {type(extractor).__name__}")
+
+
+class FrozenImageEncoder:
+    """
+    The image encoder of the features extractor of a trained SB3 model (CustomCNN, CustomCombinedPatchExtractor
+    or CustomCombinedExtractor2), frozen and in eval mode. Encodes batches of (N, H, W, C) uint8 frames.
+    """
+    def __init__(self, path: str, device: Union[th.device, str] = "cpu"):
+        data, params, _ = load_from_zip_file(path, device=device, print_system_info=False)
+        policy_kwargs = data["policy_kwargs"]
+        observation_space = data["observation_space"]
+        extractor_class = policy_kwargs["features_extractor_class"]
+        self.extractor = extractor_class(observation_space, **policy_kwargs.get("features_extractor_kwargs", {}))
+        self.extractor.load_state_dict(self._extractor_state_dict(params["policy"]))
+        self.extractor.to(device).eval().requires_grad_(False)
+        self.device = device
+        self.normalize_images = policy_kwargs.get("normalize_images", True)
+        self.channels_last = getattr(self.extractor, "channels_last", False)
+        image_space = observation_space["observation"] if isinstance(observation_space, spaces.Dict) else observation_space
+        self.image_shape = image_space.shape
+        self.encode = image_encoder(self.extractor)
+        with th.no_grad():
+            self.embedding_dim = self.encode(self._prepare(th.zeros((1, *self.image_shape), dtype=th.uint8, device=device))).shape[1]
+        print(f"loaded frozen {extractor_class.__name__} from {path} with embedding size {self.embedding_dim}")
+
+    @staticmethod
+    def _extractor_state_dict(policy_state: Dict[str, th.Tensor]) -> Dict[str, th.Tensor]:
+        for prefix in EXTRACTOR_PREFIXES:
+            state = {key[len(prefix):]: value for key, value in policy_state.items() if key.startswith(prefix)}
+            if len(state) > 0:
+                return state
+        raise Exception("could not find the features extractor weights in the model")
+
+    def _prepare(self, images: th.Tensor) -> th.Tensor:
+        if self.channels_last:
+            return channels_last_input(images)
+        if images.shape[1:] != self.image_shape:
+            # HWC frames for an encoder trained on transposed (CHW) images
+            images = images.permute(0, 3, 1, 2)
+        images = images.float()
+        return images / 255.0 if self.normalize_images else images
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        with th.no_grad():
+            embeddings = self.encode(self._prepare(th.as_tensor(images, device=self.device)))
+        return embeddings.cpu().numpy()
+
+
+class VecEncodeImageObservation(VecEnvWrapper):
+    """
+    Replaces the image observations of a vec env (or the "observation" entry of dict observations) with their
+    embeddings from a frozen encoder. Frames are encoded once per env step as a batch over all envs, and everything
+    downstream, including the replay buffer, only sees the compact embeddings.
+    """
+    def __init__(self, venv: VecEnv, encoder: FrozenImageEncoder, key: str = "observation"):
+        self.encoder = encoder
+        embedding_space = spaces.Box(low=-np.inf, high=np.inf, shape=(encoder.embedding_dim,), dtype=np.float32)
+        if isinstance(venv.observation_space, spaces.Dict):
+            self.key = key
+            observation_space = spaces.Dict({
+                name: embedding_space if name == key else space for name, space in venv.observation_space.spaces.items()
+            })
+        else:
+            self.key = None
+            observation_space = embedding_space
+        super().__init__(venv, observation_space=observation_space)
+
+    def _encode(self, obs):
+        if self.key is None:
+            return self.encoder(obs)
+        return {name: self.encoder(value) if name == self.key else value for name, value in obs.items()}
+
+    def _encode_single(self, obs):
+        if self.key is None:
+            return self.encoder(obs[None])[0]
+        return {name: self.encoder(value[None])[0] if name == self.key else value for name, value in obs.items()}
+
+    def reset(self):
+        return self._encode(self.venv.reset())
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        for i in np.flatnonzero(dones):
+            if infos[i].get("terminal_observation") is not None:
+                infos[i]["terminal_observation"] = self._encode_single(infos[i]["terminal_observation"])
+        return self._encode(obs), rewards, dones, infos
@@ -0,0 +1,214 @@
+import math
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import torch as th
+from torch import nn
+from gymnasium import spaces
+
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.distributions import DiagGaussianDistribution
+from stable_baselines3.common.policies import ActorCriticPolicy, BasePolicy
+from stable_baselines3.common.preprocessing import is_image_space, preprocess_obs
+from stable_baselines3.sac.policies import SACPolicy
+
+
+def _features(policy: BasePolicy, obs, features_extractor: nn.Module) -> th.Tensor:
+    # preprocess for every extractor, some of the extractors in src/networks.py write into the observation dict
+    return features_extractor(preprocess_obs(obs, policy.observation_space, normalize_images=policy.normalize_images))
+
+
+def _gaussian_log_prob(actions: th.Tensor, mean: th.Tensor, log_std: th.Tensor) -> th.Tensor:
+    """same as DiagGaussianDistribution.log_prob, written out so that it can be traced"""
+    log_prob = -((actions - mean) ** 2) / (2 * th.exp(2 * log_std)) - log_std - math.log(math.sqrt(2 * math.pi))
+    return log_prob.sum(dim=1)
+
+
+class _ActorModule(nn.Module):
+    """the action computation of a PPO or SAC policy as a single traceable module"""
+    def __init__(self, policy: BasePolicy, deterministic: bool):
+        super().__init__()
+        self.policy = policy
+        self.deterministic = deterministic
+
+    def forward(self, obs) -> th.Tensor:
+        policy = self.policy
+        if isinstance(policy, SACPolicy):
+            mean, log_std, _ = policy.actor.get_action_dist_params(obs)
+            if not self.deterministic:
+                mean = mean + th.exp(log_std) * th.randn_like(mean)
+            return th.tanh(mean)
+        latent_pi = policy.mlp_extractor.forward_actor(_features(policy, obs, policy.pi_features_extractor))
+        mean = policy.action_net(latent_pi)
+        if self.deterministic:
+            return mean
+        return mean + th.exp(policy.log_std) * th.randn_like(mean)
+
+
+class _RolloutModule(nn.Module):
+    """ActorCriticPolicy.forward (actions, values and log probabilities) as a single traceable module"""
+    def __init__(self, policy: ActorCriticPolicy):
+        super().__init__()
+        self.policy = policy
+
+    def forward(self, obs) -> Tuple[th.Tensor, th.Tensor, th.Tensor]:
+        policy = self.policy
+        pi_features = _features(policy, obs, policy.pi_features_extractor)
+        vf_features = pi_features if policy.share_features_extractor else _features(policy, obs, policy.vf_features_extractor)
+        mean = policy.action_net(policy.mlp_extractor.forward_actor(pi_features))
+        values = policy.value_net(policy.mlp_extractor.forward_critic(vf_features))
+        actions = mean + th.exp(policy.log_std) * th.randn_like(mean)
+        return actions, values, _gaussian_log_prob(actions, mean, policy.log_std)
+
+
+def supports_export(policy: BasePolicy) -> bool:
+    """policies with Box (or Dict of Box) observations and gaussian actions without gSDE"""
+    obs_spaces = policy.observation_space.spaces.values() if isinstance(policy.observation_space, spaces.Dict) else [policy.observation_space]
+    if not all(isinstance(space, spaces.Box) for space in obs_spaces):
+        return False
+    if isinstance(policy, SACPolicy):
+        return not policy.actor.use_sde
+    return isinstance(policy, ActorCriticPolicy) and isinstance(policy.action_dist, DiagGaussianDistribution)
+
+
+def trace_or_eager(module: nn.Module, example_obs, verbose: int = 1):
+    """traces the module with TorchScript, falling back to running it eagerly if tracing fails"""
+    try:
+        with th.no_grad():
+            return th.jit.trace(module, (example_obs,), check_trace=False)
+    except Exception as e:
+        if verbose >= 1: print(f"tracing {type(module).__name__} failed, running it eagerly: {e}")
+        return module
+
+
+class ExportedPolicy:
+    """
+    Inference-only version of a trained PPO or SAC policy with the same predict interface as the model.
+
+    The actor is traced with TorchScript once per (batch shape, deterministic) and the traced graphs are cached.
+    Observations are copied into preallocated float32 input buffers of that shape, which converts uint8 images
+    and transposes HWC images in one copy, instead of going through the generic SB3 preprocessing on every call.
+    The traced graphs share the parameters of the policy, so they stay up to date while training.
+    Policies that cannot be traced fall back to policy.predict.
+    """
+    def __init__(self, policy: Union[BasePolicy, BaseAlgorithm], verbose: int = 1):
+        if isinstance(policy, BaseAlgorithm):
+            policy = policy.policy
+        self.policy = policy
+        self.verbose = verbose
+        self.supported = supports_export(policy)
+        if not self.supported and verbose >= 1:
+            print(f"{type(policy).__name__} can not be exported, predicting with the policy instead")
+        self._modules: Dict[tuple, nn.Module] = {}
+        self._buffers: Dict[tuple, Union[th.Tensor, Dict[str, th.Tensor]]] = {}
+        self._low = policy.action_space.low
+        self._high = policy.action_space.high
+
+    def _obs_shape_key(self, observation) -> tuple:
+        if isinstance(observation, dict):
+            return tuple((key, value.shape) for key, value in sorted(observation.items()))
+        return (observation.shape,)
+
+    def _copy_to_buffer(self, buffer: th.Tensor, value: np.ndarray, space: spaces.Box):
+        if is_image_space(space) and value.shape[1:] != space.shape and value.shape[1:] == (*space.shape[1:], space.shape[0]):
+            # HWC observations from an env that was not wrapped in VecTransposeImage
+            value = value.transpose(0, 3, 1, 2)
+        buffer.copy_(th.from_numpy(value))
+
+    def _fill_buffers(self, key: tuple, observation):
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            device = self.policy.device
+            if isinstance(observation, dict):
+                buffers = {
+                    name: th.empty(value.shape[:1] + self.policy.observation_space[name].shape, dtype=th.float32, device=device)
+                    for name, value in observation.items()
+                }
+            else:
+                buffers = th.empty(observation.shape[:1] + self.policy.observation_space.shape, dtype=th.float32, device=device)
+            self._buffers[key] = buffers
+        if isinstance(observation, dict):
+            for name, value in observation.items():
+                self._copy_to_buffer(buffers[name], np.asarray(value), self.policy.observation_space[name])
+        else:
+            self._copy_to_buffer(buffers, np.asarray(observation), self.policy.observation_space)
+        return buffers
+
+    def _is_vectorized(self, observation) -> bool:
+        if isinstance(observation, dict):
+            name, value = next(iter(observation.items()))
+            return np.ndim(value) == len(self.policy.observation_space[name].shape) + 1
+        return np.ndim(observation) == len(self.policy.observation_space.shape) + 1
+
+    def predict(
+        self,
+        observation: Union[np.ndarray, Dict[str, np.ndarray]],
+        state: Optional[Tuple[np.ndarray, ...]] = None,
+        episode_start: Optional[np.ndarray] = None,
+        deterministic: bool = False,
+    ) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, ...]]]:
+        if not self.supported:
+            return self.policy.predict(observation, state, episode_start, deterministic)
+
+        vectorized = self._is_vectorized(observation)
+        if not vectorized:
+            if isinstance(observation, dict):
+                observation = {name: np.expand_dims(value, 0) for name, value in observation.items()}
+            else:
+                observation = np.expand_dims(observation, 0)
+
+        shape_key = self._obs_shape_key(observation)
+        obs = self._fill_buffers(shape_key, observation)
+        key = (shape_key, deterministic)
+        module = self._modules.get(key)
+        if module is None:
+            self.policy.set_training_mode(False)
+            module = self._modules[key] = trace_or_eager(_ActorModule(self.policy, deterministic), obs, self.verbose)
+
+        with th.no_grad():
+            actions = module(obs).cpu().numpy().reshape((-1, *self.policy.action_space.shape))
+
+        # same post processing as BasePolicy.predict
+        if self.policy.squash_output:
+            actions = self.policy.unscale_action(actions)
+        else:
+            actions = np.clip(actions, self._low, self._high)
+
+        if not vectorized:
+            actions = actions.squeeze(axis=0)
+        return actions, state
+
+
+class TracedRolloutForward:
+    """
+    Replacement for ActorCriticPolicy.forward during on-policy rollout collection, using a traced graph per
+    observation batch shape. Deterministic calls go to the original forward.
+    Kept outside of the policy's modules so that the policy's state dict and saved models are unchanged.
+    """
+    def __init__(self, policy: ActorCriticPolicy, verbose: int = 1):
+        self.policy = policy
+        self.verbose = verbose
+        self._modules: Dict[tuple, nn.Module] = {}
+
+    def __call__(self, obs, deterministic: bool = False):
+        if deterministic:
+            return type(self.policy).forward(self.policy, obs, deterministic)
+        if isinstance(obs, dict):
+            key = tuple((name, value.shape, value.dtype) for name, value in sorted(obs.items()))
+        else:
+            key = (obs.shape, obs.dtype)
+        module = self._modules.get(key)
+        if module is None:
+            module = self._modules[key] = trace_or_eager(_RolloutModule(self.policy), obs, self.verbose)
+        actions, values, log_prob = module(obs)
+        return actions.reshape((-1, *self.policy.action_space.shape)), values, log_prob
+
+
+def enable_traced_rollouts(model: BaseAlgorithm, verbose: int = 1) -> bool:
+    """makes the rollout collection of an on-policy model use a traced policy forward. Returns whether it was enabled"""
+    policy = model.policy
+    if not isinstance(policy, ActorCriticPolicy) or not supports_export(policy):
+        if verbose >= 1: print(f"traced rollouts are not supported for {type(policy).__name__}")
+        return False
+    policy.forward = TracedRolloutForward(policy, verbose)
+    return True
@@ -1,25 +1,51 @@
+import typing
+from typing import Optional
+
 import numpy as np
 import gymnasium as gym
 from torch import nn
 import torch as th
 
 from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+from stable_baselines3.common.policies import ActorCriticCnnPolicy, ContinuousCritic
+from stable_baselines3.sac.policies import Actor, SACPolicy
     
+def channels_last_input(images: th.Tensor) -> th.Tensor:
+    """
+    converts a batch of (N, H, W, C) images with values in [0, 255] to normalized float (N, C, H, W) in channels-last
+    memory format. The permute is only a view with channels-last strides, so the float conversion is the only copy
+    """
+    images = images.permute(0, 3, 1, 2)
+    if images.dtype == th.uint8:
+        images = images.float().mul_(1.0 / 255.0)
+    else:
+        images = images * (1.0 / 255.0)
+    return images.contiguous(memory_format=th.channels_last)
+
+
 class CustomCNN(BaseFeaturesExtractor):
     """
     :param observation_space: (gym.Space)
     :param features_dim: (int) Number of features extracted.
         This corresponds to the number of unit for the last layer.
+    :param channels_last: (bool) whether the images are unnormalized HWC (uint8) images that are normalized here,
+        with the convolutions running in channels-last memory format. Needs a policy that passes the observations
+        through unprocessed (see ChannelsLastActorCriticCnnPolicy, ChannelsLastSACPolicy)
     """
 
-    def __init__(self, observation_space, features_dim: int = 256):
+    def __init__(self, observation_space, features_dim: int = 256, channels_last: bool = False):
         super().__init__(observation_space, features_dim)
-        # We assume CxHxW images (channels first)
-        # Re-ordering will be done by pre-preprocessing or wrapper
+        self.channels_last = channels_last
         if isinstance(observation_space, gym.spaces.Dict):
-            n_input_channels = observation_space.get('observation').shape[0]
+            image_space = observation_space.get('observation')
         else:
-            n_input_channels = observation_space.shape[0]
+            image_space = observation_space
+        if channels_last:
+            n_input_channels = image_space.shape[-1]
+        else:
+            # We assume CxHxW images (channels first)
+            # Re-ordering will be done by pre-preprocessing or wrapper
+            n_input_channels = image_space.shape[0]
         self.cnn = nn.Sequential(
             nn.Conv2d(n_input_channels, 32, kernel_size=8, stride=4, padding=0),
             nn.ReLU(),
@@ -29,21 +55,25 @@ class CustomCNN(BaseFeaturesExtractor):
             nn.ReLU(),
             nn.Flatten(),
         )
+        if channels_last:
+            self.cnn = self.cnn.to(memory_format=th.channels_last)
 
         # Compute shape by doing one forward pass
         with th.no_grad():
-            if isinstance(observation_space, gym.spaces.Dict):
-                n_flatten = self.cnn(
-                    th.as_tensor(observation_space.get("observation").sample()[None]).float()
-                ).shape[1]
-            else:
-                n_flatten = self.cnn(
-                    th.as_tensor(observation_space.sample()[None]).float()
-                ).shape[1]
+            n_flatten = self.cnn(
+                self.prepare_images(th.as_tensor(image_space.sample()[None]))
+            ).shape[1]
 
         self.linear = nn.Sequential(nn.Linear(n_flatten, features_dim), nn.ReLU())
 
+    def prepare_images(self, images: th.Tensor) -> th.Tensor:
+        if self.channels_last:
+            return channels_last_input(images)
+        return images.float()
+
     def forward(self, observations: th.Tensor) -> th.Tensor:
+        if self.channels_last:
+            observations = channels_last_input(observations)
         return self.linear(self.cnn(observations))
     
 
@@ -140,14 +170,15 @@ class CustomCombinedExtractor2(BaseFeaturesExtractor):
         This corresponds to the number of unit for the last layer of image.
     :param goal_dim: (int) Number of goal features extracted.
         This corresponds to the number of unit for the last layer of goal.
+    :param channels_last: (bool) whether the images are unnormalized HWC images, see CustomCNN
     """
-    def __init__(self, observation_space, features_dim: int = 256, goal_dim: int = 32):
+    def __init__(self, observation_space, features_dim: int = 256, goal_dim: int = 32, channels_last: bool = False):
         super().__init__(observation_space, features_dim + goal_dim)
-        extractors = {}
+        self.channels_last = channels_last
 
         for key, subspace in observation_space.items():
             if key == "observation":
-                n_input_channels = subspace.shape[0]
+                n_input_channels = subspace.shape[-1] if channels_last else subspace.shape[0]
                 self.conv = nn.Sequential(
                     nn.Conv2d(n_input_channels, 32, kernel_size=8, stride=4, padding=0),
                     nn.ReLU(),
@@ -161,18 +192,26 @@ class CustomCombinedExtractor2(BaseFeaturesExtractor):
                 )
             elif key == "desired_goal":
                 n_input_goals = subspace.shape[0]
+        if channels_last:
+            self.conv = self.conv.to(memory_format=th.channels_last)
 
         # Compute shape by doing one forward pass
         with th.no_grad():
             n_flatten = self.conv(
-                th.as_tensor(observation_space.get("observation").sample()[None]).float()
+                self.prepare_images(th.as_tensor(observation_space.get("observation").sample()[None]))
             ).shape[1]
 
         self.linear = nn.Sequential(nn.Linear(n_flatten + n_input_goals, features_dim + goal_dim), nn.ReLU())
 
-    def forward(self, observations: th.Tensor) -> th.Tensor:
-        observations["observation"]  = self.conv(observations["observation"])
-        return self.linear(th.cat([observations["observation"], observations["desired_goal"]], dim=1))
+    def prepare_images(self, images: th.Tensor) -> th.Tensor:
+        if self.channels_last:
+            return channels_last_input(images)
+        return images.float()
+
+    def forward(self, observations: typing.Dict[str, th.Tensor]) -> th.Tensor:
+        # the observations are only read, so batches can be passed in without copying them
+        image_features = self.conv(self.prepare_images(observations["observation"]) if self.channels_last else observations["observation"])
+        return self.linear(th.cat([image_features, observations["desired_goal"].float()], dim=1))
     
 
 class CustomCombinedPatchExtractor(BaseFeaturesExtractor):
@@ -182,11 +221,15 @@ class CustomCombinedPatchExtractor(BaseFeaturesExtractor):
         This corresponds to the number of unit for the last layer of image.
     :param goal_dim: (int) Number of goal features extracted.
         This corresponds to the number of unit for the last layer of goal.
+    :param channels_last: (bool) whether the images are unnormalized HWC images, see CustomCNN
     """
-    def __init__(self, observation_space, patch_size=[16,16], embed_size=64, no_patch_embed_bias=False, features_dim: int = 256, goal_dim: int = 32):
+    def __init__(self, observation_space, patch_size=[16,16], embed_size=64, no_patch_embed_bias=False, features_dim: int = 256, goal_dim: int = 32, channels_last: bool = False):
         super().__init__(observation_space, features_dim + goal_dim)
-        extractors = {}
-        C, H, W = observation_space["observation"].shape[0], observation_space["observation"].shape[1], observation_space["observation"].shape[2]
+        self.channels_last = channels_last
+        if channels_last:
+            H, W, C = observation_space["observation"].shape
+        else:
+            C, H, W = observation_space["observation"].shape[0], observation_space["observation"].shape[1], observation_space["observation"].shape[2]
         num_patches = (H // patch_size[0] // 2) * (W // patch_size[1] // 2)
         self.img_size = (H, W)
         self.patch_size = patch_size
@@ -210,25 +253,70 @@ class CustomCombinedPatchExtractor(BaseFeaturesExtractor):
         )
         self.bn = nn.BatchNorm2d(embed_size)
         self.flatten = nn.Flatten()
+        if channels_last:
+            self.conv = self.conv.to(memory_format=th.channels_last)
+            self.proj = self.proj.to(memory_format=th.channels_last)
         
         self.desired_layer = nn.Linear(observation_space["desired_goal"].shape[0], goal_dim) # option 1
 
         # Compute shape by doing one forward pass
         with th.no_grad():
-            n_flatten = self.flatten(self.bn(self.proj(self.conv((
-                th.as_tensor(observation_space.get("observation").sample()[None]).float()
-            ))))).shape[1]
+            n_flatten = self.encode_image(
+                self.prepare_images(th.as_tensor(observation_space.get("observation").sample()[None]))
+            ).shape[1]
 
         self.linear = nn.Sequential(nn.Linear(n_flatten + goal_dim, features_dim + goal_dim), nn.ReLU()) # option 1
         # self.linear = nn.Sequential(nn.Linear(n_flatten + observation_space["desired_goal"].shape[0], features_dim + goal_dim, nn.ReLU())) # option 2
 
+    def prepare_images(self, images: th.Tensor) -> th.Tensor:
+        if self.channels_last:
+            return channels_last_input(images)
+        return images.float()
+
+    def encode_image(self, images: th.Tensor) -> th.Tensor:
+        return self.flatten(self.bn(self.proj(self.conv(images))))
+
+    def forward(self, observations: typing.Dict[str, th.Tensor]) -> th.Tensor:
+        # the observations are only read, so batches can be passed in without copying them
+        images = self.prepare_images(observations["observation"]) if self.channels_last else observations["observation"]
+        image_features = self.encode_image(images)
+        goal_features = self.desired_layer(observations["desired_goal"].float()) # option 1
+
+        return self.linear(th.cat([image_features, goal_features], dim=1))
+
+
+class UnprocessedObsMixin:
+    """
+    Passes the observations to the features extractor as they are, without SB3's preprocess_obs.
+    For extractors that convert and normalize the raw images themselves (channels_last in CustomCNN,
+    CustomCombinedExtractor2 and CustomCombinedPatchExtractor), which saves the float copy of every image batch
+    made by preprocess_obs. The extractors must not write into the observations, since they are the sampled batch.
+    """
+    def extract_features(self, obs, features_extractor: Optional[BaseFeaturesExtractor] = None):
+        if features_extractor is None and not getattr(self, "share_features_extractor", True):
+            # ActorCriticPolicy with separate actor and critic extractors
+            return self.pi_features_extractor(obs), self.vf_features_extractor(obs)
+        return (features_extractor if features_extractor is not None else self.features_extractor)(obs)
+
+
+class ChannelsLastActorCriticCnnPolicy(UnprocessedObsMixin, ActorCriticCnnPolicy):
+    """PPO policy for HWC uint8 image observations, see CustomCNN channels_last"""
+
+
+class ChannelsLastActor(UnprocessedObsMixin, Actor):
+    pass
+
+
+class ChannelsLastContinuousCritic(UnprocessedObsMixin, ContinuousCritic):
+    pass
 
-    def forward(self, observations: th.Tensor) -> th.Tensor:
-        observations["observation"] = self.conv(observations["observation"])
-        observations["observation"] = self.proj(observations["observation"])
-        observations["observation"] = self.bn(observations["observation"])
-        observations["observation"] = self.flatten(observations["observation"])
 
-        observations["desired_goal"] = self.desired_layer(observations["desired_goal"]) # option 1
+class ChannelsLastSACPolicy(SACPolicy):
+    """SAC policy for HWC uint8 image observations, see CustomCNN channels_last"""
+    def make_actor(self, features_extractor: Optional[BaseFeaturesExtractor] = None) -> Actor:
+        actor_kwargs = self._update_features_extractor(self.actor_kwargs, features_extractor)
+        return ChannelsLastActor(**actor_kwargs).to(self.device)
 
-        return self.linear(th.cat([observations["observation"], observations["desired_goal"]], dim=1))
\ No newline at end of file
+    def make_critic(self, features_extractor: Optional[BaseFeaturesExtractor] = None) -> ContinuousCritic:
+        critic_kwargs = self._update_features_extractor(self.critic_kwargs, features_extractor)
+        return ChannelsLastContinuousCritic(**critic_kwargs).to(self.device)
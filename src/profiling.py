@@ -0,0 +1,107 @@
+import time
+from typing import Callable, Dict, List
+
+
+class _Phase:
+    """context manager that adds the elapsed wall time to its phase on exit"""
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer: "PhaseTimer", name: str):
+        self.timer = timer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class PhaseTimer:
+    """
+    Accumulates wall time and call counts per named phase of an env step.
+    Each phase costs two perf_counter calls and a couple of dict updates, so it can stay on during training.
+    """
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._phases: Dict[str, _Phase] = {}
+
+    def phase(self, name: str) -> _Phase:
+        """returns a reusable context manager timing the named phase"""
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self, name)
+        return phase
+
+    def add(self, name: str, seconds: float):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """wraps func so that every call is timed as the named phase"""
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        timed.__wrapped__ = func
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """total seconds, call count and mean seconds per call for every phase"""
+        return {
+            name: {"total": total, "count": self.counts[name], "mean": total / self.counts[name]}
+            for name, total in self.totals.items()
+        }
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+
+
+def time_render_calls(timer: PhaseTimer, sim):
+    """
+    times the offscreen renders of the camera observables as the 'render' phase.
+    robosuite recreates the sim on hard resets, so this has to be called again after every reset.
+    """
+    if not hasattr(sim.render, "__wrapped__"):
+        sim.render = timer.wrap("render", sim.render)
+
+
+def sum_phase_times(per_env: List[Dict[str, Dict[str, float]]]) -> Dict[str, Dict[str, float]]:
+    """sums the phase totals and counts of PhaseTimer.summary over all env workers"""
+    totals: Dict[str, Dict[str, float]] = {}
+    for phases in per_env:
+        for name, stats in phases.items():
+            total = totals.setdefault(name, {"total": 0.0, "count": 0})
+            total["total"] += stats["total"]
+            total["count"] += stats["count"]
+    return totals
+
+
+def phase_ms_per_step(before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """
+    mean milliseconds per env step spent in each phase between two sum_phase_times snapshots.
+    physics is derived as the wrapped env step minus the camera renders inside it.
+    """
+    steps = after.get("step", {"count": 0})["count"] - before.get("step", {"count": 0})["count"]
+    if steps <= 0:
+        return {}
+    delta = {
+        name: after[name]["total"] - before.get(name, {"total": 0.0})["total"]
+        for name in after
+    }
+    phases = {
+        "physics": delta.get("env_step", 0.0) - delta.get("render", 0.0),
+        "render": delta.get("render", 0.0),
+        "reward": delta.get("reward", 0.0),
+        "step": delta["step"],
+    }
+    # finer phases recorded by the env wrappers are reported as is
+    phases.update({name: value for name, value in delta.items() if name not in ("env_step", "reset") and name not in phases})
+    return {name: value / steps * 1000.0 for name, value in phases.items()}
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import numpy as np
+
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.vec_env import VecEnv
+
+from .checkpointing import transition_arrays
+
+TRANSFER_MODES = ["keep", "relabel", "expire"]
+
+
+def enable_sim_state_recording(buffer: ReplayBuffer, sim_state_dim: int):
+    """
+    adds a per-transition sim_states array to a replay buffer, filled by SimStateRecorderCallback with the
+    flattened sim state after each transition (NaN where nothing was recorded). Being a per-transition array,
+    it is moved by expire_transitions and streamed by the run state checkpoints like the rest of the buffer.
+    The states are kept in float64 as the sim uses them, so the predicates see the exact stored states. This takes
+    buffer_size * n_envs * sim_state_dim * 8 bytes, e.g. about 1 GB for a 1M buffer
+    """
+    assert type(buffer) is ReplayBuffer, "sim state recording is only supported for the plain ReplayBuffer"
+    if getattr(buffer, "sim_states", None) is None:
+        buffer.sim_states = np.full((buffer.buffer_size, buffer.n_envs, sim_state_dim), np.nan)
+
+
+def filled_rows(buffer: ReplayBuffer) -> int:
+    return buffer.buffer_size if buffer.full else buffer.pos
+
+
+def relabel_rewards(buffer: ReplayBuffer, envs: VecEnv) -> int:
+    """
+    Recomputes the rewards of all stored transitions for the task the envs currently run, from the recorded sim
+    states (see LowDimensionalObsGymEnv.relabel_rewards). The states are split over the env workers, which
+    evaluate them in parallel. Since the env ends an episode on success, a relabeled transition is terminal
+    exactly when it succeeds on the new task. Timeouts are left as they are.
+    Transitions without a recorded sim state keep their reward.
+    Returns the number of relabeled transitions.
+    """
+    sim_states = buffer.sim_states[:filled_rows(buffer)].reshape(-1, buffer.sim_states.shape[-1])
+    rewards = buffer.rewards[:filled_rows(buffer)].reshape(-1)
+    dones = buffer.dones[:filled_rows(buffer)].reshape(-1)
+    recorded = np.flatnonzero(~np.isnan(sim_states[:, 0]))
+    if len(recorded) == 0:
+        return 0
+    worker_indices = np.array_split(recorded, envs.num_envs)
+    def relabel(worker: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(worker_indices[worker]) == 0:
+            return np.zeros(0, dtype=rewards.dtype), np.zeros(0, dtype=bool)
+        return envs.env_method("relabel_rewards", sim_states[worker_indices[worker]], indices=[worker])[0]
+    # env_method blocks on its worker, so every worker gets its own thread
+    with ThreadPoolExecutor(max_workers=envs.num_envs) as executor:
+        relabeled = list(executor.map(relabel, range(envs.num_envs)))
+    for indices, (worker_rewards, worker_successes) in zip(worker_indices, relabeled):
+        rewards[indices] = worker_rewards
+        dones[indices] = worker_successes
+    return len(recorded)
+
+
+def expire_transitions(buffer: ReplayBuffer, keep_last: int) -> int:
+    """
+    keeps only the newest keep_last rows (one transition per env each) of a replay buffer, moved to its start.
+    Returns the number of expired rows
+    """
+    filled = filled_rows(buffer)
+    keep = min(keep_last, filled)
+    indices = (buffer.pos - keep + np.arange(keep)) % buffer.buffer_size
+    for array in transition_arrays(buffer).values():
+        array[:keep] = array[indices]
+    buffer.pos = keep % buffer.buffer_size
+    buffer.full = keep == buffer.buffer_size
+    return filled - keep
+
+
+def transfer_replay_buffer(buffer: ReplayBuffer, envs: VecEnv, mode: str, keep_last: int = 10000, verbose: int = 1) -> bool:
+    """
+    prepares the replay buffer of the previous curriculum subtask for the next one, whose envs are passed in:
+        - keep: leave the stored transitions and their rewards as they are
+        - relabel: recompute the stored rewards and terminal flags for the new task from the recorded sim states
+        - expire: only keep the newest keep_last rows
+    Returns whether the stored transitions changed
+    """
+    assert mode in TRANSFER_MODES, f"unknown replay buffer transfer mode {mode}, use one of {TRANSFER_MODES}"
+    if mode == "keep" or filled_rows(buffer) == 0:
+        return False
+    # HER's episode bookkeeping would no longer match moved transitions or relabeled goals
+    assert type(buffer) is ReplayBuffer, "replay buffer transfer is only supported for the plain ReplayBuffer"
+    if mode == "relabel":
+        assert getattr(buffer, "sim_states", None) is not None, "relabeling needs sim state recording enabled"
+        count = relabel_rewards(buffer, envs)
+        if verbose >= 1: print(f"Relabeled the rewards of {count} replay buffer transitions for the new subtask")
+    else:
+        count = expire_transitions(buffer, keep_last)
+        if verbose >= 1: print(f"Expired {count} replay buffer rows, kept the newest {filled_rows(buffer)}")
+    return True
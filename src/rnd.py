@@ -1,13 +1,173 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Union
+
 import numpy as np
 import gymnasium as gym
 from torch import nn
+from torch.nn import functional as F
 import torch as th
 
+from stable_baselines3.common.vec_env import VecEnv
+
+
 class RNDNetworkLowDim(nn.Module):
     def __init__(self, input_dim, output_dim, hidden_dim=64):
         super(RNDNetworkLowDim, self).__init__()
-        self.linear  = nn.Linear(input_dim, output_dim)
-        self.double()
-    
+        self.net = nn.Sequential(
+            nn.Linear(input_dim, hidden_dim),
+            nn.ReLU(),
+            nn.Linear(hidden_dim, hidden_dim),
+            nn.ReLU(),
+            nn.Linear(hidden_dim, output_dim),
+        )
+
     def forward(self, x):
-        return self.linear(x)
\ No newline at end of file
+        return self.net(x)
+
+
+class RunningMeanStd:
+    """running mean and variance of batches of vectors (parallel algorithm of Chan et al.), kept on the device"""
+    def __init__(self, shape, device: Union[th.device, str] = "cpu", epsilon: float = 1e-4):
+        self.mean = th.zeros(shape, dtype=th.float32, device=device)
+        self.var = th.ones(shape, dtype=th.float32, device=device)
+        self.count = epsilon
+
+    def update(self, x: th.Tensor):
+        batch_mean = x.mean(dim=0)
+        batch_var = x.var(dim=0, unbiased=False)
+        batch_count = x.shape[0]
+        delta = batch_mean - self.mean
+        total_count = self.count + batch_count
+        self.mean = self.mean + delta * batch_count / total_count
+        m2 = self.var * self.count + batch_var * batch_count + delta**2 * self.count * batch_count / total_count
+        self.var = m2 / total_count
+        self.count = total_count
+
+    def normalize(self, x: th.Tensor, clip: float = 5.0) -> th.Tensor:
+        return ((x - self.mean) / th.sqrt(self.var + 1e-8)).clamp_(-clip, clip)
+
+
+class NativeIntrinsicReward(ABC):
+    """
+    Base of the first-party intrinsic rewards for low dimensional observation vectors, with the parts of the rllte
+    BaseReward interface used by the exploration callbacks (compute, update, metrics, device, batch_size).
+    There is no per-step watch, the callbacks skip it.
+    Everything runs in float32 on the device. Observations are normalized with running statistics, which are
+    updated on every compute call, since compute sees each new transition once (a PPO rollout, or a batch of new
+    off-policy transitions with sync=False). With sync, compute also runs the update on the already normalized
+    samples, so a rollout end is a single fused pass over the rollout.
+    """
+    def __init__(
+        self,
+        envs: VecEnv,
+        device: Union[th.device, str] = "cpu",
+        beta: float = 1.0,
+        latent_dim: int = 64,
+        hidden_dim: int = 128,
+        lr: float = 1e-3,
+        batch_size: int = 256,
+    ):
+        assert isinstance(envs.observation_space, gym.spaces.Box) and len(envs.observation_space.shape) == 1, \
+            "native intrinsic rewards only support low dimensional observation vectors"
+        self.device = th.device(device)
+        self.obs_dim = envs.observation_space.shape[0]
+        self.action_dim = int(np.prod(envs.action_space.shape))
+        self.beta = beta
+        self.latent_dim = latent_dim
+        self.hidden_dim = hidden_dim
+        self.lr = lr
+        self.batch_size = batch_size
+        self.obs_rms = RunningMeanStd((self.obs_dim,), device=self.device)
+        self.metrics: Dict[str, List[float]] = {"loss": []}
+
+    def _flatten(self, samples: Dict[str, th.Tensor]):
+        """(n_steps, n_envs, ...) samples to float32 (n_steps * n_envs, ...) tensors on the device"""
+        obs = samples["observations"].to(self.device, th.float32).reshape(-1, self.obs_dim)
+        next_obs = samples["next_observations"].to(self.device, th.float32).reshape(-1, self.obs_dim)
+        actions = samples["actions"].to(self.device, th.float32).reshape(-1, self.action_dim)
+        return obs, actions, next_obs
+
+    @abstractmethod
+    def _intrinsic_rewards(self, obs: th.Tensor, actions: th.Tensor, next_obs: th.Tensor) -> th.Tensor:
+        """per-transition intrinsic rewards of normalized samples, before scaling by beta"""
+
+    @abstractmethod
+    def _loss(self, obs: th.Tensor, actions: th.Tensor, next_obs: th.Tensor) -> th.Tensor:
+        """training loss of a minibatch of normalized samples"""
+
+    def compute(self, samples: Dict[str, th.Tensor], sync: bool = True) -> th.Tensor:
+        n_steps, n_envs = samples["observations"].shape[:2]
+        obs, actions, next_obs = self._flatten(samples)
+        self.obs_rms.update(next_obs)
+        obs, next_obs = self.obs_rms.normalize(obs), self.obs_rms.normalize(next_obs)
+        with th.no_grad():
+            intrinsic_rewards = self.beta * self._intrinsic_rewards(obs, actions, next_obs)
+        if sync:
+            self._update_normalized(obs, actions, next_obs)
+        return intrinsic_rewards.reshape(n_steps, n_envs)
+
+    def update(self, samples: Dict[str, th.Tensor]):
+        obs, actions, next_obs = self._flatten(samples)
+        self._update_normalized(self.obs_rms.normalize(obs), actions, self.obs_rms.normalize(next_obs))
+
+    def _update_normalized(self, obs: th.Tensor, actions: th.Tensor, next_obs: th.Tensor):
+        """one epoch of minibatch updates over the normalized samples"""
+        losses = []
+        for indices in th.randperm(obs.shape[0], device=self.device).split(self.batch_size):
+            loss = self._loss(obs[indices], actions[indices], next_obs[indices])
+            self.optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            self.optimizer.step()
+            losses.append(loss.detach())
+        self.metrics["loss"].append(th.stack(losses).mean().item())
+
+
+class NativeRND(NativeIntrinsicReward):
+    """
+    Random network distillation: the intrinsic reward is the error of a trained predictor network at matching a
+    fixed random target network on the normalized next observation.
+    """
+    def __init__(self, envs: VecEnv, device: Union[th.device, str] = "cpu", **kwargs):
+        super().__init__(envs, device, **kwargs)
+        self.predictor = RNDNetworkLowDim(self.obs_dim, self.latent_dim, self.hidden_dim).to(self.device)
+        self.target = RNDNetworkLowDim(self.obs_dim, self.latent_dim, self.hidden_dim).to(self.device)
+        self.target.requires_grad_(False)
+        self.optimizer = th.optim.Adam(self.predictor.parameters(), lr=self.lr)
+
+    def _intrinsic_rewards(self, obs, actions, next_obs):
+        return (self.predictor(next_obs) - self.target(next_obs)).pow(2).mean(dim=1)
+
+    def _loss(self, obs, actions, next_obs):
+        return F.mse_loss(self.predictor(next_obs), self.target(next_obs))
+
+
+class NativeICM(NativeIntrinsicReward):
+    """
+    Intrinsic curiosity module: the intrinsic reward is the error of a forward model predicting the encoding of the
+    next observation from the encoding of the observation and the action. The encoder is trained with an inverse
+    model predicting the (continuous) action from both encodings.
+    """
+    def __init__(self, envs: VecEnv, device: Union[th.device, str] = "cpu", forward_loss_weight: float = 0.2, **kwargs):
+        super().__init__(envs, device, **kwargs)
+        self.forward_loss_weight = forward_loss_weight
+        self.encoder = RNDNetworkLowDim(self.obs_dim, self.latent_dim, self.hidden_dim).to(self.device)
+        self.inverse_model = RNDNetworkLowDim(2 * self.latent_dim, self.action_dim, self.hidden_dim).to(self.device)
+        self.forward_model = RNDNetworkLowDim(self.latent_dim + self.action_dim, self.latent_dim, self.hidden_dim).to(self.device)
+        self.optimizer = th.optim.Adam(
+            [*self.encoder.parameters(), *self.inverse_model.parameters(), *self.forward_model.parameters()], lr=self.lr
+        )
+
+    def _forward_error(self, obs, actions, next_obs, next_latent=None):
+        latent = self.encoder(obs)
+        if next_latent is None:
+            next_latent = self.encoder(next_obs)
+        predicted_next_latent = self.forward_model(th.cat([latent, actions], dim=1))
+        return latent, next_latent, 0.5 * (predicted_next_latent - next_latent.detach()).pow(2).mean(dim=1)
+
+    def _intrinsic_rewards(self, obs, actions, next_obs):
+        return self._forward_error(obs, actions, next_obs)[2]
+
+    def _loss(self, obs, actions, next_obs):
+        latent, next_latent, forward_error = self._forward_error(obs, actions, next_obs)
+        inverse_loss = F.mse_loss(self.inverse_model(th.cat([latent, next_latent], dim=1)), actions)
+        return (1 - self.forward_loss_weight) * inverse_loss + self.forward_loss_weight * forward_error.mean()
@@ -0,0 +1,116 @@
+from typing import Tuple
+
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+
+from stable_baselines3 import SAC
+from stable_baselines3.common.utils import polyak_update
+from stable_baselines3.sac.policies import LOG_STD_MAX, LOG_STD_MIN
+
+
+class SharedEncoderSAC(SAC):
+    """
+    SAC that runs the image encoder once per sampled batch instead of once per actor / critic / target call.
+
+    Needs share_features_extractor=True, so that, like in SB3, the encoder is trained by the actor loss only and
+    the critic sees detached features. Per gradient step the online encoder runs once on the observations
+    (with grad) and once on the next observations (without grad, for the next actions), and the target encoder
+    once on the next observations, instead of five encoder passes. The actor and critic heads are then applied
+    to these cached features.
+    """
+
+    def _setup_model(self) -> None:
+        super()._setup_model()
+        assert self.policy.share_features_extractor, "SharedEncoderSAC needs share_features_extractor=True"
+        assert not self.use_sde, "SharedEncoderSAC does not support gSDE"
+
+    def _actor_from_features(self, features: th.Tensor) -> Tuple[th.Tensor, th.Tensor]:
+        """same as Actor.action_log_prob, starting from the extracted features"""
+        latent_pi = self.actor.latent_pi(features)
+        mean_actions = self.actor.mu(latent_pi)
+        log_std = th.clamp(self.actor.log_std(latent_pi), LOG_STD_MIN, LOG_STD_MAX)
+        actions, log_prob = self.actor.action_dist.log_prob_from_params(mean_actions, log_std)
+        return actions, log_prob.reshape(-1, 1)
+
+    @staticmethod
+    def _q_values(critic, features: th.Tensor, actions: th.Tensor) -> th.Tensor:
+        """same as ContinuousCritic.forward, starting from the extracted features"""
+        qvalue_input = th.cat([features, actions], dim=1)
+        return th.cat([q_net(qvalue_input) for q_net in critic.q_networks], dim=1)
+
+    def train(self, gradient_steps: int, batch_size: int = 64) -> None:
+        # Switch to train mode (this affects batch norm / dropout)
+        self.policy.set_training_mode(True)
+        # Update optimizers learning rate
+        optimizers = [self.actor.optimizer, self.critic.optimizer]
+        if self.ent_coef_optimizer is not None:
+            optimizers += [self.ent_coef_optimizer]
+        self._update_learning_rate(optimizers)
+
+        ent_coef_losses, ent_coefs = [], []
+        actor_losses, critic_losses = [], []
+
+        for gradient_step in range(gradient_steps):
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)  # type: ignore[union-attr]
+
+            # the only encoder pass with grad, the critic gets these features detached
+            features = self.actor.extract_features(replay_data.observations, self.actor.features_extractor)
+            detached_features = features.detach()
+            actions_pi, log_prob = self._actor_from_features(features)
+
+            ent_coef_loss = None
+            if self.ent_coef_optimizer is not None and self.log_ent_coef is not None:
+                ent_coef = th.exp(self.log_ent_coef.detach())
+                ent_coef_loss = -(self.log_ent_coef * (log_prob + self.target_entropy).detach()).mean()
+                ent_coef_losses.append(ent_coef_loss.item())
+            else:
+                ent_coef = self.ent_coef_tensor
+
+            ent_coefs.append(ent_coef.item())
+
+            if ent_coef_loss is not None and self.ent_coef_optimizer is not None:
+                self.ent_coef_optimizer.zero_grad()
+                ent_coef_loss.backward()
+                self.ent_coef_optimizer.step()
+
+            with th.no_grad():
+                next_features = self.actor.extract_features(replay_data.next_observations, self.actor.features_extractor)
+                next_actions, next_log_prob = self._actor_from_features(next_features)
+                next_target_features = self.critic_target.extract_features(replay_data.next_observations, self.critic_target.features_extractor)
+                next_q_values = self._q_values(self.critic_target, next_target_features, next_actions)
+                next_q_values, _ = th.min(next_q_values, dim=1, keepdim=True)
+                next_q_values = next_q_values - ent_coef * next_log_prob
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            current_q_values = self._q_values(self.critic, detached_features, replay_data.actions)
+            critic_loss = 0.5 * sum(F.mse_loss(current_q_values[:, i:i + 1], target_q_values) for i in range(current_q_values.shape[1]))
+            assert isinstance(critic_loss, th.Tensor)
+            critic_losses.append(critic_loss.item())
+
+            self.critic.optimizer.zero_grad()
+            critic_loss.backward()
+            self.critic.optimizer.step()
+
+            q_values_pi = self._q_values(self.critic, detached_features, actions_pi)
+            min_qf_pi, _ = th.min(q_values_pi, dim=1, keepdim=True)
+            actor_loss = (ent_coef * log_prob - min_qf_pi).mean()
+            actor_losses.append(actor_loss.item())
+
+            self.actor.optimizer.zero_grad()
+            actor_loss.backward()
+            self.actor.optimizer.step()
+
+            if gradient_step % self.target_update_interval == 0:
+                polyak_update(self.critic.parameters(), self.critic_target.parameters(), self.tau)
+                # Copy running stats, see GH issue #996
+                polyak_update(self.batch_norm_stats, self.batch_norm_stats_target, 1.0)
+
+        self._n_updates += gradient_steps
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/ent_coef", np.mean(ent_coefs))
+        self.logger.record("train/actor_loss", np.mean(actor_losses))
+        self.logger.record("train/critic_loss", np.mean(critic_losses))
+        if len(ent_coef_losses) > 0:
+            self.logger.record("train/ent_coef_loss", np.mean(ent_coef_losses))
@@ -0,0 +1,60 @@
+from typing import Callable, List
+
+
+class SparseGoalTracker:
+    """
+    Incrementally tracks progress through the ordered goal states of a BDDL problem for sparse-only rewards.
+
+    Only the current goal predicate is evaluated every step. Goals that were already completed are re-evaluated
+    every `completed_check_freq` steps and cached in between, which is only used for the small reward for goals
+    remaining complete. Success is exact: the goals have to be completed in order, so a full check_success is
+    only needed on steps where the last goal holds.
+    """
+    def __init__(
+        self,
+        goal_states: List[List[str]],
+        eval_predicate: Callable[[List[str]], bool],
+        check_success: Callable[[], bool],
+        completed_check_freq: int = 10,
+    ):
+        assert completed_check_freq >= 1, "completed_check_freq must be at least 1"
+        self.goal_states = goal_states
+        self.eval_predicate = eval_predicate
+        self.check_success = check_success
+        self.completed_check_freq = completed_check_freq
+        self.reset()
+
+    def reset(self):
+        self.current_goal_index = 0
+        self.num_completed = 0
+        # cached predicate results for completed goals, refreshed every completed_check_freq steps
+        self.holding = [False] * len(self.goal_states)
+        self.step_count = 0
+
+    def update(self):
+        """
+        evaluates the goals for the current step
+        :return: (success, number of goals newly completed this step)
+        """
+        self.step_count += 1
+        if self.num_completed > 0 and self.step_count % self.completed_check_freq == 0:
+            for i in range(self.num_completed):
+                self.holding[i] = self.eval_predicate(self.goal_states[i])
+
+        newly_completed = 0
+        while True:
+            i = self.current_goal_index
+            self.holding[i] = self.eval_predicate(self.goal_states[i])
+            if not self.holding[i]:
+                return False, newly_completed
+            if i == self.num_completed:
+                self.num_completed += 1
+                newly_completed += 1
+            if i == len(self.goal_states) - 1:
+                # the last goal holds, so verify the earlier goals still hold as well
+                return self.check_success(), newly_completed
+            self.current_goal_index += 1
+
+    def num_holding(self) -> int:
+        """number of goals currently holding, using the cached results for completed goals"""
+        return sum(self.holding[:self.current_goal_index + 1])
@@ -1,40 +1,42 @@
 import os
 import time
-from typing import List, Optional, Tuple
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional, Tuple
 
-import imageio
-from IPython.display import HTML
+import numpy as np
+import torch
 
-from stable_baselines3.common.vec_env import SubprocVecEnv, DummyVecEnv, VecEnv
+from stable_baselines3.common.vec_env import SubprocVecEnv, DummyVecEnv, VecEnv, VecTransposeImage
 from stable_baselines3.common.monitor import Monitor
 from stable_baselines3 import PPO, SAC
 
 from . import args
 from .envs_gymapi import LowDimensionalObsGymEnv, LowDimensionalObsGymGoalEnv, AgentViewGymEnv, AgentViewGymGoalEnv
-from .networks import CustomCNN, CustomCombinedPatchExtractor
+from .networks import CustomCNN, CustomCombinedPatchExtractor, ChannelsLastActorCriticCnnPolicy, ChannelsLastSACPolicy
 from .her_replay_buffer_modified import HerReplayBufferModified
+from .video import StreamingVideoWriter
+from .inference import enable_traced_rollouts
+from .shared_encoder_sac import SharedEncoderSAC
+from .frozen_encoder import FrozenImageEncoder, VecEncodeImageObservation
+from .curriculum import SwitchableTaskEnv
 
 import subprocess
 import multiprocessing
 create_env_err_count = 0
 
-def obs_to_video(images: list, filename: str):
+# cores this process was allowed to run on at import time, before any pinning is applied
+AVAILABLE_CORES: List[int] = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"]
+
+def obs_to_video(images: Iterable[np.ndarray], filename: str, fps: int = 60):
     """
-    converts a list of images to video and writes the file
+    converts images to video and writes the file.
+    images can be any iterable (e.g. a generator), which is consumed while encoding on a background thread.
+    To stream frames during rollouts, use src.video.EpisodeVideoWriter directly
     """
-    video_writer = imageio.get_writer(filename, fps=60)
-    for image in images:
-        video_writer.append_data(image[::-1])
-    video_writer.close()
-    HTML("""
-        <video width="640" height="480" controls>
-            <source src="output.mp4" type="video/mp4">
-        </video>
-        <script>
-            var video = document.getElementsByTagName('video')[0];
-            video.playbackRate = 2.0; // Increase the playback speed to 2x
-            </script>    
-    """)
+    with StreamingVideoWriter(filename, fps=fps) as video_writer:
+        for image in images:
+            video_writer.append(image[::-1])
 
 def get_open_files_count():
     output = subprocess.check_output(['lsof', '-w', '-Ff', '-p', str(os.getpid())])
@@ -47,17 +49,84 @@ def get_open_files_count():
 class EnvAndAlgArgs(args.EnvArgs, args.AlgArgs):
     pass
 
+def assign_cores(num_envs: int, learner_cores: int, cores_per_env: int) -> Tuple[List[int], List[List[int]]]:
+    """
+    splits the available cores into a reserved set for the learner and a dedicated set for each env worker.
+    If there are not enough cores, workers wrap around and share cores.
+    """
+    learner = AVAILABLE_CORES[:learner_cores]
+    worker_pool = AVAILABLE_CORES[learner_cores:] or AVAILABLE_CORES
+    if num_envs * cores_per_env > len(worker_pool):
+        print(f"Warning: {num_envs} envs x {cores_per_env} cores oversubscribes the {len(worker_pool)} cores left for env workers")
+    workers = [
+        [worker_pool[(i * cores_per_env + j) % len(worker_pool)] for j in range(cores_per_env)]
+        for i in range(num_envs)
+    ]
+    return learner, workers
+
+def pin_current_process(cores: List[int], num_threads: int = 1):
+    """
+    pins the calling process to the given cores and limits its torch thread pool
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+
+def pinned_env_fn(env_fn: Callable, cores: List[int]) -> Callable:
+    """
+    wraps an env constructor so that the worker process pins itself before creating the env
+    """
+    def _init():
+        pin_current_process(cores, num_threads=1)
+        return env_fn()
+    return _init
+
+@contextmanager
+def single_threaded_environ():
+    """
+    sets the BLAS/OpenMP thread env vars to 1 while the worker processes are started, so they are inherited by the workers.
+    These are read when the libraries are loaded, so they cannot be changed from inside an already running worker.
+    """
+    previous = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: "1" for var in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for var, value in previous.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+def wrap_vec_env(env: VecEnv, args: EnvAndAlgArgs) -> VecEnv:
+    """vec env wrappers that depend on how the policy consumes the image observations"""
+    if args.visual_observation and args.pretrained_encoder_path is not None:
+        # the policy only sees the embeddings of a frozen encoder
+        return VecEncodeImageObservation(env, FrozenImageEncoder(args.pretrained_encoder_path, device=args.get_device()))
+    if args.visual_observation and args.channels_last:
+        # with channels_last, image observations are passed to the policy as HWC uint8 (see networks.channels_last_input).
+        # Wrapping in a skipping VecTransposeImage stops SB3 from adding a transposing one when the model is created
+        return VecTransposeImage(env, skip=True)
+    return env
+
 def setup_envs(
     bddl_file: str,
     args: EnvAndAlgArgs,
+    task_switching: bool = False,
     **env_args_override
 ) -> VecEnv:
+    """
+    creates the vec env for a BDDL file.
+    With task_switching, every worker runs a SwitchableTaskEnv starting on bddl_file, which can be moved to other
+    BDDL files with env_method("switch_task", ...) (see src/curriculum.py)
+    """
     print("Setting up environment")
 
     env_args = {
         "bddl_file_name": bddl_file,
         "camera_heights": 128,
         "camera_widths": 128,
+        "action_repeat": args.action_repeat,
     }
     
     if not args.truncate:
@@ -65,36 +134,53 @@ def setup_envs(
         
     env_args.update(env_args_override)
 
-    # vec_env_class = SubprocVecEnv if args.num_envs > 1 else DummyVecEnv
-    if args.visual_observation:
-        if args.her:
-            envs = [lambda: Monitor(AgentViewGymGoalEnv(**env_args), info_keywords=["is_success"]) for _ in range(args.num_envs)]
-        else:
-            envs = [lambda: Monitor(AgentViewGymEnv(**env_args), info_keywords=["is_success"]) for _ in range(args.num_envs)]
-    else:
+    def make_task_env(task_bddl_file: str):
+        task_env_args = {**env_args, "bddl_file_name": task_bddl_file}
+        if args.visual_observation:
+            if args.her:
+                return AgentViewGymGoalEnv(**task_env_args)
+            return AgentViewGymEnv(**task_env_args)
         if args.her:
-            envs = [lambda: Monitor(LowDimensionalObsGymGoalEnv(**env_args), info_keywords=["is_success"]) for _ in range(args.num_envs)]
-        else:
-            envs = [lambda: Monitor(LowDimensionalObsGymEnv(
-                args.shaping_reward,
-                args.sparse_reward,
-                reward_geoms=args.reward_geoms.split(",") if args.reward_geoms is not None else None,
-                dense_reward_multiplier=args.dense_reward_multiplier,
-                steps_per_episode=args.steps_per_episode,
-                sim_states=args.fetch_sim_states(),
-                setup_demo=args.fetch_setup_demo(),
-                **env_args
-            ), info_keywords=["is_success"]) for _ in range(args.num_envs)]
+            return LowDimensionalObsGymGoalEnv(**task_env_args)
+        return LowDimensionalObsGymEnv(
+            args.shaping_reward,
+            args.sparse_reward,
+            reward_geoms=args.reward_geoms.split(",") if args.reward_geoms is not None else None,
+            dense_reward_multiplier=args.dense_reward_multiplier,
+            steps_per_episode=args.steps_per_episode,
+            sim_states=args.fetch_sim_states(),
+            setup_demo=args.fetch_setup_demo(),
+            sparse_goal_tracking=args.sparse_goal_tracking,
+            completed_goal_check_freq=args.completed_goal_check_freq,
+            **task_env_args
+        )
+
+    # vec_env_class = SubprocVecEnv if args.num_envs > 1 else DummyVecEnv
+    def make_env():
+        if task_switching:
+            return Monitor(SwitchableTaskEnv(make_task_env, env_args["bddl_file_name"]), info_keywords=["is_success"])
+        return Monitor(make_task_env(env_args["bddl_file_name"]), info_keywords=["is_success"])
+
+    envs = [make_env for _ in range(args.num_envs)]
     
     if args.num_envs > 1:
+        if args.pin_workers:
+            learner_cores, worker_cores = assign_cores(args.num_envs, args.learner_cores, args.cores_per_env)
+            envs = [pinned_env_fn(env_fn, cores) for env_fn, cores in zip(envs, worker_cores)]
+            print(f"Pinning learner to cores {learner_cores} and env workers to cores {worker_cores}")
         while True:
             global create_env_err_count
             try:
                 print("Open files before SubprocVecEnv:", get_open_files_count())
-                env = SubprocVecEnv(envs, start_method=args.multiprocessing_start_method)
+                if args.pin_workers:
+                    with single_threaded_environ():
+                        env = SubprocVecEnv(envs, start_method=args.multiprocessing_start_method)
+                    pin_current_process(learner_cores, num_threads=len(learner_cores))
+                else:
+                    env = SubprocVecEnv(envs, start_method=args.multiprocessing_start_method)
                 print("Open files after SubprocVecEnv:", get_open_files_count())
                 create_env_err_count = 0
-                return env
+                return wrap_vec_env(env, args)
             except OSError as e:
                 create_env_err_count += 1
                 print(f"Got error while creating envs, trying again in {create_env_err_count}s: {e}")
@@ -105,7 +191,7 @@ def setup_envs(
         print("Open files before DummyVecEnv:", get_open_files_count())
         env = DummyVecEnv(envs)
         print("Open files after DummyVecEnv:", get_open_files_count())
-        return env
+        return wrap_vec_env(env, args)
 
 
 def setup_run_at_path(base_path: str, *paths: str):
@@ -127,13 +213,19 @@ def setup_model(
     if tensorboard_path == None:
         tensorboard_path = save_path
 
-    if args.visual_observation:
+    if args.visual_observation and args.pretrained_encoder_path is None:
         policy_kwargs = dict(
             features_extractor_class=CustomCombinedPatchExtractor if args.her else CustomCNN,
             features_extractor_kwargs=dict(features_dim=256),
         )
         policy_class = "MultiInputPolicy" if args.her else "CnnPolicy"
+        if args.channels_last:
+            # images stay HWC uint8 until the extractor normalizes them, so SB3 must not preprocess them
+            policy_kwargs["features_extractor_kwargs"]["channels_last"] = True
+            policy_kwargs["normalize_images"] = False
+            policy_class = ChannelsLastActorCriticCnnPolicy if args.alg == "ppo" else ChannelsLastSACPolicy
     else:
+        # low dimensional observations, or image embeddings from a frozen pretrained encoder
         policy_kwargs = dict(net_arch=[128, 128])
         policy_class = "MultiInputPolicy" if args.her else "MlpPolicy"
         
@@ -154,8 +246,12 @@ def setup_model(
         )
     elif args.alg == "sac":
         algorithm = SAC
+        if args.shared_encoder:
+            assert args.visual_observation and args.pretrained_encoder_path is None, "shared_encoder is only meant for image observations"
+            algorithm = SharedEncoderSAC
+            policy_kwargs["share_features_extractor"] = True
         if args.her:
-            model = SAC(
+            model = algorithm(
                 policy_class,
                 env,
                 verbose=1,
@@ -171,7 +267,7 @@ def setup_model(
                 replay_buffer_kwargs=dict(n_sampled_goal=4, goal_selection_strategy='future',)
             )
         else:
-            model = SAC(
+            model = algorithm(
                 policy_class,
                 env,
                 verbose=1,
@@ -209,5 +305,8 @@ def setup_model(
         # model.n_steps = args.n_steps
         # new_logger = configure(save_path, ["tensorboard"])
         # model.set_logger(new_logger)
+
+    if args.compile_policy and args.alg == "ppo":
+        enable_traced_rollouts(model)
     
     return model
\ No newline at end of file
@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+from typing import Optional
+
+import imageio
+import numpy as np
+
+
+class StreamingVideoWriter:
+    """
+    Encodes frames to a video file on a background thread as they are produced.
+    Frames are handed to the encoder through a bounded queue, so memory stays flat and the producer only blocks
+    when encoding falls more than max_queue_size frames behind.
+    """
+    def __init__(self, filename: str, fps: int = 30, max_queue_size: int = 64):
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.filename = filename
+        self.num_frames = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._encode, args=(fps,), daemon=True)
+        self._thread.start()
+
+    def append(self, frame: np.ndarray):
+        """queues a (H, W, C) uint8 frame. The frame is copied, so the caller may reuse its buffer"""
+        if self._error is not None:
+            raise RuntimeError(f"encoding {self.filename} failed") from self._error
+        self._queue.put(np.ascontiguousarray(frame))
+        self.num_frames += 1
+
+    def close(self, wait: bool = True):
+        """
+        signals the end of the video. If wait is False, the remaining queued frames are encoded in the background
+        and the file is complete once join() returns
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        if wait:
+            self.join()
+
+    @property
+    def done(self) -> bool:
+        """whether the encoder thread has finished"""
+        return not self._thread.is_alive()
+
+    def join(self):
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError(f"encoding {self.filename} failed") from self._error
+
+    def _encode(self, fps: int):
+        done = False
+        try:
+            writer = imageio.get_writer(self.filename, fps=fps)
+            try:
+                while not done:
+                    frame = self._queue.get()
+                    done = frame is None
+                    if not done:
+                        writer.append_data(frame)
+            finally:
+                writer.close()
+        except BaseException as e:
+            self._error = e
+            # keep draining so that the producer never blocks on a full queue
+            while not done:
+                done = self._queue.get() is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class EpisodeVideoWriter:
+    """
+    Streams rollout frames to video files while the rollouts are running (see StreamingVideoWriter).
+    Only every frame_stride-th frame of an episode is kept, and with split_episodes every episode is written to its
+    own file (<name>_<episode>.<ext>), so memory use does not grow with the number of evaluated episodes.
+    """
+    def __init__(self, filename: str, fps: int = 60, frame_stride: int = 1, split_episodes: bool = False, max_queue_size: int = 64):
+        assert frame_stride >= 1, "frame_stride must be at least 1"
+        self.filename = filename
+        self.fps = fps
+        self.frame_stride = frame_stride
+        self.split_episodes = split_episodes
+        self.max_queue_size = max_queue_size
+        self.episode = 0
+        self.episode_step = 0
+        self.writer: Optional[StreamingVideoWriter] = None
+        # the previous episode's writer, still encoding its last frames in the background
+        self.finishing: Optional[StreamingVideoWriter] = None
+
+    def episode_filename(self, episode: int) -> str:
+        if not self.split_episodes:
+            return self.filename
+        root, ext = os.path.splitext(self.filename)
+        return f"{root}_{episode:03d}{ext}"
+
+    def add_frame(self, image: np.ndarray):
+        if self.episode_step % self.frame_stride == 0:
+            if self.writer is None:
+                self.writer = StreamingVideoWriter(self.episode_filename(self.episode), fps=self.fps, max_queue_size=self.max_queue_size)
+            self.writer.append(image[::-1])
+        self.episode_step += 1
+
+    def end_episode(self):
+        self.episode += 1
+        self.episode_step = 0
+        if self.split_episodes and self.writer is not None:
+            if self.finishing is not None:
+                self.finishing.join()
+            self.writer.close(wait=False)
+            self.finishing = self.writer
+            self.writer = None
+
+    def close(self):
+        """finishes encoding all the videos"""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.finishing is not None:
+            self.finishing.join()
+            self.finishing = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
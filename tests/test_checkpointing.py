@@ -0,0 +1,96 @@
+# add parent path to sys
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from stable_baselines3 import SAC
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.env_util import make_vec_env
+
+from src.checkpointing import RunStateCheckpointer, restore_run_state, transition_arrays
+
+
+class SaveEvery(BaseCallback):
+    """saves inside on_step, where SB3 already counted the step but has not stored its transition yet"""
+    def __init__(self, checkpointer: RunStateCheckpointer, save_freq: int):
+        super().__init__()
+        self.checkpointer = checkpointer
+        self.save_freq = save_freq
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.save_freq == 0:
+            self.checkpointer.save(self.model)
+        return True
+
+
+def make_model(buffer_size: int):
+    envs = make_vec_env("Pendulum-v1", n_envs=2, seed=0)
+    # no gradient steps, only the replay buffer matters here
+    return SAC("MlpPolicy", envs, buffer_size=buffer_size, learning_starts=10**6, seed=0)
+
+
+@pytest.mark.parametrize("buffer_size, save_freq", [(100, 10), (50, 10), (30, 7), (8, 3)])
+def test_restore_reproduces_buffer_with_in_callback_and_post_learn_saves(tmp_path, buffer_size, save_freq):
+    run_state_dir = str(tmp_path / "run_state")
+    model = make_model(buffer_size)
+    checkpointer = RunStateCheckpointer(run_state_dir, verbose=0)
+    # subtasks that end on total_timesteps, each followed by a save outside of learn like train_curriculum's
+    for total_timesteps in [74, 38, 90]:
+        model.learn(total_timesteps=total_timesteps, callback=SaveEvery(checkpointer, save_freq), reset_num_timesteps=False)
+        checkpointer.save(model)
+    checkpointer.close()
+
+    restored = make_model(buffer_size)
+    restore_run_state(restored, run_state_dir, verbose=0)
+
+    buffer, restored_buffer = model.replay_buffer, restored.replay_buffer
+    assert restored.num_timesteps == model.num_timesteps
+    assert (restored_buffer.pos, restored_buffer.full) == (buffer.pos, buffer.full)
+    filled = buffer.buffer_size if buffer.full else buffer.pos
+    restored_arrays = transition_arrays(restored_buffer)
+    for name, array in transition_arrays(buffer).items():
+        np.testing.assert_array_equal(restored_arrays[name][:filled], array[:filled], err_msg=name)
+
+
+def test_invalidated_buffer_is_written_in_full(tmp_path):
+    run_state_dir = str(tmp_path / "run_state")
+    model = make_model(40)
+    checkpointer = RunStateCheckpointer(run_state_dir, verbose=0)
+    model.learn(total_timesteps=30, callback=SaveEvery(checkpointer, 4), reset_num_timesteps=False)
+    checkpointer.save(model)
+    # stored transitions changed in place, e.g. relabeled rewards
+    model.replay_buffer.rewards[:] += 1.0
+    checkpointer.invalidate_buffer()
+    checkpointer.save(model)
+    checkpointer.close()
+
+    restored = make_model(40)
+    restore_run_state(restored, run_state_dir, verbose=0)
+    filled = model.replay_buffer.pos
+    np.testing.assert_array_equal(restored.replay_buffer.rewards[:filled], model.replay_buffer.rewards[:filled])
+
+
+def test_resumed_checkpointer_continues_the_buffer_chunks(tmp_path):
+    run_state_dir = str(tmp_path / "run_state")
+    model = make_model(60)
+    checkpointer = RunStateCheckpointer(run_state_dir, verbose=0)
+    model.learn(total_timesteps=50, callback=SaveEvery(checkpointer, 6), reset_num_timesteps=False)
+    checkpointer.close()
+
+    # a preempted run: resume from the last in-learn checkpoint with a new checkpointer on the same directory
+    resumed = make_model(60)
+    restore_run_state(resumed, run_state_dir, verbose=0)
+    checkpointer = RunStateCheckpointer(run_state_dir, verbose=0)
+    resumed.learn(total_timesteps=70, callback=SaveEvery(checkpointer, 5), reset_num_timesteps=False)
+    checkpointer.save(resumed)
+    checkpointer.close()
+
+    restored = make_model(60)
+    restore_run_state(restored, run_state_dir, verbose=0)
+    buffer, restored_buffer = resumed.replay_buffer, restored.replay_buffer
+    assert (restored_buffer.pos, restored_buffer.full) == (buffer.pos, buffer.full)
+    restored_arrays = transition_arrays(restored_buffer)
+    for name, array in transition_arrays(buffer).items():
+        np.testing.assert_array_equal(restored_arrays[name], array, err_msg=name)